@@ -365,6 +365,11 @@ using_nfs() {
 #     directory, work directory, JUnit xml file name, and other file/directory paths that are
 #     expected to be unique. This allows to run each test multiple times within the same test suite
 #     run.
+#   YB_TEST_BATCH_ID
+#     If this is set, the gtest-compatible test description is a combined filter of multiple tests
+#     (separated by colons) that are run with one invocation of the test binary, and log paths are
+#     based on "batch_$YB_TEST_BATCH_ID" instead of the potentially very long combined filter. This
+#     is used by run_tests_on_spark.py.
 # Outputs:
 #   rel_test_binary
 #     Relative path of the test binary
@@ -453,6 +458,8 @@ prepare_for_running_test() {
     # Make this similar to the case when we run tests separately. Pretend that the test binary name
     # is the test name.
     rel_test_log_path_prefix+="/${rel_test_binary##*/}"
+  elif [[ -n ${YB_TEST_BATCH_ID:-} ]]; then
+    rel_test_log_path_prefix+="/batch_$YB_TEST_BATCH_ID"
   else
     rel_test_log_path_prefix+="/$test_name_sanitized"
   fi
@@ -781,6 +788,17 @@ set_test_log_url_prefix() {
   fi
 }
 
+# Runs the given command with the file descriptor of the "set -x" trace of run-test.sh closed, if
+# run-test.sh got one from its caller, so that the test and e.g. yb-master / yb-tserver processes
+# it starts don't keep the trace pipe open.
+run_without_xtrace_fd() {
+  if [[ -n ${RUN_TEST_XTRACE_FD:-} ]]; then
+    "$@" {RUN_TEST_XTRACE_FD}>&-
+  else
+    "$@"
+  fi
+}
+
 determine_test_timeout() {
   expect_num_args 0 "$@"
   expect_vars_to_be_set rel_test_binary
@@ -850,14 +868,14 @@ run_one_test() {
         if [[ $STACK_TRACE_FILTER != "cat" ]]; then
           stack_trace_filter_cmd+=( "$abs_test_binary_path" )
         fi
-        ( set -x; "${test_wrapper_cmd_line[@]}" 2>&1 ) | \
+        ( set -x; run_without_xtrace_fd "${test_wrapper_cmd_line[@]}" 2>&1 ) | \
           "${stack_trace_filter_cmd[@]}" | \
           tee "$test_log_path"
         # Propagate the exit code of the test process, not any of the filters. This will only exit
         # this subshell, not the entire script calling this function.
         exit ${PIPESTATUS[0]}
       else
-        "${test_wrapper_cmd_line[@]}" &>"$test_log_path"
+        run_without_xtrace_fd "${test_wrapper_cmd_line[@]}" &>"$test_log_path"
       fi
     )
     test_exit_code=$?
@@ -1334,7 +1352,7 @@ run_java_test() {
   log "Test log path: $test_log_path"
   log
 
-  ( set -x; mvn "${mvn_options[@]}" surefire:test )
+  ( set -x; run_without_xtrace_fd mvn "${mvn_options[@]}" surefire:test )
 
   if is_jenkins || [[ ${YB_REMOVE_SUCCESSFUL_JAVA_TEST_OUTPUT:-} == "1" ]]; then
     # If the test is successful, all expected files exist, and no failures are found in the JUnit
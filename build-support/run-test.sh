@@ -52,7 +52,15 @@ cleanup() {
 }
 
 if [[ ${YB_DEBUG_RUN_TEST:-} == "1" ]]; then
-  log "Running ${0##*/} with 'set -x' for debugging (perhaps it previously failed with no output)."
+  if [[ -n ${BASH_XTRACEFD:-} ]]; then
+    # The caller collects the trace separately and only looks at it if the test fails without any
+    # output, so we don't write anything here. Don't pass the file descriptor to child processes,
+    # see run_without_xtrace_fd in common-test-env.sh.
+    RUN_TEST_XTRACE_FD=$BASH_XTRACEFD
+    export -n BASH_XTRACEFD
+  else
+    log "Running ${0##*/} with 'set -x' for debugging (perhaps it previously failed with no output)."
+  fi
   set -x
 fi
 
@@ -29,23 +29,37 @@ spark-submit --driver-cores 8 \
   --write_report \
   --save_report_to_build_dir
 
+The same tests can be run on one machine without Spark using a pool of local processes:
+
+build-support/run_tests_on_spark.py \
+  --backend local \
+  --build-root build/debug-gcc-dynamic-community \
+  --cpp \
+  --cpp_test_program_regexp '.*redisserver.*'
+
 """
 
 import argparse
+import copy
+import errno
 import getpass
 import glob
 import gzip
+import hashlib
 import json
 import logging
+import multiprocessing
 import os
 import pwd
 import random
 import re
+import shutil
 import socket
 import sys
+import threading
 import time
 import traceback
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 BUILD_SUPPORT_DIR = os.path.dirname(os.path.realpath(__file__))
 YB_PYTHONPATH_ENTRY = os.path.realpath(os.path.join(BUILD_SUPPORT_DIR, '..', 'python'))
@@ -54,6 +68,13 @@ sys.path.append(YB_PYTHONPATH_ENTRY)
 from yb import yb_dist_tests  # noqa
 from yb import command_util  # noqa
 from yb.common_util import set_to_comma_sep_str, get_bool_env_var  # noqa
+from yb.test_reports import get_test_program, get_descriptor_without_attempt_index  # noqa
+from yb.test_reports import DEFAULT_MAX_REPORTS  # noqa
+from yb.test_report_store import load_test_history  # noqa
+from yb.test_result_cache import TestResultCache, DEFAULT_MAX_CACHE_SIZE_MB  # noqa
+from yb.test_listing_cache import TestListingCache  # noqa
+from yb.test_admission import get_total_memory_bytes  # noqa
+from yb.test_admission import DEFAULT_MAX_MEMORY_FRACTION, DEFAULT_MAX_PORTS_PER_HOST  # noqa
 
 
 # Special Jenkins environment variables. They are propagated to tasks running in a distributed way
@@ -109,6 +130,17 @@ ONE_SHOT_TESTS = set([
 
 HASH_COMMENT_RE = re.compile('#.*$')
 
+# Resource profiles, as (CPU cores, memory bytes, number of ports) tuples (see
+# test_admission.ResourceProfile), of tests without historical CPU and memory usage.
+DEFAULT_TEST_RESOURCE_PROFILE = (1.0, 512 * 1024 * 1024, 0)
+DEFAULT_MINI_CLUSTER_TEST_RESOURCE_PROFILE = (2.0, 2 * 1024 * 1024 * 1024, 30)
+
+# C++ test programs that are expected to start mini-clusters. All Java tests are expected to do so.
+MINI_CLUSTER_TEST_PROGRAM_RE = re.compile(r'^tests-integration-tests/|itest|cluster')
+
+# Extensions of the source files that Java and Scala test descriptors point to.
+JVM_TEST_SOURCE_EXTENSIONS = ('.java', '.scala')
+
 # Number of failures of any particular task before giving up on the job. The total number of
 # failures spread across different tasks will not cause the job to fail; a particular task has to
 # fail this number of attempts. Should be greater than or equal to 1. Number of allowed retries =
@@ -117,6 +149,59 @@ SPARK_TASK_MAX_FAILURES = 100
 
 verbose = False
 
+# Whether to run batched tests of the same C++ test program with one invocation of that program.
+combine_gtest_filters = False
+
+# Where to run tests, see SparkBackend and LocalBackend.
+execution_backend = None
+
+# Arguments of test_admission.get_host_capacity, or None to start tests without admission control.
+admission_control_conf = None
+# Test descriptor string without the attempt index -> resource profile tuple, see
+# get_resource_profiles.
+resource_profiles = {}
+# Descriptor strings of tests that should run with no other tests on their host, e.g. retries of
+# failed tests with --isolate_retries.
+isolated_tests = set()
+
+# A directory on the shared file system for marker files of tests that may be run speculatively,
+# see StragglerMonitor, or None if stragglers are not run speculatively.
+speculation_dir = None
+# Arguments of StragglerMonitor, only used by the driver.
+speculation_conf = None
+
+DEFAULT_MAX_PARALLEL_RETRIES = 4
+
+DEFAULT_STRAGGLER_P95_MULTIPLIER = 2.0
+DEFAULT_MIN_STRAGGLER_TIME_SEC = 60
+DEFAULT_MAX_SPECULATIVE_COPIES = 10
+STRAGGLER_CHECK_INTERVAL_SEC = 5
+
+# Which copy of a test passed first, see StragglerMonitor.
+ORIGINAL_COPY = 'original'
+SPECULATIVE_COPY = 'speculative_copy'
+
+# Appended to YB_TEST_LOG_ROOT_SUFFIX for speculative copies of tests, so that their logs and
+# temporary directories are separate from those of the original.
+SPECULATIVE_COPY_LOG_ROOT_SUFFIX = '__speculative_copy'
+
+# Suffixes of marker files in speculation_dir. A test running for the first time creates the
+# "started" marker, and the copy of the test that passes first creates the "winner" marker.
+STARTED_MARKER_SUFFIX = '.started'
+WINNER_MARKER_SUFFIX = '.winner'
+
+SPARK_BACKEND = 'spark'
+LOCAL_BACKEND = 'local'
+
+DEFAULT_LOCAL_WORKER_MEMORY_GB = 2.0
+
+# Waiting for results of a multiprocessing pool with a timeout, unlike without one, can be
+# interrupted with Ctrl+C.
+LOCAL_BACKEND_TIMEOUT_SEC = 7 * 24 * 3600
+
+STREAMED_RESULTS_POLL_INTERVAL_SEC = 1
+PROGRESS_LOGGING_INTERVAL_SEC = 60
+
 
 # Initializes the spark context. The details list will be incorporated in the Spark application
 # name visible in the Spark web UI.
@@ -152,6 +237,211 @@ def init_spark_context(details=[]):
     spark_context.addPyFile(yb_dist_tests.__file__)
 
 
+def get_list_accumulator_param():
+    from pyspark.accumulators import AccumulatorParam
+
+    class ListAccumulatorParam(AccumulatorParam):
+        def zero(self, value):
+            return []
+
+        def addInPlace(self, value1, value2):
+            # Extending the list in place lets the driver read it while updates arrive.
+            value1.extend(value2)
+            return value1
+
+    return ListAccumulatorParam()
+
+
+class SparkBackend:
+    """
+    Runs functions such as parallel_run_tests and parallel_list_test_descriptors as Spark tasks.
+    """
+    def __init__(self):
+        self.name = SPARK_BACKEND
+        self.cancelled = False
+
+    def init(self, app_name_details):
+        init_spark_context(app_name_details)
+        set_global_conf_for_spark_jobs()
+
+    def map(self, func, items, num_slices=None, on_result=None):
+        """
+        @param num_slices the number of Spark tasks to split the items into, by default one task
+                          per item. Tasks are started in the order of the items.
+        @param on_result an optional function to call with the result of every item as soon as the
+                         task computing it finishes, from a separate thread
+        @return results of calling the given function on every item, in the order of the items,
+                or only on the items that were done if cancel was called
+        """
+        if self.cancelled:
+            return []
+        if not on_result:
+            return run_spark_action(lambda: spark_context.parallelize(
+                items, numSlices=num_slices or len(items)).map(func).collect())
+
+        # Results of tasks are sent to the driver through an accumulator, which Spark updates as
+        # every task finishes, unlike the results of collect. toLocalIterator would give us results
+        # incrementally too, but it runs one job per partition, one after another.
+        results_accumulator = spark_context.accumulator([], get_list_accumulator_param())
+
+        def run_and_add_result(indexed_item):
+            index, item = indexed_item
+            results_accumulator.add([(index, func(item))])
+
+        all_results_received = threading.Event()
+
+        def poll_results():
+            num_results_seen = 0
+            while True:
+                done = all_results_received.wait(STREAMED_RESULTS_POLL_INTERVAL_SEC)
+                indexed_results = results_accumulator.value
+                for index, result in indexed_results[num_results_seen:len(indexed_results)]:
+                    on_result(result)
+                    num_results_seen += 1
+                if done:
+                    break
+
+        poll_thread = threading.Thread(target=poll_results)
+        poll_thread.start()
+        try:
+            run_spark_action(lambda: spark_context.parallelize(
+                list(enumerate(items)),
+                numSlices=num_slices or len(items)).foreach(run_and_add_result))
+        except Exception:
+            if not self.cancelled:
+                raise
+            logging.info("Spark jobs have been cancelled")
+        finally:
+            all_results_received.set()
+            poll_thread.join()
+        return [result for index, result in sorted(results_accumulator.value)]
+
+    def run_in_spare_worker(self, func, item):
+        """
+        Runs the given function on the given item as a separate Spark job, on whatever executor is
+        free.
+
+        @return the result of the function, or None if cancel was called
+        """
+        results = self.map(func, [item])
+        return results[0] if results else None
+
+    def cancel(self):
+        """
+        Cancels all running Spark jobs, and makes map do nothing from now on.
+        """
+        self.cancelled = True
+        spark_context.cancelAllJobs()
+
+
+def call_with_index(func_index_and_item):
+    func, index, item = func_index_and_item
+    return index, func(item)
+
+
+class LocalBackend:
+    """
+    Runs the same functions as SparkBackend in a pool of processes on the local machine, e.g. for
+    developers and small CI workers without a Spark cluster.
+    """
+    def __init__(self, num_workers):
+        self.name = LOCAL_BACKEND
+        self.num_workers = num_workers
+        self.cancelled = False
+        # The process pool of the map call in progress, and an event set once it has been shut
+        # down, used by run_in_spare_worker.
+        self.pool_lock = threading.Lock()
+        self.pool = None
+        self.pool_done_event = None
+
+    def init(self, app_name_details):
+        set_global_conf_for_spark_jobs()
+        logging.info("Using {} local worker processes ({})".format(
+            self.num_workers, ', '.join(app_name_details)))
+
+    def map(self, func, items, num_slices=None, on_result=None):
+        """
+        See SparkBackend.map. Here, on_result is called from the calling thread.
+        """
+        if not items or self.cancelled:
+            return []
+        # Worker processes are forked, so they inherit global variables such as global_conf_dict.
+        # Items are handed out one at a time in their order, the same as with Spark.
+        pool = multiprocessing.Pool(min(self.num_workers, len(items)))
+        pool_done_event = threading.Event()
+        with self.pool_lock:
+            self.pool = pool
+            self.pool_done_event = pool_done_event
+        results_by_index = {}
+        try:
+            deadline_sec = time.time() + LOCAL_BACKEND_TIMEOUT_SEC
+            indexed_results = pool.imap_unordered(
+                call_with_index,
+                [(func, index, item) for index, item in enumerate(items)],
+                chunksize=1)
+            while len(results_by_index) < len(items) and not self.cancelled:
+                index, result = indexed_results.next(max(0, deadline_sec - time.time()))
+                results_by_index[index] = result
+                if on_result:
+                    on_result(result)
+            with self.pool_lock:
+                self.pool = None
+            if self.cancelled:
+                logging.info("Killing local worker processes, as tests have been cancelled")
+                pool.terminate()
+            else:
+                pool.close()
+        except:  # noqa
+            with self.pool_lock:
+                self.pool = None
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            pool_done_event.set()
+        return [results_by_index[index] for index in sorted(results_by_index)]
+
+    def run_in_spare_worker(self, func, item):
+        """
+        Runs the given function on the given item in the process pool of the map call in progress,
+        e.g. from another thread, so that the total number of processes stays within num_workers.
+        The pool takes up the item after all items of the map call have been started, i.e. once
+        one of its workers has nothing else to do.
+
+        @return the result of the function, or None if no map call is in progress, or if its pool
+                was killed before the function finished
+        """
+        with self.pool_lock:
+            if self.pool is None:
+                return None
+            async_result = self.pool.apply_async(func, (item,))
+            pool_done_event = self.pool_done_event
+        while not async_result.ready():
+            if pool_done_event.wait(STRAGGLER_CHECK_INTERVAL_SEC):
+                # Once the pool is shut down, the function has either finished or been killed.
+                break
+        return async_result.get() if async_result.ready() else None
+
+    def cancel(self):
+        """
+        Makes map stop waiting for results and kill the worker processes, and do nothing from now
+        on. Tests that the worker processes have started are left to finish on their own.
+        """
+        self.cancelled = True
+
+
+def get_default_num_local_workers(worker_memory_gb):
+    """
+    @return the number of tests to run in parallel on this machine: one per CPU, but no more than
+            fit into physical memory if every test needs worker_memory_gb
+    """
+    num_workers = multiprocessing.cpu_count()
+    total_memory_bytes = get_total_memory_bytes()
+    if total_memory_bytes and worker_memory_gb:
+        num_workers = min(num_workers, int(total_memory_bytes / (worker_memory_gb * 1024 ** 3)))
+    return max(1, num_workers)
+
+
 def adjust_pythonpath():
     if YB_PYTHONPATH_ENTRY not in sys.path:
         sys.path.append(YB_PYTHONPATH_ENTRY)
@@ -162,61 +452,342 @@ def set_global_conf_for_spark_jobs():
     global_conf_dict = vars(yb_dist_tests.global_conf)
 
 
-def parallel_run_test(test_descriptor_str):
+def init_test_task():
     """
-    This is invoked in parallel to actually run tests.
+    Prepares a Spark task for running tests. Only has to be done once per task, even if the task
+    runs multiple tests.
     """
     adjust_pythonpath()
-    from yb import yb_dist_tests, command_util
+    from yb import yb_dist_tests
 
     global_conf = yb_dist_tests.set_global_conf_from_dict(global_conf_dict)
     global_conf.set_env(propagated_env_vars)
     yb_dist_tests.global_conf = global_conf
-    test_descriptor = yb_dist_tests.TestDescriptor(test_descriptor_str)
-    os.environ['YB_TEST_ATTEMPT_INDEX'] = str(test_descriptor.attempt_index)
     os.environ['build_type'] = global_conf.build_type
 
     yb_dist_tests.wait_for_clock_sync()
 
-    # We could use "run_program" here, but it collects all the output in memory, which is not
-    # ideal for a large amount of test log output. The "tee" part also makes the output visible in
-    # the standard error of the Spark task as well, which is sometimes helpful for debugging.
-    def run_test():
-        start_time = time.time()
-        exit_code = os.system(
-            "bash -c 'set -o pipefail; \"{}\" {} 2>&1 | tee \"{}\"; {}'".format(
-                    global_conf.get_run_test_script_path(),
-                    test_descriptor.args_for_run_test,
-                    test_descriptor.error_output_path,
-                    'exit ${PIPESTATUS[0]}')) >> 8
-        # The ">> 8" is to get the exit code returned by os.system() in the high 8 bits of the
-        # result.
-        elapsed_time_sec = time.time() - start_time
-        logging.info("Test {} ran on {}, rc={}".format(
-            test_descriptor, socket.gethostname(), exit_code))
-        return exit_code, elapsed_time_sec
-
-    exit_code, elapsed_time_sec = run_test()
-    error_output_path = test_descriptor.error_output_path
-
-    failed_without_output = False
-    if os.path.isfile(error_output_path) and os.path.getsize(error_output_path) == 0:
-        if exit_code == 0:
-            # Test succeeded, no error output.
-            os.remove(error_output_path)
-        else:
-            # Test failed without any output! Re-run with "set -x" to diagnose.
-            os.environ['YB_DEBUG_RUN_TEST'] = '1'
-            exit_code, elapsed_time_sec = run_test()
-            del os.environ['YB_DEBUG_RUN_TEST']
-            # Also mark this in test results.
-            failed_without_output = True
+
+def admit_tests(test_descriptors):
+    """
+    @return a context manager that waits until this host has the resources to run the given tests
+            one after another, and keeps the resources reserved while they run
+    """
+    from yb import test_admission
+
+    if not admission_control_conf:
+        return test_admission.no_admission_control()
+    capacity = test_admission.get_host_capacity(**admission_control_conf)
+    profiles = [
+        test_admission.ResourceProfile(*resource_profiles.get(
+            test_descriptor.descriptor_str_without_attempt_index, DEFAULT_TEST_RESOURCE_PROFILE))
+        for test_descriptor in test_descriptors]
+    if any(test_descriptor.descriptor_str in isolated_tests
+           for test_descriptor in test_descriptors):
+        # Reserving the whole host makes us wait until no other tests run there, and keeps other
+        # tests from starting.
+        profiles.append(capacity)
+    controller = test_admission.HostAdmissionController(capacity)
+    description = str(test_descriptors[0])
+    if len(test_descriptors) > 1:
+        description += ' and {} more tests'.format(len(test_descriptors) - 1)
+    return controller.admit(test_admission.get_max_profile(profiles), description)
+
+
+def run_test_script(args_for_run_test, error_output_path, extra_env={}, should_cancel=None):
+    """
+    Runs run-test.sh with the given arguments, streaming its output to error_output_path,
+    gzip-compressed. run-test.sh runs with "set -x", but the trace goes to a separate pipe (see
+    BASH_XTRACEFD in run-test.sh), of which only the end is kept in memory, and saved in place of
+    the output if the test fails without any output. That way we don't have to run the test again
+    to diagnose such failures.
+
+    @param should_cancel see command_util.run_program_with_output_file
+    @return a command_util.StreamedProgramResult
+    """
+    from yb import yb_dist_tests, command_util
+
+    command_util.mkdir_p(os.path.dirname(error_output_path))
+    env = dict(os.environ, YB_DEBUG_RUN_TEST='1')
+    env.update(extra_env)
+    result = command_util.run_program_with_output_file(
+        ['bash', yb_dist_tests.global_conf.get_run_test_script_path()] +
+        args_for_run_test.split(),
+        error_output_path,
+        env=env,
+        should_cancel=should_cancel,
+        trace_env_var='BASH_XTRACEFD')
+    if result.returncode != 0 and result.num_output_bytes == 0 and not result.cancelled:
+        with gzip.open(error_output_path, 'wb') as error_output_file:
+            error_output_file.write(
+                "run-test.sh failed without any output, the last {} bytes of its 'set -x' trace "
+                "follow\n".format(len(result.trace_tail)))
+            error_output_file.write(result.trace_tail)
+
+    if result.returncode != 0 and result.output_tail and not result.cancelled:
+        # This used to be visible in the standard error of the Spark task for all tests, and is
+        # sometimes helpful for debugging.
+        logging.info("Last {} bytes of output of run-test.sh {}:\n{}".format(
+            len(result.output_tail), args_for_run_test, result.output_tail))
+    return result
+
+
+def get_speculation_marker_path(test_descriptor_str, suffix):
+    return os.path.join(speculation_dir, hashlib.md5(test_descriptor_str).hexdigest() + suffix)
+
+
+def claim_speculation_win(test_descriptor_str, copy_name):
+    """
+    Creates the winner marker of the given test, unless the other copy of the test has already
+    created it.
+
+    @return whether this copy of the test passed first
+    """
+    try:
+        fd = os.open(get_speculation_marker_path(test_descriptor_str, WINNER_MARKER_SUFFIX),
+                     os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+        return False
+    with os.fdopen(fd, 'w') as winner_marker_file:
+        winner_marker_file.write(copy_name)
+    return True
+
+
+def run_single_test(test_descriptor, speculative_copy=False):
+    """
+    @param speculative_copy whether this is a speculative copy of a test that is still running
+                            elsewhere, see StragglerMonitor
+    """
+    from yb import yb_dist_tests
+
+    os.environ['YB_TEST_ATTEMPT_INDEX'] = str(test_descriptor.attempt_index)
+
+    extra_env = {}
+    if speculative_copy:
+        log_root_suffix = (os.environ.get('YB_TEST_LOG_ROOT_SUFFIX', '') +
+                           SPECULATIVE_COPY_LOG_ROOT_SUFFIX)
+        extra_env['YB_TEST_LOG_ROOT_SUFFIX'] = log_root_suffix
+        test_descriptor = copy.copy(test_descriptor)
+        test_descriptor.error_output_path = os.path.join(
+            yb_dist_tests.global_conf.build_root, 'yb-test-logs' + log_root_suffix,
+            os.path.basename(test_descriptor.error_output_path))
+
+    # Java tests of the same module cannot run concurrently in the same build root, so we only
+    # run C++ tests speculatively.
+    speculation = speculation_dir and not test_descriptor.is_jvm_based
+    should_cancel = None
+    with admit_tests([test_descriptor]):
+        if speculation:
+            winner_marker_path = get_speculation_marker_path(
+                test_descriptor.descriptor_str, WINNER_MARKER_SUFFIX)
+
+            def should_cancel():
+                return os.path.exists(winner_marker_path)
+
+            started_marker_path = get_speculation_marker_path(
+                test_descriptor.descriptor_str, STARTED_MARKER_SUFFIX)
+            if not speculative_copy:
+                with open(started_marker_path, 'w') as started_marker_file:
+                    json.dump(dict(descriptor_str=test_descriptor.descriptor_str,
+                                   host=socket.gethostname(),
+                                   start_time_sec=time.time()),
+                              started_marker_file)
+        try:
+            result = run_test_script(
+                test_descriptor.args_for_run_test, test_descriptor.error_output_path,
+                extra_env=extra_env, should_cancel=should_cancel)
+        finally:
+            if speculation and not speculative_copy:
+                # Otherwise StragglerMonitor would keep running copies of a test that is not
+                # running anymore.
+                os.remove(started_marker_path)
+    copy_description = ' (speculative copy)' if speculative_copy else ''
+    if result.cancelled:
+        logging.info("Test {}{} was killed on {} as the other copy of it passed".format(
+            test_descriptor, copy_description, socket.gethostname()))
+    else:
+        logging.info("Test {}{} ran on {}, rc={}".format(
+            test_descriptor, copy_description, socket.gethostname(), result.returncode))
+    if speculation:
+        # A copy that fails, e.g. because of a port conflict or a crash, lets the other copy run to
+        # completion, so the test only fails if both copies fail.
+        if result.returncode == 0 and not result.cancelled:
+            claim_speculation_win(test_descriptor.descriptor_str,
+                                  SPECULATIVE_COPY if speculative_copy else ORIGINAL_COPY)
+
+    if result.returncode == 0 and result.num_output_bytes == 0:
+        # Test succeeded, no error output.
+        os.remove(test_descriptor.error_output_path)
 
     return yb_dist_tests.TestResult(
-            exit_code=exit_code,
+            exit_code=result.returncode,
+            test_descriptor=test_descriptor,
+            elapsed_time_sec=result.elapsed_time_sec,
+            failed_without_output=result.returncode != 0 and result.num_output_bytes == 0,
+            cpu_time_sec=result.cpu_time_sec,
+            max_rss_bytes=result.max_rss_bytes,
+            host=socket.gethostname(),
+            speculation_winner=None)
+
+
+def run_gtest_batch(test_descriptors):
+    """
+    Runs multiple tests of the same C++ test program, with the same attempt index, using one
+    invocation of the test program with a combined --gtest_filter. Per-test results are recovered
+    from the Google Test output. Tests that did not get to run, e.g. because the test program
+    crashed before them, are run separately.
+
+    @return a list of TestResults
+    """
+    from yb import yb_dist_tests
+
+    global_conf = yb_dist_tests.global_conf
+    first_test = test_descriptors[0]
+    rel_test_binary = first_test.rel_test_binary
+    gtest_filter = ':'.join(test_descriptor.test_name for test_descriptor in test_descriptors)
+    batch_id = hashlib.sha1(gtest_filter).hexdigest()[:16]
+    batch_name = '{}{}batch_{}'.format(
+        rel_test_binary, yb_dist_tests.TEST_DESCRIPTOR_SEPARATOR, batch_id)
+
+    # These paths must match what prepare_for_running_test in common-test-env.sh does when
+    # YB_TEST_BATCH_ID is set.
+    log_name = 'batch_' + batch_id
+    if first_test.attempt_index > 1:
+        log_name += '__attempt_%d' % first_test.attempt_index
+    test_log_path = os.path.join(
+        global_conf.build_root,
+        'yb-test-logs' + os.environ.get('YB_TEST_LOG_ROOT_SUFFIX', ''),
+        yb_dist_tests.sanitize_for_path(rel_test_binary),
+        log_name + '.log')
+    error_output_path = os.path.join(
+        global_conf.build_root, 'yb-test-logs',
+        rel_test_binary.replace('/', '__') + '__' + log_name + '__error.log.gz')
+
+    os.environ['YB_TEST_ATTEMPT_INDEX'] = str(first_test.attempt_index)
+    os.environ['YB_TEST_BATCH_ID'] = batch_id
+    try:
+        with admit_tests(test_descriptors):
+            script_result = run_test_script(
+                '{} {}'.format(os.path.join(global_conf.build_root, rel_test_binary),
+                               gtest_filter),
+                error_output_path)
+    finally:
+        del os.environ['YB_TEST_BATCH_ID']
+    exit_code = script_result.returncode
+    elapsed_time_sec = script_result.elapsed_time_sec
+    logging.info("Batch of {} tests {} ran on {}, rc={}".format(
+        len(test_descriptors), batch_name, socket.gethostname(), exit_code))
+
+    gtest_results = {}
+    if os.path.isfile(test_log_path):
+        with open(test_log_path) as test_log_file:
+            gtest_results = yb_dist_tests.parse_gtest_output(test_log_file)
+
+    # The output of a failed batch is kept, and the logs of its failed tests refer to it, so that
+    # we don't have to keep possibly large output in memory or copy it for every failed test.
+    if exit_code == 0 and script_result.num_output_bytes == 0:
+        os.remove(error_output_path)
+
+    # If the test program failed but none of the tests did according to its output, e.g. because of
+    # a sanitizer error at exit, we cannot tell which test is responsible.
+    failure_attributed = exit_code == 0 or any(
+        not passed for passed, test_elapsed_time_sec in gtest_results.values())
+
+    results = []
+    tests_to_run_separately = []
+    for test_descriptor in test_descriptors:
+        passed, test_elapsed_time_sec = gtest_results.get(test_descriptor.test_name, (None, None))
+        if exit_code == 0:
+            passed = True
+        elif passed is None:
+            tests_to_run_separately.append(test_descriptor)
+            continue
+        elif not failure_attributed:
+            passed = False
+        if test_elapsed_time_sec is None:
+            test_elapsed_time_sec = elapsed_time_sec / len(test_descriptors)
+
+        if not passed:
+            with gzip.open(test_descriptor.error_output_path, 'wb') as test_error_output_file:
+                test_error_output_file.write(
+                    "This test ran as part of a batch of {} tests of {} using a combined "
+                    "--gtest_filter. Output of the whole batch: {}\n"
+                    "Test log: {}\n".format(len(test_descriptors), rel_test_binary,
+                                            error_output_path, test_log_path))
+
+        # Only the total CPU time of the batch is known, and the memory usage of the batch is an
+        # upper bound of that of every test in it.
+        results.append(yb_dist_tests.TestResult(
+            exit_code=0 if passed else exit_code,
             test_descriptor=test_descriptor,
-            elapsed_time_sec=elapsed_time_sec,
-            failed_without_output=failed_without_output)
+            elapsed_time_sec=test_elapsed_time_sec,
+            failed_without_output=not passed and script_result.num_output_bytes == 0,
+            cpu_time_sec=script_result.cpu_time_sec * min(
+                1.0, test_elapsed_time_sec / elapsed_time_sec) if elapsed_time_sec > 0 else None,
+            max_rss_bytes=script_result.max_rss_bytes,
+            host=socket.gethostname(),
+            speculation_winner=None))
+
+    if tests_to_run_separately:
+        logging.info("{} tests of the batch {} did not run, running them separately".format(
+            len(tests_to_run_separately), batch_name))
+        results += [run_single_test(test_descriptor)
+                    for test_descriptor in tests_to_run_separately]
+    return results
+
+
+def parallel_run_speculative_copy(test_descriptor_str):
+    """
+    This is invoked by StragglerMonitor to run a copy of a test that is taking too long.
+
+    @return the result of the copy, or None if the original copy has finished in the meantime,
+            e.g. while this one was waiting for a free worker
+    """
+    if not os.path.exists(get_speculation_marker_path(test_descriptor_str, STARTED_MARKER_SUFFIX)):
+        return None
+    init_test_task()
+    from yb import yb_dist_tests
+
+    return run_single_test(yb_dist_tests.TestDescriptor(test_descriptor_str),
+                           speculative_copy=True)
+
+
+def parallel_run_test(test_descriptor_str):
+    """
+    This is invoked in parallel to actually run tests.
+    """
+    init_test_task()
+    from yb import yb_dist_tests
+
+    return run_single_test(yb_dist_tests.TestDescriptor(test_descriptor_str))
+
+
+def parallel_run_tests(test_descriptor_strs):
+    """
+    Runs a batch of tests one after another in the same Spark task. With --combine_gtest_filters,
+    tests of the same C++ test program are run with one invocation of that program.
+    """
+    init_test_task()
+    from yb import yb_dist_tests
+
+    tests_by_group = OrderedDict()
+    for test_descriptor_str in test_descriptor_strs:
+        test_descriptor = yb_dist_tests.TestDescriptor(test_descriptor_str)
+        group_key = test_descriptor_str
+        if (combine_gtest_filters and test_descriptor.test_name and
+                test_descriptor_str not in isolated_tests):
+            group_key = (test_descriptor.rel_test_binary, test_descriptor.attempt_index)
+        tests_by_group.setdefault(group_key, []).append(test_descriptor)
+
+    results = []
+    for test_descriptors in tests_by_group.values():
+        if len(test_descriptors) > 1:
+            results += run_gtest_batch(test_descriptors)
+        else:
+            results.append(run_single_test(test_descriptors[0]))
+    return results
 
 
 def parallel_list_test_descriptors(rel_test_path):
@@ -317,16 +888,50 @@ def save_json_to_paths(short_description, json_data, output_paths, should_gzip=F
             "Expected output path to end with .json: {}".format(output_path)
         final_output_path = output_path + ('.gz' if should_gzip else '')
         logging.info("Saving {} to {}".format(short_description, final_output_path))
+        # Other test runs load reports from the same directory, so never let them see partial
+        # files, e.g. if this run is killed while saving the report.
+        tmp_path = '%s.tmp.%d' % (final_output_path, os.getpid())
         if should_gzip:
-            with gzip.open(final_output_path, 'wb') as output_file:
+            with gzip.open(tmp_path, 'wb') as output_file:
                 output_file.write(json_data_str)
         else:
-            with open(final_output_path, 'w') as output_file:
+            with open(tmp_path, 'w') as output_file:
                 output_file.write(json_data_str)
+        os.rename(tmp_path, final_output_path)
+
+
+def get_test_report_dict(result, flakiness_scores=None):
+    """
+    @return the report of one test for the full build report
+    """
+    test_descriptor = result.test_descriptor
+    test_report_dict = dict(
+        elapsed_time_sec=result.elapsed_time_sec,
+        exit_code=result.exit_code,
+        language=test_descriptor.language
+    )
+    if result.cpu_time_sec is not None:
+        test_report_dict['cpu_time_sec'] = result.cpu_time_sec
+    if result.max_rss_bytes is not None:
+        test_report_dict['max_rss_bytes'] = result.max_rss_bytes
+    if result.host:
+        test_report_dict['host'] = result.host
+    if result.speculation_winner:
+        test_report_dict['speculation_winner'] = result.speculation_winner
+    if flakiness_scores:
+        test_report_dict['flakiness_score'] = flakiness_scores.get(
+            test_descriptor.descriptor_str_without_attempt_index, 0.0)
+    if test_descriptor.error_output_path and os.path.isfile(test_descriptor.error_output_path):
+        test_report_dict['error_output_path'] = test_descriptor.error_output_path
+    return test_report_dict
 
 
 def save_report(report_base_dir, results, total_elapsed_time_sec, spark_succeeded,
-                save_to_build_dir=False):
+                save_to_build_dir=False, flakiness_scores=None):
+    """
+    @param flakiness_scores an optional dictionary mapping descriptor strings of tests without
+                            attempt indexes to flakiness scores, see get_flakiness_scores
+    """
     global_conf = yb_dist_tests.global_conf
 
     if report_base_dir:
@@ -351,15 +956,8 @@ def save_report(report_base_dir, results, total_elapsed_time_sec, spark_succeede
 
     test_reports_by_descriptor = {}
     for result in results:
-        test_descriptor = result.test_descriptor
-        test_report_dict = dict(
-            elapsed_time_sec=result.elapsed_time_sec,
-            exit_code=result.exit_code,
-            language=test_descriptor.language
-        )
-        test_reports_by_descriptor[test_descriptor.descriptor_str] = test_report_dict
-        if test_descriptor.error_output_path and os.path.isfile(test_descriptor.error_output_path):
-            test_report_dict['error_output_path'] = test_descriptor.error_output_path
+        test_reports_by_descriptor[result.test_descriptor.descriptor_str] = get_test_report_dict(
+            result, flakiness_scores)
 
     jenkins_env_var_values = {}
     for jenkins_env_var_name in JENKINS_ENV_VARS:
@@ -394,35 +992,44 @@ def is_one_shot_test(rel_binary_path):
     return False
 
 
-def collect_cpp_tests(max_tests, cpp_test_program_filter, cpp_test_program_re_str):
+def collect_cpp_tests(max_tests, cpp_test_program_filter, cpp_test_program_re_str,
+                      test_listing_cache):
     """
     Collect C++ test programs to run.
     @param max_tests: maximum number of tests to run. Used in debugging.
     @param cpp_test_program_filter: a collection of C++ test program names to be used as a filter
     @param cpp_test_program_re_str: a regular expression string to be used as a filter for the set
                                     of C++ test programs.
+    @param test_listing_cache: a TestListingCache with lists of test programs and tests from
+                               previous runs. Updated with the lists collected here.
     """
 
     global_conf = yb_dist_tests.global_conf
     logging.info("Collecting the list of C++ test programs")
     start_time_sec = time.time()
-    ctest_cmd_result = command_util.run_program(
-            ['/bin/bash',
-             '-c',
-             'cd "{}" && YB_LIST_CTEST_TESTS_ONLY=1 ctest -j8 --verbose'.format(
-                global_conf.build_root)])
-    test_programs = []
-
-    for line in ctest_cmd_result.stdout.split("\n"):
-        re_match = CTEST_TEST_PROGRAM_RE.match(line)
-        if re_match:
-            rel_ctest_prog_path = os.path.relpath(re_match.group(1), global_conf.build_root)
-            test_programs.append(rel_ctest_prog_path)
-
-    test_programs = sorted(set(test_programs))
-    elapsed_time_sec = time.time() - start_time_sec
-    logging.info("Collected %d test programs in %.2f sec" % (
-        len(test_programs), elapsed_time_sec))
+    test_programs = test_listing_cache.get_test_programs()
+    if test_programs is not None:
+        logging.info("Using the cached list of %d test programs, CTest files have not changed" %
+                     len(test_programs))
+    else:
+        ctest_cmd_result = command_util.run_program(
+                ['/bin/bash',
+                 '-c',
+                 'cd "{}" && YB_LIST_CTEST_TESTS_ONLY=1 ctest -j8 --verbose'.format(
+                    global_conf.build_root)])
+        test_programs = []
+
+        for line in ctest_cmd_result.stdout.split("\n"):
+            re_match = CTEST_TEST_PROGRAM_RE.match(line)
+            if re_match:
+                rel_ctest_prog_path = os.path.relpath(re_match.group(1), global_conf.build_root)
+                test_programs.append(rel_ctest_prog_path)
+
+        test_programs = sorted(set(test_programs))
+        test_listing_cache.set_test_programs(test_programs)
+        elapsed_time_sec = time.time() - start_time_sec
+        logging.info("Collected %d test programs in %.2f sec" % (
+            len(test_programs), elapsed_time_sec))
 
     if cpp_test_program_re_str:
         cpp_test_program_re = re.compile(cpp_test_program_re_str)
@@ -475,30 +1082,42 @@ def collect_cpp_tests(max_tests, cpp_test_program_filter, cpp_test_program_re_st
                     len(fine_granularity_gtest_programs),
                     len(one_shot_test_programs)))
 
-    test_programs = fine_granularity_gtest_programs
+    cached_test_descriptor_strs = []
+    test_programs = []
+    for test_program in fine_granularity_gtest_programs:
+        cached_tests = test_listing_cache.get_tests(test_program)
+        if cached_tests is None:
+            test_programs.append(test_program)
+        else:
+            cached_test_descriptor_strs += cached_tests
     logging.info(
-        "Collecting gtest tests for {} test programs where tests will be run separately".format(
-            len(test_programs)))
+        ("Collecting gtest tests for {} test programs where tests will be run separately, "
+         "using cached lists of tests for {} more test programs that have not changed").format(
+            len(test_programs), len(fine_granularity_gtest_programs) - len(test_programs)))
 
     start_time_sec = time.time()
 
-    all_test_programs = fine_granularity_gtest_programs + one_shot_test_programs
-    if len(all_test_programs) <= 5:
-        app_name_details = ['test programs: [{}]'.format(', '.join(all_test_programs))]
-    else:
-        app_name_details = ['{} test programs'.format(len(all_test_programs))]
+    all_test_descriptor_lists = []
+    if test_programs:
+        all_test_programs = fine_granularity_gtest_programs + one_shot_test_programs
+        if len(all_test_programs) <= 5:
+            app_name_details = ['test programs: [{}]'.format(', '.join(all_test_programs))]
+        else:
+            app_name_details = ['{} test programs'.format(len(all_test_programs))]
 
-    init_spark_context(app_name_details)
-    set_global_conf_for_spark_jobs()
+        execution_backend.init(app_name_details)
+
+        # Use fewer "slices" (tasks) than there are test programs, in hope to get some batching.
+        num_slices = (len(test_programs) + 1) / 2
+        all_test_descriptor_lists = execution_backend.map(
+            parallel_list_test_descriptors, test_programs, num_slices)
+        for test_program, test_descriptor_str_list in zip(test_programs,
+                                                          all_test_descriptor_lists):
+            test_listing_cache.set_tests(test_program, test_descriptor_str_list)
+    test_listing_cache.save()
 
-    # Use fewer "slices" (tasks) than there are test programs, in hope to get some batching.
-    num_slices = (len(test_programs) + 1) / 2
-    all_test_descriptor_lists = run_spark_action(
-        lambda: spark_context.parallelize(
-            test_programs, numSlices=num_slices).map(parallel_list_test_descriptors).collect()
-    )
     elapsed_time_sec = time.time() - start_time_sec
-    test_descriptor_strs = one_shot_test_programs + [
+    test_descriptor_strs = one_shot_test_programs + cached_test_descriptor_strs + [
         test_descriptor_str
         for test_descriptor_str_list in all_test_descriptor_lists
         for test_descriptor_str in test_descriptor_str_list]
@@ -508,6 +1127,591 @@ def collect_cpp_tests(max_tests, cpp_test_program_filter, cpp_test_program_re_st
     return [yb_dist_tests.TestDescriptor(s) for s in test_descriptor_strs]
 
 
+def prioritize_cpp_tests(cpp_test_descriptors, test_priorities, time_budget_sec=None):
+    """
+    Orders C++ tests so that tests of the most relevant test programs, according to the priorities
+    computed by dependency_graph.py, come first. Test programs not mentioned in the priorities go
+    last.
+
+    @param test_priorities a list of dictionaries with "test_program" basenames and optionally
+                           "expected_time_sec", most relevant first
+    @param time_budget_sec if specified, only keep test programs, in the order of priority, while
+                           their total expected running time fits into this budget. Test programs
+                           without historical running times are assumed to take the average time
+                           of the others.
+    """
+    priority_by_basename = {}
+    for rank, priority in enumerate(test_priorities):
+        priority_by_basename[priority['test_program']] = (rank, priority.get('expected_time_sec'))
+
+    descriptors_by_program = defaultdict(list)
+    for test_descriptor in cpp_test_descriptors:
+        descriptors_by_program[get_test_program(test_descriptor.descriptor_str)].append(
+            test_descriptor)
+    test_programs = sorted(
+        descriptors_by_program.keys(),
+        key=lambda test_program: (
+            priority_by_basename.get(os.path.basename(test_program), (len(test_priorities),))[0],
+            test_program))
+
+    if time_budget_sec:
+        expected_times = [expected_time_sec for rank, expected_time_sec
+                          in priority_by_basename.values() if expected_time_sec is not None]
+        if expected_times:
+            default_expected_time_sec = sum(expected_times) / len(expected_times)
+            total_expected_time_sec = 0.0
+            num_programs_to_run = 0
+            for test_program in test_programs:
+                expected_time_sec = priority_by_basename.get(
+                    os.path.basename(test_program), (None, None))[1]
+                if expected_time_sec is None:
+                    expected_time_sec = default_expected_time_sec
+                if num_programs_to_run > 0 and (
+                        total_expected_time_sec + expected_time_sec > time_budget_sec):
+                    break
+                total_expected_time_sec += expected_time_sec
+                num_programs_to_run += 1
+            if num_programs_to_run < len(test_programs):
+                logging.info(
+                    "Only running %d most relevant C++ test programs out of %d to fit into the "
+                    "time budget of %.1f sec (expected time: %.1f sec). Skipped: %s" % (
+                        num_programs_to_run, len(test_programs), time_budget_sec,
+                        total_expected_time_sec,
+                        ', '.join(test_programs[num_programs_to_run:])))
+            test_programs = test_programs[:num_programs_to_run]
+        else:
+            logging.warning("Ignoring the time budget of %.1f sec: no historical running times "
+                            "of C++ test programs are available" % time_budget_sec)
+
+    return [test_descriptor
+            for test_program in test_programs
+            for test_descriptor in descriptors_by_program[test_program]]
+
+
+def get_test_digests(test_descriptors, test_program_digests):
+    """
+    @param test_program_digests digests of transitive inputs of C++ test programs, computed by
+                                dependency_graph.py, by test program path relative to the build
+                                root
+    @return a dictionary mapping descriptor strings of the given tests to digests of their inputs,
+            for tests of the test programs we have digests for
+    """
+    test_digests = {}
+    for test_descriptor in test_descriptors:
+        digest = test_program_digests.get(get_test_program(test_descriptor.descriptor_str))
+        if digest:
+            test_digests[test_descriptor.descriptor_str] = digest
+    return test_digests
+
+
+def skip_cached_tests(test_descriptors, test_digests, test_result_cache):
+    """
+    @return the given tests, except those that already passed with exactly the same inputs
+            according to the test result cache
+    """
+    tests_to_run = []
+    num_skipped = 0
+    skipped_time_sec = 0.0
+    for test_descriptor in test_descriptors:
+        digest = test_digests.get(test_descriptor.descriptor_str)
+        cached_result = digest and test_result_cache.get(test_descriptor.descriptor_str, digest)
+        if cached_result:
+            num_skipped += 1
+            skipped_time_sec += cached_result.get('elapsed_time_sec') or 0.0
+            if verbose:
+                logging.info("Skipping test that already passed with the same inputs: {}".format(
+                    test_descriptor))
+        else:
+            tests_to_run.append(test_descriptor)
+    logging.info(
+        "Skipping %d tests out of %d that already passed with the same inputs according to the "
+        "test result cache (%.1f sec of previous running time)" % (
+            num_skipped, len(test_descriptors), skipped_time_sec))
+    return tests_to_run
+
+
+def save_passed_tests_to_cache(results, test_digests, test_result_cache):
+    num_saved = 0
+    for result in results:
+        digest = test_digests.get(result.test_descriptor.descriptor_str)
+        if result.exit_code == 0 and digest:
+            test_result_cache.put(result.test_descriptor.descriptor_str, digest,
+                                  dict(elapsed_time_sec=result.elapsed_time_sec))
+            num_saved += 1
+    logging.info("Saved {} passed tests to the test result cache at '{}'".format(
+        num_saved, test_result_cache.cache_dir))
+    test_result_cache.evict()
+
+
+def get_expected_test_times(test_descriptors, test_history):
+    """
+    @return a dictionary mapping descriptor strings of the given tests to their expected running
+            times according to historical test reports. Tests that have not run before are
+            assumed to take the average time of the tests of the same test program that have, or
+            else the average time of all tests with known running times. The result is empty if
+            there are no historical running times at all.
+    """
+    expected_times = {}
+    known_times_by_program = defaultdict(list)
+    for test_descriptor in test_descriptors:
+        stats = test_history.get_test_stats(test_descriptor.descriptor_str)
+        if stats:
+            expected_times[test_descriptor.descriptor_str] = stats.get_avg_elapsed_time_sec()
+            known_times_by_program[get_test_program(test_descriptor.descriptor_str)].append(
+                stats.get_avg_elapsed_time_sec())
+    if not expected_times:
+        return expected_times
+
+    default_expected_time_sec = sum(expected_times.values()) / len(expected_times)
+    for test_descriptor in test_descriptors:
+        if test_descriptor.descriptor_str not in expected_times:
+            known_times = known_times_by_program.get(
+                get_test_program(test_descriptor.descriptor_str))
+            expected_times[test_descriptor.descriptor_str] = (
+                sum(known_times) / len(known_times) if known_times else default_expected_time_sec)
+    return expected_times
+
+
+def uses_mini_cluster(test_descriptor):
+    return test_descriptor.is_jvm_based or bool(MINI_CLUSTER_TEST_PROGRAM_RE.search(
+        get_test_program(test_descriptor.descriptor_str)))
+
+
+def get_resource_profiles(test_descriptors, test_history):
+    """
+    @param test_history a TestHistory, or None if there are no historical reports
+    @return a dictionary mapping descriptor strings of the given tests, without attempt indexes,
+            to resource profiles, as (CPU cores, memory bytes, number of ports) tuples. The average
+            number of CPU cores used and the maximum memory usage come from historical reports
+            where available. The number of ports is only estimated based on whether a test is
+            expected to start a mini-cluster.
+    """
+    profiles = {}
+    for test_descriptor in test_descriptors:
+        cpu_cores, memory_bytes, num_ports = DEFAULT_TEST_RESOURCE_PROFILE
+        if uses_mini_cluster(test_descriptor):
+            cpu_cores, memory_bytes, num_ports = DEFAULT_MINI_CLUSTER_TEST_RESOURCE_PROFILE
+        stats = test_history and test_history.get_test_stats(test_descriptor.descriptor_str)
+        if stats:
+            avg_cpu_cores = stats.get_avg_cpu_cores()
+            if avg_cpu_cores is not None:
+                cpu_cores = avg_cpu_cores
+            memory_bytes = stats.max_rss_bytes or memory_bytes
+        profiles[test_descriptor.descriptor_str_without_attempt_index] = (
+            cpu_cores, memory_bytes, num_ports)
+    return profiles
+
+
+class StragglerMonitor:
+    """
+    Runs in the driver while tests are running. Tests running for the first time leave "started"
+    markers in speculation_dir, and when a test runs for longer than its straggler threshold, we
+    run a speculative copy of it as a separate Spark job, on whatever executor is free, or with
+    the local backend, in the first local worker process that has nothing else to do. The copy
+    that passes first creates the "winner" marker, and the other copy kills its test when it sees
+    that, so the Spark task running the straggler does not hold up the whole run. If neither copy
+    passes, both run to completion and the test fails.
+    """
+    def __init__(self, straggler_thresholds, max_speculative_copies):
+        """
+        @param straggler_thresholds a dictionary mapping test descriptor strings without attempt
+                                    indexes to the time after which we run a copy of the test
+        """
+        self.straggler_thresholds = straggler_thresholds
+        self.max_speculative_copies = max_speculative_copies
+        # Test descriptor string -> thread running its speculative copy.
+        self.copy_threads = {}
+        # Test descriptor string -> TestResult of its speculative copy.
+        self.copy_results = {}
+        self.stop_event = threading.Event()
+        self.monitor_thread = threading.Thread(target=self.monitor)
+        self.monitor_thread.daemon = True
+
+    def start(self):
+        self.monitor_thread.start()
+
+    def monitor(self):
+        while not self.stop_event.wait(STRAGGLER_CHECK_INTERVAL_SEC):
+            try:
+                self.check_for_stragglers()
+            except Exception as ex:
+                logging.exception("Error while looking for straggler tests: {}".format(ex))
+
+    def check_for_stragglers(self):
+        for started_marker_path in glob.glob(
+                os.path.join(speculation_dir, '*' + STARTED_MARKER_SUFFIX)):
+            if len(self.copy_threads) >= self.max_speculative_copies:
+                return
+            try:
+                with open(started_marker_path) as started_marker_file:
+                    started_marker = json.load(started_marker_file)
+            except (IOError, ValueError):
+                # The test has just finished, or the marker is still being written.
+                continue
+            test_descriptor_str = started_marker['descriptor_str']
+            threshold_sec = self.straggler_thresholds.get(
+                get_descriptor_without_attempt_index(test_descriptor_str))
+            running_time_sec = time.time() - started_marker['start_time_sec']
+            if (test_descriptor_str in self.copy_threads or threshold_sec is None or
+                    running_time_sec < threshold_sec or
+                    os.path.exists(get_speculation_marker_path(
+                        test_descriptor_str, WINNER_MARKER_SUFFIX))):
+                continue
+            logging.info("Test %s has been running on %s for %.1f sec, longer than its threshold "
+                         "of %.1f sec, running a speculative copy of it" % (
+                             test_descriptor_str, started_marker['host'], running_time_sec,
+                             threshold_sec))
+            copy_thread = threading.Thread(target=self.run_copy, args=(test_descriptor_str,))
+            copy_thread.daemon = True
+            self.copy_threads[test_descriptor_str] = copy_thread
+            copy_thread.start()
+
+    def run_copy(self, test_descriptor_str):
+        try:
+            copy_result = execution_backend.run_in_spare_worker(
+                parallel_run_speculative_copy, test_descriptor_str)
+            if copy_result is None:
+                logging.info("Could not run a speculative copy of {}".format(test_descriptor_str))
+            else:
+                self.copy_results[test_descriptor_str] = copy_result
+        except Exception as ex:
+            logging.exception("Failed to run a speculative copy of {}: {}".format(
+                test_descriptor_str, ex))
+
+    def stop(self):
+        """
+        Stops looking for stragglers, and waits for the speculative copies that are still running.
+        Those that lost the race kill their tests soon after the other copy finishes.
+        """
+        self.stop_event.set()
+        self.monitor_thread.join()
+        for copy_thread in self.copy_threads.values():
+            copy_thread.join()
+
+    def merge_results(self, results):
+        """
+        @return the given results of tests, with the results of tests that had speculative copies
+                replaced by the results of the copy that passed first, and marked with the
+                winning copy in speculation_winner. Tests that failed in both copies keep the
+                result of the original copy.
+        """
+        merged_results = []
+        for result in results:
+            test_descriptor_str = result.test_descriptor.descriptor_str
+            if test_descriptor_str in self.copy_threads:
+                try:
+                    with open(get_speculation_marker_path(
+                            test_descriptor_str, WINNER_MARKER_SUFFIX)) as winner_marker_file:
+                        winner = winner_marker_file.read() or ORIGINAL_COPY
+                except IOError:
+                    logging.warning("Neither copy of {} passed".format(test_descriptor_str))
+                    merged_results.append(result)
+                    continue
+                if winner == SPECULATIVE_COPY and test_descriptor_str in self.copy_results:
+                    result = self.copy_results[test_descriptor_str]
+                logging.info("The {} copy of test {} passed first".format(
+                    winner, test_descriptor_str))
+                result = result._replace(speculation_winner=winner)
+            merged_results.append(result)
+        return merged_results
+
+
+class TestProgressTracker:
+    """
+    Receives results of tests as soon as they finish, in the driver. Logs the progress, appends
+    failed tests to the failed test list and reports of all tests to a partial report right away,
+    so they are available before all tests are done, and cancels the remaining tests once too many
+    have failed, if requested.
+    """
+    def __init__(self, test_descriptor_strs, expected_times, failed_test_list_path=None,
+                 partial_report_path=None, max_failures=None):
+        """
+        @param expected_times a dictionary mapping test descriptor strings to their expected
+                              running times, used for estimating the remaining time
+        @param max_failures cancel the remaining tests once this many test attempts have failed
+        """
+        self.expected_times = expected_times
+        self.default_expected_time_sec = 1.0
+        if expected_times:
+            self.default_expected_time_sec = (
+                sum(expected_times.values()) / len(expected_times))
+        self.failed_test_list_path = failed_test_list_path
+        self.partial_report_path = partial_report_path
+        self.max_failures = max_failures
+
+        self.num_tests = 0
+        self.total_expected_time_sec = 0.0
+        self.num_done = 0
+        self.num_failed = 0
+        self.done_expected_time_sec = 0.0
+        self.reported_test_descriptor_strs = set()
+        self.start_time_sec = time.time()
+        self.last_logging_time_sec = self.start_time_sec
+        # Results of the local backend come from the main thread, but those of Spark and of
+        # speculative copies come from other threads.
+        self.lock = threading.Lock()
+
+        for path in [failed_test_list_path, partial_report_path]:
+            if path:
+                open(path, 'w').close()
+        self.add_tests(test_descriptor_strs)
+
+    def add_tests(self, test_descriptor_strs):
+        """
+        Adds tests that are going to run, e.g. retries of failed tests.
+        """
+        with self.lock:
+            self.num_tests += len(test_descriptor_strs)
+            self.total_expected_time_sec += sum(self.get_expected_time(test_descriptor_str)
+                                                for test_descriptor_str in test_descriptor_strs)
+
+    def get_expected_time(self, test_descriptor_str):
+        return self.expected_times.get(test_descriptor_str, self.default_expected_time_sec)
+
+    def add_result(self, result):
+        test_descriptor_str = result.test_descriptor.descriptor_str
+        with self.lock:
+            if test_descriptor_str in self.reported_test_descriptor_strs:
+                return
+            self.reported_test_descriptor_strs.add(test_descriptor_str)
+            self.num_done += 1
+            self.done_expected_time_sec += self.get_expected_time(test_descriptor_str)
+
+            if self.partial_report_path:
+                with open(self.partial_report_path, 'a') as partial_report_file:
+                    partial_report_file.write(json.dumps(dict(
+                        get_test_report_dict(result), test=test_descriptor_str)) + "\n")
+
+            if result.exit_code != 0:
+                self.num_failed += 1
+                logging.info("Test failed: {}, rc={}".format(test_descriptor_str,
+                                                             result.exit_code))
+                if self.failed_test_list_path:
+                    with open(self.failed_test_list_path, 'a') as failed_test_file:
+                        failed_test_file.write(test_descriptor_str + "\n")
+
+            if (result.exit_code != 0 or self.num_done == self.num_tests or
+                    time.time() - self.last_logging_time_sec >= PROGRESS_LOGGING_INTERVAL_SEC):
+                self.log_progress()
+
+            if (self.max_failures and self.num_failed >= self.max_failures and
+                    not execution_backend.cancelled):
+                logging.info("{} tests have failed, cancelling the remaining tests".format(
+                    self.num_failed))
+                execution_backend.cancel()
+
+    def log_progress(self):
+        elapsed_time_sec = time.time() - self.start_time_sec
+        eta_str = ''
+        if 0 < self.done_expected_time_sec < self.total_expected_time_sec:
+            eta_str = ', ETA %.1f sec' % (
+                elapsed_time_sec * (self.total_expected_time_sec - self.done_expected_time_sec) /
+                self.done_expected_time_sec)
+        logging.info("Done %d of %d tests, %d failed, in %.1f sec%s" % (
+            self.num_done, self.num_tests, self.num_failed, elapsed_time_sec, eta_str))
+        self.last_logging_time_sec = time.time()
+
+
+def run_test_batches(test_batches, progress_tracker=None):
+    """
+    Runs the given batches of tests, one task per batch, and speculative copies of straggler tests
+    if enabled.
+
+    @param progress_tracker an optional TestProgressTracker to pass results of tests to as soon as
+                            they finish
+    @return results of all tests
+    """
+    straggler_monitor = None
+    if speculation_conf:
+        straggler_monitor = StragglerMonitor(**speculation_conf)
+        straggler_monitor.start()
+
+    def on_batch_results(batch_results):
+        for result in batch_results:
+            if (straggler_monitor and
+                    result.test_descriptor.descriptor_str in straggler_monitor.copy_threads):
+                # We'll know which copy of the test passed first when both are done.
+                continue
+            progress_tracker.add_result(result)
+
+    try:
+        results = [result
+                   for batch_results in execution_backend.map(
+                       parallel_run_tests, test_batches,
+                       on_result=on_batch_results if progress_tracker else None)
+                   for result in batch_results]
+    finally:
+        if straggler_monitor:
+            straggler_monitor.stop()
+    if straggler_monitor:
+        results = straggler_monitor.merge_results(results)
+        if progress_tracker:
+            for result in results:
+                if result.test_descriptor.descriptor_str in straggler_monitor.copy_threads:
+                    progress_tracker.add_result(result)
+    return results
+
+
+def get_straggler_thresholds(test_descriptors, test_history, p95_multiplier,
+                             min_straggler_time_sec):
+    """
+    @return a dictionary mapping descriptor strings of C++ tests, without attempt indexes, to the
+            time after which we consider them stragglers: the 95th percentile of their historical
+            running times times p95_multiplier, but at least min_straggler_time_sec
+    """
+    thresholds = {}
+    for test_descriptor in test_descriptors:
+        if test_descriptor.is_jvm_based:
+            continue
+        stats = test_history.get_test_stats(test_descriptor.descriptor_str)
+        p95_time_sec = stats and stats.get_elapsed_time_percentile(95)
+        if p95_time_sec:
+            thresholds[test_descriptor.descriptor_str_without_attempt_index] = max(
+                p95_time_sec * p95_multiplier, min_straggler_time_sec)
+    return thresholds
+
+
+def run_tests_with_retries(test_batches, max_attempts, max_parallel_retries, isolate_retries,
+                           progress_tracker=None):
+    """
+    Runs the given batches of tests, and then runs the tests that failed again, up to max_attempts
+    times in total. Every round of retries waits for the previous round to finish, and is split
+    into at most max_parallel_retries tasks, so that retried tests compete less for the resources
+    of their hosts than they did the first time.
+
+    @return results of all attempts of all tests
+    """
+    global isolated_tests
+
+    results = run_test_batches(test_batches, progress_tracker)
+    all_results = list(results)
+    for attempt_index in xrange(2, max_attempts + 1):
+        tests_to_retry = [result.test_descriptor.with_attempt_index(attempt_index)
+                          for result in results if result.exit_code != 0]
+        if not tests_to_retry or execution_backend.cancelled:
+            break
+        num_tasks = min(max_parallel_retries, len(tests_to_retry))
+        logging.info("Running {} failed tests again (attempt {} of {}) as {} tasks".format(
+            len(tests_to_retry), attempt_index, max_attempts, num_tasks))
+        if isolate_retries:
+            isolated_tests = set(test_descriptor.descriptor_str
+                                 for test_descriptor in tests_to_retry)
+        retry_batches = [[test_descriptor.descriptor_str
+                          for test_descriptor in tests_to_retry[i::num_tasks]]
+                         for i in xrange(num_tasks)]
+        if progress_tracker:
+            progress_tracker.add_tests([test_descriptor.descriptor_str
+                                        for test_descriptor in tests_to_retry])
+        results = run_test_batches(retry_batches, progress_tracker)
+        all_results += results
+    isolated_tests = set()
+    return all_results
+
+
+def get_flakiness_scores(attempt_outcomes):
+    """
+    @param attempt_outcomes (test, passed) pairs, one for every attempt of every test
+    @return a dictionary mapping tests to their flakiness scores: the fraction of failed attempts
+            for tests that both failed and passed, and zero for tests that always failed or always
+            passed
+
+    >>> sorted(get_flakiness_scores([('a', False), ('a', True), ('b', False), ('b', False),
+    ...                              ('c', True), ('d', False), ('d', False), ('d', True)]).items())
+    [('a', 0.5), ('b', 0.0), ('c', 0.0), ('d', 0.6666666666666666)]
+    """
+    outcomes_by_test = defaultdict(list)
+    for test, passed in attempt_outcomes:
+        outcomes_by_test[test].append(passed)
+    scores = {}
+    for test, outcomes in outcomes_by_test.items():
+        num_failures = outcomes.count(False)
+        scores[test] = 0.0
+        if 0 < num_failures < len(outcomes):
+            scores[test] = float(num_failures) / len(outcomes)
+    return scores
+
+
+def get_final_results(results):
+    """
+    @return the results of the last attempt of every test
+    """
+    final_results = {}
+    for result in results:
+        test = result.test_descriptor.descriptor_str_without_attempt_index
+        if (test not in final_results or
+                final_results[test].test_descriptor.attempt_index <
+                result.test_descriptor.attempt_index):
+            final_results[test] = result
+    return final_results.values()
+
+
+def schedule_tests(test_descriptor_strs, expected_times, short_test_threshold_sec,
+                   max_batch_time_sec, test_program_ranks=None):
+    """
+    Splits tests into batches to run as Spark tasks, longest first. Spark starts tasks in the order
+    of partitions, so this makes the longest tests start the earliest instead of delaying the end of
+    the whole run. Tests expected to take less than short_test_threshold_sec are packed together
+    into batches of up to max_batch_time_sec, to save the per-task overhead. Only tests of the same
+    test program are batched together, so that they can also be run with one invocation of the test
+    program (see run_gtest_batch). Tests without expected running times run in separate tasks
+    before all others, in the original order.
+
+    @param test_program_ranks an optional dictionary mapping test program basenames to their ranks
+                              in the priorities from the test configuration, most relevant first.
+                              If specified, batches are ordered by rank first, and only batches of
+                              equally ranked tests are ordered as described above. Tests of test
+                              programs without a rank go last. The ranks only cover C++ test
+                              programs, so Java tests keep going first, as they take the longest.
+    @return a list of lists of test descriptor strings
+
+    >>> schedule_tests(['a', 'p:::b', 'p:::c', 'p:::d', 'e', 'f', 'q:::g'],
+    ...                {'a': 100, 'p:::b': 1, 'p:::c': 2, 'p:::d': 3, 'e': 50, 'q:::g': 1}, 5, 4)
+    [['f'], ['a'], ['e'], ['p:::d', 'p:::b'], ['p:::c'], ['q:::g']]
+    >>> schedule_tests(['p:::a', 'p:::b', 'p:::c'], {'p:::a': 1, 'p:::b': 2, 'p:::c': 3}, 0, 4)
+    [['p:::c'], ['p:::b'], ['p:::a']]
+    >>> schedule_tests(['a', 'p:::b', 'p:::c', 'q:::d', 'q:::e', 'm/src/test/java/T.java'],
+    ...                {'a': 100, 'p:::b': 1, 'p:::c': 2, 'q:::d': 3, 'q:::e': 4,
+    ...                 'm/src/test/java/T.java': 50}, 0, 4, {'q': 0, 'p': 1})
+    [['m/src/test/java/T.java'], ['q:::e'], ['q:::d'], ['p:::c'], ['p:::b'], ['a']]
+    """
+    batches = []
+    short_tests_by_program = defaultdict(list)
+    for test_descriptor_str in test_descriptor_strs:
+        expected_time_sec = expected_times.get(test_descriptor_str)
+        if expected_time_sec is not None and expected_time_sec < short_test_threshold_sec:
+            short_tests_by_program[get_test_program(test_descriptor_str)].append(
+                (expected_time_sec, test_descriptor_str))
+        else:
+            batches.append((expected_time_sec, [test_descriptor_str]))
+
+    # First-fit decreasing bin packing of short tests of each test program.
+    for test_program in sorted(short_tests_by_program):
+        short_batches = []
+        for expected_time_sec, test_descriptor_str in sorted(
+                short_tests_by_program[test_program], reverse=True):
+            for batch in short_batches:
+                if batch[0] + expected_time_sec <= max_batch_time_sec:
+                    batch[0] += expected_time_sec
+                    batch[1].append(test_descriptor_str)
+                    break
+            else:
+                short_batches.append([expected_time_sec, [test_descriptor_str]])
+        batches += [tuple(batch) for batch in short_batches]
+
+    def get_rank(batch):
+        if test_program_ranks is None:
+            return 0
+        test_program = get_test_program(batch[1][0])
+        if test_program.endswith(JVM_TEST_SOURCE_EXTENSIONS):
+            return -1
+        return test_program_ranks.get(os.path.basename(test_program), len(test_program_ranks))
+
+    # Python's sort is stable, so tests with unknown times keep their original order.
+    batches.sort(key=lambda batch: (
+        get_rank(batch), -batch[0] if batch[0] is not None else float('-inf')))
+    return [test_descriptor_strs for expected_time_sec, test_descriptor_strs in batches]
+
+
 def is_writable(dir_path):
     return os.access(dir_path, os.W_OK)
 
@@ -522,6 +1726,9 @@ def fatal_error(msg):
 
 
 def collect_tests(args):
+    """
+    @return a (test descriptors, test configuration) tuple
+    """
     cpp_test_descriptors = []
 
     if args.cpp_test_program_regexp and args.test_conf:
@@ -547,10 +1754,19 @@ def collect_tests(args):
                     ("Ignoring the C++ test program regular expression specified on the "
                      "command line: {}").format(args.cpp_test_program_regexp))
 
+        test_listing_cache = TestListingCache(yb_dist_tests.global_conf.build_root)
+        if args.refresh_test_listing_cache:
+            test_listing_cache.clear()
         cpp_test_descriptors = collect_cpp_tests(
                 args.max_tests,
                 cpp_test_programs,
-                args.cpp_test_program_regexp)
+                args.cpp_test_program_regexp,
+                test_listing_cache)
+
+        test_priorities = test_conf.get('cpp_test_program_priorities')
+        if test_priorities:
+            cpp_test_descriptors = prioritize_cpp_tests(
+                    cpp_test_descriptors, test_priorities, test_conf.get('time_budget_sec'))
 
     java_test_descriptors = []
     yb_src_root = yb_dist_tests.global_conf.yb_src_root
@@ -572,12 +1788,14 @@ def collect_tests(args):
                             logging.warning("Skipping file (does not match expected pattern): " +
                                             test_descriptor)
 
-    # TODO: sort tests in the order of reverse historical execution time. If Spark starts running
-    # tasks from the beginning, this will ensure the longest tests start the earliest.
-    #
-    # Right now we just put Java tests first because those tests are entire test classes and will
-    # take longer to run on average.
-    return sorted(java_test_descriptors) + sorted(cpp_test_descriptors)
+    # Tests are put in the order of reverse historical execution time later, by schedule_tests,
+    # within groups of equally ranked test programs if the test configuration prioritizes C++ test
+    # programs. Here we just put Java tests first because those tests are entire test classes and
+    # will take longer to run on average, which also matters when there are no historical reports.
+    # C++ tests prioritized by the test configuration keep their order.
+    if not test_conf.get('cpp_test_program_priorities'):
+        cpp_test_descriptors = sorted(cpp_test_descriptors)
+    return sorted(java_test_descriptors) + cpp_test_descriptors, test_conf
 
 
 def load_test_list(test_list_path):
@@ -614,6 +1832,17 @@ def run_spark_action(action):
 def main():
     parser = argparse.ArgumentParser(
         description='Run tests on Spark.')
+    parser.add_argument('--backend', choices=[SPARK_BACKEND, LOCAL_BACKEND],
+                        default=SPARK_BACKEND,
+                        help='Where to run tests: on a Spark cluster, or in a pool of processes on '
+                             'this machine.')
+    parser.add_argument('--num_local_workers', type=int,
+                        help='Number of tests to run in parallel with the local backend. By '
+                             'default, one per CPU, limited by --local_worker_memory_gb.')
+    parser.add_argument('--local_worker_memory_gb', type=float,
+                        default=DEFAULT_LOCAL_WORKER_MEMORY_GB,
+                        help='Memory to reserve for every test running in parallel with the local '
+                             'backend, when choosing the default number of local workers.')
     parser.add_argument('--verbose', action='store_true',
                         help='Enable debug output')
     parser.add_argument('--java', dest='run_java_tests', action='store_true',
@@ -641,6 +1870,20 @@ def main():
                         help='Actually enable writing build reports. If this is not '
                              'specified, we will only read previous test reports to sort tests '
                              'better.')
+    parser.add_argument('--max_historical_reports', type=int, default=DEFAULT_MAX_REPORTS,
+                        help='Number of most recent test reports from the reports directory to '
+                             'use for estimating test running times. Reports are added to a '
+                             'report store database in the per-build-type subdirectory of the '
+                             'reports directory, see python/yb/test_report_store.py.')
+    parser.add_argument('--short_test_threshold_sec', type=float, default=5.0,
+                        help='Tests expected to take less than this are batched together into '
+                             'one Spark task. Zero disables batching.')
+    parser.add_argument('--max_test_batch_time_sec', type=float, default=30.0,
+                        help='Maximum expected running time of a batch of short tests.')
+    parser.add_argument('--combine_gtest_filters', action='store_true',
+                        help='Run batched short tests of the same C++ test program with one '
+                             'invocation of the test program using a combined --gtest_filter, '
+                             'instead of running the test program once per test.')
     parser.add_argument('--save_report_to_build_dir', action='store_true',
                         help='Save a test report to the build directory directly, in addition '
                              'to any reports saved in the common reports directory. This should '
@@ -652,9 +1895,74 @@ def main():
                              'produced by dependency_graph.py')
     parser.add_argument('--num_repetitions', type=int, default=1,
                         help='Number of times to run each test.')
+    parser.add_argument('--max_attempts', type=int, default=1,
+                        help='Maximum number of times to run each test. Tests that fail are run '
+                             'again, after all tests of the previous attempt are done, until they '
+                             'pass or run this many times. A test that passes on a later attempt '
+                             'is reported as flaky and does not fail the run. Cannot be combined '
+                             'with --num_repetitions.')
+    parser.add_argument('--max_parallel_retries', type=int, default=DEFAULT_MAX_PARALLEL_RETRIES,
+                        help='Maximum number of tasks to split every round of retries of failed '
+                             'tests into with --max_attempts. Each task runs its tests one after '
+                             'another.')
+    parser.add_argument('--speculate_stragglers', action='store_true',
+                        help='Run a second copy of a C++ test that runs for much longer than it '
+                             'usually does, according to historical reports, and use the result '
+                             'of whichever copy passes first. The test only fails if both copies '
+                             'fail. The logs of the copy are in the yb-test-logs{} '
+                             'directory.'.format(SPECULATIVE_COPY_LOG_ROOT_SUFFIX))
+    parser.add_argument('--straggler_p95_multiplier', type=float,
+                        default=DEFAULT_STRAGGLER_P95_MULTIPLIER,
+                        help='With --speculate_stragglers, a test is a straggler once it runs for '
+                             'this many times the 95th percentile of its historical running times.')
+    parser.add_argument('--min_straggler_time_sec', type=float,
+                        default=DEFAULT_MIN_STRAGGLER_TIME_SEC,
+                        help='With --speculate_stragglers, never consider a test a straggler '
+                             'before it runs for this long.')
+    parser.add_argument('--max_speculative_copies', type=int,
+                        default=DEFAULT_MAX_SPECULATIVE_COPIES,
+                        help='Maximum number of tests to run speculative copies of, per round of '
+                             'tests.')
+    parser.add_argument('--isolate_retries', action='store_true',
+                        help='With --max_attempts and --admission_control, run every retried test '
+                             'with no other tests on its host.')
     parser.add_argument('--failed_test_list',
                         help='A file path to save the list of failed tests to. The format is '
-                             'one test descriptor per line.')
+                             'one test descriptor per line. Failed tests are added to it as soon '
+                             'as they finish, and the final list is written when all tests are '
+                             'done.')
+    parser.add_argument('--partial_report',
+                        help='A file path to append the report of every test to as soon as it '
+                             'finishes, one JSON object per line.')
+    parser.add_argument('--max_failures', type=int,
+                        help='Cancel the remaining tests once this many test attempts have '
+                             'failed.')
+    parser.add_argument('--test_result_cache_dir',
+                        help='A directory with results of previous passing test runs. Tests '
+                             'whose inputs are the same as in a previous passing run are '
+                             'skipped. This requires a --test_conf produced by dependency_graph.py '
+                             'with --test-input-digests.')
+    parser.add_argument('--test_result_cache_max_size_mb', type=int,
+                        default=DEFAULT_MAX_CACHE_SIZE_MB,
+                        help='Maximum total size of the test result cache. Least recently used '
+                             'results are removed to stay under this limit.')
+    parser.add_argument('--admission_control', action='store_true',
+                        help='Before starting a test, wait until the host it runs on has enough '
+                             'CPU, memory and ports for it, according to what the tests running '
+                             'there already reserved. Resource usage of tests is estimated based '
+                             'on historical reports.')
+    parser.add_argument('--max_test_memory_fraction', type=float,
+                        default=DEFAULT_MAX_MEMORY_FRACTION,
+                        help='Fraction of the physical memory of a host that tests running there '
+                             'may reserve with --admission_control.')
+    parser.add_argument('--max_test_ports_per_host', type=int,
+                        default=DEFAULT_MAX_PORTS_PER_HOST,
+                        help='Number of ports that tests running on one host may reserve with '
+                             '--admission_control. Tests starting mini-clusters reserve %d ports.' %
+                             DEFAULT_MINI_CLUSTER_TEST_RESOURCE_PROFILE[2])
+    parser.add_argument('--refresh_test_listing_cache', action='store_true',
+                        help='List C++ test programs and tests in them again, even those that '
+                             'have not changed since they were listed by a previous run.')
     parser.add_argument('--allow_no_tests', action='store_true',
                         help='Allow running with filters that yield no tests to run. Useful when '
                              'debugging.')
@@ -671,6 +1979,16 @@ def main():
     global verbose
     verbose = args.verbose
 
+    global combine_gtest_filters
+    combine_gtest_filters = args.combine_gtest_filters
+
+    global execution_backend
+    if args.backend == LOCAL_BACKEND:
+        execution_backend = LocalBackend(
+            args.num_local_workers or get_default_num_local_workers(args.local_worker_memory_gb))
+    else:
+        execution_backend = SparkBackend()
+
     log_level = logging.INFO
     logging.basicConfig(
         level=log_level,
@@ -696,9 +2014,40 @@ def main():
             "--write_report specified but the reports directory ('{}') is not writable".format(
                 report_base_dir))
 
+    if args.short_test_threshold_sec > args.max_test_batch_time_sec:
+        fatal_error("--short_test_threshold_sec must not exceed --max_test_batch_time_sec")
+
+    if args.num_local_workers is not None and args.num_local_workers < 1:
+        fatal_error("--num_local_workers must be at least 1, got: {}".format(
+            args.num_local_workers))
+
     if args.num_repetitions < 1:
         fatal_error("--num_repetitions must be at least 1, got: {}".format(args.num_repetitions))
 
+    if args.max_attempts < 1:
+        fatal_error("--max_attempts must be at least 1, got: {}".format(args.max_attempts))
+
+    if args.max_attempts > 1 and args.num_repetitions > 1:
+        fatal_error("--max_attempts and --num_repetitions cannot be used together")
+
+    if args.max_failures is not None and args.max_failures < 1:
+        fatal_error("--max_failures must be at least 1, got: {}".format(args.max_failures))
+
+    if args.partial_report and not is_parent_dir_writable(args.partial_report):
+        fatal_error("Parent directory of the partial report path ('{}') is not writable".format(
+            args.partial_report))
+
+    if args.max_speculative_copies < 0:
+        fatal_error("--max_speculative_copies must not be negative, got: {}".format(
+            args.max_speculative_copies))
+
+    if args.max_parallel_retries < 1:
+        fatal_error("--max_parallel_retries must be at least 1, got: {}".format(
+            args.max_parallel_retries))
+
+    if args.isolate_retries and not args.admission_control:
+        fatal_error("--isolate_retries requires --admission_control")
+
     failed_test_list_path = args.failed_test_list
     if failed_test_list_path and not is_parent_dir_writable(failed_test_list_path):
         fatal_error(("Parent directory of failed test list destination path ('{}') is not " +
@@ -713,10 +2062,26 @@ def main():
     # Start the timer.
     global_start_time = time.time()
 
+    test_conf = {}
     if test_list_path:
         test_descriptors = load_test_list(test_list_path)
     else:
-        test_descriptors = collect_tests(args)
+        test_descriptors, test_conf = collect_tests(args)
+
+    test_result_cache = None
+    test_digests = {}
+    if args.test_result_cache_dir:
+        if args.num_repetitions > 1:
+            logging.info("Not using the test result cache, as tests are repeated")
+        elif not test_conf.get('cpp_test_program_digests'):
+            logging.warning("Not using the test result cache: no digests of test inputs found in "
+                            "the test configuration")
+        else:
+            test_result_cache = TestResultCache(
+                args.test_result_cache_dir, args.test_result_cache_max_size_mb * 1024 * 1024)
+            test_digests = get_test_digests(test_descriptors,
+                                            test_conf['cpp_test_program_digests'])
+            test_descriptors = skip_cached_tests(test_descriptors, test_digests, test_result_cache)
 
     if not test_descriptors and not args.allow_no_tests:
         logging.info("No tests to run")
@@ -749,32 +2114,112 @@ def main():
             for i in xrange(1, num_repetitions + 1)
         ]
 
+    expected_times = {}
+    test_history = None
+    historical_report_dir = None
+    if report_base_dir:
+        historical_report_dir = os.path.join(report_base_dir, global_conf.build_type)
+    if historical_report_dir and os.path.isdir(historical_report_dir):
+        test_history = load_test_history(historical_report_dir, args.max_historical_reports)
+        expected_times = get_expected_test_times(test_descriptors, test_history)
+    if not expected_times:
+        logging.info("No historical test running times available, not reordering tests")
+    test_program_ranks = None
+    if test_conf.get('cpp_test_program_priorities'):
+        # Run tests of the most relevant test programs first, so that failures caused by the
+        # changes being tested show up as early as possible.
+        test_program_ranks = dict(
+            (priority['test_program'], rank)
+            for rank, priority in enumerate(test_conf['cpp_test_program_priorities']))
+    test_batches = schedule_tests(
+            [test_descriptor.descriptor_str for test_descriptor in test_descriptors],
+            expected_times,
+            args.short_test_threshold_sec,
+            args.max_test_batch_time_sec,
+            test_program_ranks)
+    if expected_times:
+        logging.info("Expected total running time of tests: %.1f sec, of the longest task: %.1f "
+                     "sec" % (sum(expected_times.values()),
+                              max(sum(expected_times.get(s, 0.0) for s in test_batch)
+                                  for test_batch in test_batches)))
+
+    if args.speculate_stragglers:
+        straggler_thresholds = {}
+        if test_history:
+            straggler_thresholds = get_straggler_thresholds(
+                test_descriptors, test_history, args.straggler_p95_multiplier,
+                args.min_straggler_time_sec)
+        if straggler_thresholds:
+            global speculation_dir, speculation_conf
+            speculation_dir = os.path.join(
+                build_root, 'yb-test-logs', 'speculation',
+                '{}_{}'.format(time.strftime('%Y-%m-%dT%H_%M_%S'), os.getpid()))
+            command_util.mkdir_p(speculation_dir)
+            speculation_conf = dict(straggler_thresholds=straggler_thresholds,
+                                    max_speculative_copies=args.max_speculative_copies)
+            logging.info("Will run speculative copies of {} tests if they take too long".format(
+                len(straggler_thresholds)))
+        else:
+            logging.info("No historical test running times available, not running speculative "
+                         "copies of straggler tests")
+
+    if args.admission_control:
+        global admission_control_conf, resource_profiles
+        admission_control_conf = dict(max_memory_fraction=args.max_test_memory_fraction,
+                                      max_ports=args.max_test_ports_per_host)
+        resource_profiles = get_resource_profiles(test_descriptors, test_history)
+
     app_name_details = ['{} tests total'.format(total_num_tests)]
     if num_repetitions > 1:
         app_name_details += ['{} repetitions of {} tests'.format(num_repetitions, num_tests)]
-    init_spark_context(app_name_details)
-
-    set_global_conf_for_spark_jobs()
+    execution_backend.init(app_name_details)
 
     # By this point, test_descriptors have been duplicated the necessary number of times, with
     # attempt indexes attached to each test descriptor.
     spark_succeeded = False
     if test_descriptors:
-        logging.info("Running {} tasks on Spark".format(total_num_tests))
+        logging.info("Running {} tests as {} tasks using the {} backend".format(
+            total_num_tests, len(test_batches), execution_backend.name))
         assert total_num_tests == len(test_descriptors), \
             "total_num_tests={}, len(test_descriptors)={}".format(
                     total_num_tests, len(test_descriptors))
 
-        test_names_rdd = spark_context.parallelize(
-                [test_descriptor.descriptor_str for test_descriptor in test_descriptors],
-                numSlices=total_num_tests)
-
-        results = run_spark_action(lambda: test_names_rdd.map(parallel_run_test).collect())
+        progress_tracker = TestProgressTracker(
+            [test_descriptor.descriptor_str for test_descriptor in test_descriptors],
+            expected_times,
+            failed_test_list_path=failed_test_list_path,
+            partial_report_path=args.partial_report,
+            max_failures=args.max_failures)
+        # One task per batch, in the order returned by schedule_tests.
+        results = run_tests_with_retries(test_batches, args.max_attempts,
+                                         args.max_parallel_retries, args.isolate_retries,
+                                         progress_tracker)
+        if execution_backend.cancelled:
+            num_tests_done = len(
+                set(result.test_descriptor.descriptor_str for result in results) &
+                set(test_descriptor.descriptor_str for test_descriptor in test_descriptors))
+            logging.info("{} of {} tests did not run because tests have been cancelled".format(
+                total_num_tests - num_tests_done, total_num_tests))
     else:
         # Allow running zero tests, for testing the reporting logic.
         results = []
 
-    test_exit_codes = set([result.exit_code for result in results])
+    # With retries, only the last attempt of a test decides whether the test failed.
+    final_results = results
+    flakiness_scores = None
+    if args.max_attempts > 1:
+        final_results = get_final_results(results)
+        flakiness_scores = get_flakiness_scores(
+            (result.test_descriptor.descriptor_str_without_attempt_index, result.exit_code == 0)
+            for result in results)
+        for test, flakiness_score in sorted(flakiness_scores.items()):
+            if flakiness_score > 0:
+                logging.info("Flaky test (flakiness score %.2f): %s" % (flakiness_score, test))
+
+    if speculation_dir:
+        shutil.rmtree(speculation_dir, ignore_errors=True)
+
+    test_exit_codes = set([result.exit_code for result in final_results])
 
     global_exit_code = 0 if test_exit_codes == set([0]) else 1
 
@@ -782,14 +2227,18 @@ def main():
         sorted(test_exit_codes), global_exit_code))
     failures_by_language = defaultdict(int)
     failed_test_desc_strs = []
-    for result in results:
+    for result in final_results:
         if result.exit_code != 0:
             how_test_failed = ""
             if result.failed_without_output:
                 how_test_failed = " without any output"
             logging.info("Test failed{}: {}".format(how_test_failed, result.test_descriptor))
             failures_by_language[result.test_descriptor.language] += 1
-            failed_test_desc_strs.append(result.test_descriptor.descriptor_str)
+            if args.max_attempts > 1:
+                failed_test_desc_strs.append(
+                    result.test_descriptor.descriptor_str_without_attempt_index)
+            else:
+                failed_test_desc_strs.append(result.test_descriptor.descriptor_str)
 
     if failed_test_list_path:
         logging.info("Writing the list of failed tests to '{}'".format(failed_test_list_path))
@@ -799,11 +2248,15 @@ def main():
     for language, num_failures in failures_by_language.iteritems():
         logging.info("Failures in {} tests: {}".format(language, num_failures))
 
+    if test_result_cache:
+        save_passed_tests_to_cache(results, test_digests, test_result_cache)
+
     total_elapsed_time_sec = time.time() - global_start_time
     logging.info("Total elapsed time: {} sec".format(total_elapsed_time_sec))
     if report_base_dir and write_report or args.save_report_to_build_dir:
         save_report(report_base_dir, results, total_elapsed_time_sec, spark_succeeded,
-                    save_to_build_dir=args.save_report_to_build_dir)
+                    save_to_build_dir=args.save_report_to_build_dir,
+                    flakiness_scores=flakiness_scores)
 
     if args.sleep_after_tests:
         # This can be used as a way to keep the Spark app running during debugging while examining
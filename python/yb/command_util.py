@@ -17,11 +17,18 @@ Copyright (c) YugaByte, Inc.
 This module provides utilities for running commands.
 """
 
+import fcntl
+import gzip
 import os
+import select
+import signal
 import subprocess
 import logging
+import sys
+import threading
+import time
 
-from collections import namedtuple
+from collections import deque, namedtuple
 
 
 ProgramResult = namedtuple('ProgramResult',
@@ -32,6 +39,76 @@ ProgramResult = namedtuple('ProgramResult',
                             'error_msg',
                             'program_path'])
 
+StreamedProgramResult = namedtuple('StreamedProgramResult',
+                                   ['returncode',
+                                    'elapsed_time_sec',
+                                    # CPU time and peak resident set size of the program and all
+                                    # its descendants that it waited for.
+                                    'cpu_time_sec',
+                                    'max_rss_bytes',
+                                    'num_output_bytes',
+                                    'output_tail',
+                                    # Whether the program was killed because should_cancel said
+                                    # so.
+                                    'cancelled',
+                                    # The end of what the program wrote to the trace pipe, or
+                                    # None if it did not get one, see trace_env_var.
+                                    'trace_tail'])
+
+OUTPUT_READ_CHUNK_SIZE = 64 * 1024
+
+CANCELLATION_CHECK_INTERVAL_SEC = 1.0
+
+DEFAULT_MAX_OUTPUT_TAIL_BYTES = 64 * 1024
+
+# How long to wait for the trace pipe to be closed after the program exits. Processes it started
+# might still keep the pipe open.
+TRACE_READ_TIMEOUT_SEC = 5.0
+
+
+class OutputTail:
+    """
+    A bounded ring buffer of the last bytes of some output. Safe to use from multiple threads.
+
+    >>> tail = OutputTail(5)
+    >>> for chunk in ['abc', 'def', 'gh']:
+    ...     tail.append(chunk)
+    >>> tail.get()
+    'defgh'
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.chunks = deque()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def append(self, chunk):
+        with self.lock:
+            self.chunks.append(chunk)
+            self.size += len(chunk)
+            while self.size - len(self.chunks[0]) >= self.max_bytes:
+                self.size -= len(self.chunks.popleft())
+
+    def get(self):
+        with self.lock:
+            output = ''.join(self.chunks)
+        return output[max(0, len(output) - self.max_bytes):]
+
+
+def read_into_tail(fd, tail):
+    """
+    Reads from the given file descriptor until the end of file into an OutputTail, and closes the
+    file descriptor.
+    """
+    try:
+        while True:
+            chunk = os.read(fd, OUTPUT_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            tail.append(chunk)
+    finally:
+        os.close(fd)
+
 
 def trim_output(output, max_lines):
     lines = output.split("\n")
@@ -76,6 +153,133 @@ def run_program(args, error_ok=False, max_error_lines=100, cwd=None):
                          error_msg=error_msg)
 
 
+def get_exit_code(wait_status):
+    """
+    @return the exit code of a process with the given status returned by os.wait and similar
+            functions, or 128 + signal number for a process killed by a signal, like the shell does
+
+    >>> get_exit_code(3 << 8)
+    3
+    >>> get_exit_code(9)
+    137
+    """
+    if os.WIFSIGNALED(wait_status):
+        return 128 + os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+def run_program_with_output_file(args, output_path,
+                                 max_output_tail_bytes=DEFAULT_MAX_OUTPUT_TAIL_BYTES, env=None,
+                                 should_cancel=None, trace_env_var=None):
+    """
+    Runs the given program with its standard output and error streamed to a gzip-compressed file,
+    keeping only the last max_output_tail_bytes bytes of output in memory.
+
+    @param should_cancel an optional function, called about every CANCELLATION_CHECK_INTERVAL_SEC
+                         seconds while the program runs. If it returns True, the program is killed
+                         together with its child processes, which run in a new session for that.
+    @param trace_env_var if specified, the program gets the file descriptor of an additional pipe
+                         in this environment variable, e.g. BASH_XTRACEFD, and only the last
+                         max_output_tail_bytes bytes written to it are kept, in trace_tail
+    @return a StreamedProgramResult
+
+    >>> import tempfile
+    >>> output_path = tempfile.mktemp()
+    >>> result = run_program_with_output_file(
+    ...     ['bash', '-c', 'echo out; echo err >&2; exit 3'], output_path, max_output_tail_bytes=6)
+    >>> (result.returncode, result.num_output_bytes, result.output_tail)
+    (3, 8, 't\\nerr\\n')
+    >>> gzip.open(output_path).read()
+    'out\\nerr\\n'
+    >>> result = run_program_with_output_file(
+    ...     ['bash', '-c', 'echo started; sleep 30'], output_path, should_cancel=lambda: True)
+    >>> (result.returncode, result.cancelled, result.elapsed_time_sec < 10)
+    (137, True, True)
+    >>> result = run_program_with_output_file(
+    ...     ['bash', '-c', 'echo out; echo trace >&$TRACE_FD'], output_path,
+    ...     trace_env_var='TRACE_FD')
+    >>> (result.output_tail, result.trace_tail)
+    ('out\\n', 'trace\\n')
+    >>> os.remove(output_path)
+    """
+    start_time_sec = time.time()
+    trace_read_fd = None
+    trace_write_fd = None
+    if trace_env_var:
+        trace_read_fd, trace_write_fd = os.pipe()
+        fcntl.fcntl(trace_read_fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        env = dict(os.environ if env is None else env)
+        env[trace_env_var] = str(trace_write_fd)
+    try:
+        program_subprocess = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            preexec_fn=os.setsid if should_cancel else None)
+    except OSError:
+        logging.error("Failed to run program {}".format(args))
+        if trace_env_var:
+            os.close(trace_read_fd)
+        raise
+    finally:
+        if trace_env_var:
+            os.close(trace_write_fd)
+
+    trace_tail = None
+    if trace_env_var:
+        trace_tail = OutputTail(max_output_tail_bytes)
+        trace_thread = threading.Thread(target=read_into_tail, args=(trace_read_fd, trace_tail))
+        trace_thread.daemon = True
+        trace_thread.start()
+
+    output_tail = OutputTail(max_output_tail_bytes)
+    num_output_bytes = 0
+    cancelled = False
+    last_cancellation_check_time_sec = start_time_sec
+    with gzip.open(output_path, 'wb') as output_file:
+        while True:
+            if should_cancel:
+                readable_fds, _, _ = select.select(
+                    [program_subprocess.stdout], [], [], CANCELLATION_CHECK_INTERVAL_SEC)
+                if (time.time() - last_cancellation_check_time_sec >=
+                        CANCELLATION_CHECK_INTERVAL_SEC):
+                    last_cancellation_check_time_sec = time.time()
+                    if should_cancel():
+                        os.killpg(program_subprocess.pid, signal.SIGKILL)
+                        cancelled = True
+                        # Processes that left the session might still keep the output open.
+                        break
+                if not readable_fds:
+                    continue
+            chunk = os.read(program_subprocess.stdout.fileno(), OUTPUT_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            output_file.write(chunk)
+            num_output_bytes += len(chunk)
+            output_tail.append(chunk)
+    program_subprocess.stdout.close()
+
+    # Unlike Popen.wait, this gives us resource usage of the program.
+    pid, wait_status, rusage = os.wait4(program_subprocess.pid, 0)
+    program_subprocess.returncode = get_exit_code(wait_status)
+    max_rss_bytes = rusage.ru_maxrss
+    if sys.platform != 'darwin':
+        # Linux reports this in kilobytes.
+        max_rss_bytes *= 1024
+    if trace_env_var:
+        trace_thread.join(TRACE_READ_TIMEOUT_SEC)
+    return StreamedProgramResult(
+            returncode=program_subprocess.returncode,
+            elapsed_time_sec=time.time() - start_time_sec,
+            cpu_time_sec=rusage.ru_utime + rusage.ru_stime,
+            max_rss_bytes=max_rss_bytes,
+            num_output_bytes=num_output_bytes,
+            output_tail=output_tail.get(),
+            cancelled=cancelled,
+            trace_tail=trace_tail.get() if trace_tail else None)
+
+
 def mkdir_p(d):
     """
     Similar to the "mkdir -p ..." shell command. Creates the given directory and all enclosing
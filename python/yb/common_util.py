@@ -4,6 +4,7 @@ Copyright (c) YugaByte, Inc.
 This module provides common utility functions.
 """
 
+import collections
 import itertools
 import logging
 import os
@@ -105,6 +106,56 @@ def get_bool_env_var(env_var_name):
     return value.lower() in ['1', 't', 'true', 'y', 'yes']
 
 
+class LRUCache:
+    """
+    A cache with a bounded number of entries, where the least recently used entries are evicted
+    first. Also keeps track of the number of hits and misses.
+
+    >>> cache = LRUCache(2)
+    >>> cache.put('a', 1)
+    >>> cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> sorted(cache.keys())
+    ['a', 'c']
+    >>> (cache.hits, cache.misses)
+    (1, 1)
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
 def is_yugabyte_git_repo_dir(d):
     for subdir in ['.git', 'src', 'java', 'bin', 'build-support']:
         if not os.path.exists(os.path.join(d, subdir)):
@@ -7,23 +7,47 @@ tests that might be affected by changes to the given set of source files.
 
 from __future__ import print_function
 from six import iteritems
+from six.moves import socketserver
 
 import argparse
+import contextlib
+import copy
 import fnmatch
+import gc
+import hashlib
 import json
 import logging
+import math
+import mmap
+import multiprocessing
 import os
+import random
 import re
+import resource
+import shutil
+import socket
+import stat
+import struct
 import subprocess
 import sys
+import tempfile
 import unittest
+from array import array
+from collections import defaultdict
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from yb.common_util import group_by, make_set, get_build_type_from_build_root, \
-                           convert_to_non_ninja_build_root, get_bool_env_var  # nopep8
+                           convert_to_non_ninja_build_root, get_bool_env_var, LRUCache  # nopep8
 from yb.command_util import mkdir_p  # nopep8
+from yb.test_reports import DEFAULT_MAX_REPORTS  # nopep8
+from yb.test_report_store import load_test_history  # nopep8
+from yb.test_result_cache import FileDigestCache  # nopep8
+from yb.header_impact import HeaderImpactAnalyzer, get_changed_identifiers_by_path, is_header, \
+                             HEADER_ANALYSIS_MODES, HEADER_ANALYSIS_NONE, \
+                             HEADER_ANALYSIS_SYMBOLS  # nopep8
 
 
 def make_extensions(exts_without_dot):
@@ -47,23 +71,121 @@ EXECUTABLE_FILE_NAME_RE = re.compile(r'^[a-zA-Z0-9_.-]+$')
 # libraries.
 IGNORED_CMAKE_TARGETS = ['gen_version_info', 'latest_symlink', 'gen_proto']
 
+# Files in the Make-based build tree that we get dependencies from.
+BUILD_FILES_TO_PARSE = set(['depend.make', 'link.txt'])
+
+# The version of the file format we use to save the state of the dependency graph build inputs,
+# which is used for incremental rebuilds of the dependency graph.
+BUILD_INPUTS_FORMAT_VERSION = 1
+
 LIST_DEPS_CMD = 'deps'
 LIST_REVERSE_DEPS_CMD = 'rev-deps'
 LIST_AFFECTED_CMD = 'affected'
 SELF_TEST_CMD = 'self-test'
-
-COMMANDS = [LIST_DEPS_CMD,
-            LIST_REVERSE_DEPS_CMD,
-            LIST_AFFECTED_CMD,
-            SELF_TEST_CMD]
+BENCHMARK_LOAD_CMD = 'benchmark-load'
+SERVE_CMD = 'serve'
+DIFF_GRAPHS_CMD = 'diff-graphs'
+EXPLAIN_CMD = 'explain'
+
+QUERY_COMMANDS = [LIST_DEPS_CMD,
+                  LIST_REVERSE_DEPS_CMD,
+                  LIST_AFFECTED_CMD]
+
+COMMANDS = QUERY_COMMANDS + [SELF_TEST_CMD,
+                             BENCHMARK_LOAD_CMD,
+                             SERVE_CMD,
+                             DIFF_GRAPHS_CMD,
+                             EXPLAIN_CMD]
+
+# An additional request type supported by the dependency graph server, returning information about
+# the loaded graph.
+SERVER_STATUS_REQUEST = 'status'
+
+# The default name of the Unix domain socket the dependency graph server listens on, in the build
+# root.
+SERVER_SOCKET_FILE_NAME = 'dependency_graph.sock'
+
+# The dependency graph server handles one client at a time, so it disconnects clients that do not
+# send a complete request within this time, so that they do not block other clients.
+SERVER_CLIENT_TIMEOUT_SEC = 10
+
+# The name of the file in the build root where digests of file contents are saved between runs, so
+# that digests of transitive inputs of test programs can be computed without reading unchanged
+# files.
+FILE_DIGEST_CACHE_FILE_NAME = 'dependency_graph_file_digests.json'
+
+# Inputs of every C++ test that the dependency graph does not track: the scripts that run tests,
+# relative to the source root, and the server executables that external mini-cluster tests start
+# as separate processes. These are folded into the digest of every test program.
+TEST_SCRIPT_INPUTS = [
+    'build-support/run-test.sh',
+    'build-support/common-test-env.sh',
+    'build-support/common-build-env.sh',
+]
+TEST_SERVER_EXECUTABLES = ['yb-master', 'yb-tserver']
+
+# Formats of the saved dependency graph, and the corresponding file names in the build root.
+GRAPH_FORMAT_JSON = 'json'
+GRAPH_FORMAT_BINARY = 'binary'
+GRAPH_FORMAT_JSONL = 'jsonl'
+GRAPH_FILE_NAMES = {
+    GRAPH_FORMAT_JSON: 'dependency_graph.json',
+    GRAPH_FORMAT_BINARY: 'dependency_graph.bin',
+    GRAPH_FORMAT_JSONL: 'dependency_graph.jsonl'
+}
+
+# In-memory representations of the dependency graph: DependencyGraph, where every node is an object
+# with its own sets of dependencies, or the read-only CompactDependencyGraph.
+GRAPH_BACKEND_OBJECTS = 'objects'
+GRAPH_BACKEND_COMPACT = 'compact'
+GRAPH_BACKENDS = [GRAPH_BACKEND_OBJECTS, GRAPH_BACKEND_COMPACT]
+
+# The binary format of the dependency graph starts with this magic string, followed by the format
+# version, the length of a JSON header, and the header itself. The header describes the location of
+# the other sections of the file. Paths are stored as a table of directories (each relative to one
+# of a few well-known prefixes such as $BUILD_ROOT) and a list of (directory index, basename) pairs.
+# Dependencies are stored in the compressed sparse row (CSR) form: for node i, its dependencies are
+# the node ids dep_targets[dep_offsets[i]:dep_offsets[i + 1]].
+BINARY_GRAPH_MAGIC = b'YBDG'
+BINARY_GRAPH_FORMAT_VERSION = 1
+BINARY_GRAPH_HEADER_STRUCT = struct.Struct('<4sII')
+
+# The line-delimited JSON format of the dependency graph can be loaded as a stream, without holding
+# the whole file or its parsed representation in memory. The first line is a header object with the
+# format name and version and the node and edge counts. It is followed by one line per node, in node
+# id order: ["n", path, node type], where paths may start with one of the aliases returned by
+# get_path_prefixes, and then one line per node with dependencies, in node id order:
+# ["d", node id, [dependency node ids]].
+JSONL_GRAPH_FORMAT_NAME = 'yb_dependency_graph'
+JSONL_GRAPH_FORMAT_VERSION = 1
+JSONL_NODE_RECORD = 'n'
+JSONL_DEPS_RECORD = 'd'
+
+# Ways of checking that files corresponding to dependency graph nodes exist after loading a saved
+# graph: check all of them, a random sample of them, only the ones used by queries, or none.
+VALIDATION_MODE_FULL = 'full'
+VALIDATION_MODE_SAMPLED = 'sampled'
+VALIDATION_MODE_LAZY = 'lazy'
+VALIDATION_MODE_NONE = 'none'
+VALIDATION_MODES = [VALIDATION_MODE_FULL,
+                    VALIDATION_MODE_SAMPLED,
+                    VALIDATION_MODE_LAZY,
+                    VALIDATION_MODE_NONE]
 
 HOME_DIR = os.path.realpath(os.path.expanduser('~'))
 
 # This will match any node type (node types being sources/libraries/tests/etc.)
 NODE_TYPE_ANY = 'any'
 
+# All node types returned by get_node_type_by_path. The index of a node type in this list is used to
+# represent it in the binary format of the dependency graph.
+NODE_TYPES = ['source', 'library', 'test', 'object', 'executable', 'other']
+
 CATEGORY_DOES_NOT_AFFECT_TESTS = 'does_not_affect_tests'
 
+# How much a historical failure rate of 100% increases the relevance score of a test program.
+HISTORICAL_FAILURE_RATE_WEIGHT = 1.0
+
 # File changes in any category other than these will cause all tests to be re-run.  Even though
 # changes to Python code affect the test framework, we can consider this Python code to be
 # reasonably tested already, by running doctests, this script, the packaging script, etc.  We can
@@ -124,13 +246,37 @@ def get_node_type_by_path(path):
     return 'other'
 
 
+def get_pretty_path(path, conf):
+    for prefix, alias in [(conf.build_root, '$BUILD_ROOT'),
+                          (conf.yb_src_root, '$YB_SRC_ROOT'),
+                          (HOME_DIR, '~')]:
+        if path.startswith(prefix + '/'):
+            return alias + '/' + path[len(prefix) + 1:]
+
+    return path
+
+
+def validate_path_existence(path, conf, source_str):
+    if not os.path.exists(path) and not conf.incomplete_build:
+        raise RuntimeError(
+                "Path does not exist: '{}'. This node was found in: {}".format(
+                    path, source_str))
+
+
 class Node:
     """
     A node in the dependency graph. Could be a source file, a header file, an object file, a
     dynamic library, or an executable.
     """
-    def __init__(self, path, dep_graph, source_str):
-        path = os.path.realpath(path)
+    def __init__(self, path, dep_graph, source_str, node_type=None):
+        """
+        @param node_type the type of this node, if already known (e.g. when loading a saved graph).
+                         In that case the path is also assumed to be canonical, and we don't have to
+                         access the file system.
+        """
+        if node_type is None:
+            path = os.path.realpath(path)
+            node_type = get_node_type_by_path(path)
         self.path = path
 
         # Other nodes that this node depends on.
@@ -139,7 +285,7 @@ class Node:
         # Nodes that depend on this node.
         self.reverse_deps = set()
 
-        self.node_type = get_node_type_by_path(path)
+        self.node_type = node_type
         self.dep_graph = dep_graph
         self.conf = dep_graph.conf
         self.source_str = source_str
@@ -148,6 +294,12 @@ class Node:
         assert self is not dep
         self.deps.add(dep)
         dep.reverse_deps.add(self)
+        self.dep_graph.invalidate_query_caches()
+
+    def remove_dependency(self, dep):
+        self.deps.discard(dep)
+        dep.reverse_deps.discard(self)
+        self.dep_graph.invalidate_query_caches()
 
     def __eq__(self, other):
         if not isinstance(other, Node):
@@ -162,19 +314,10 @@ class Node:
         return self.node_type == 'source'
 
     def validate_existence(self):
-        if not os.path.exists(self.path) and not self.dep_graph.conf.incomplete_build:
-            raise RuntimeError(
-                    "Path does not exist: '{}'. This node was found in: {}".format(
-                        self.path, self.source_str))
+        validate_path_existence(self.path, self.conf, self.source_str)
 
     def get_pretty_path(self):
-        for prefix, alias in [(self.conf.build_root, '$BUILD_ROOT'),
-                              (self.conf.yb_src_root, '$YB_SRC_ROOT'),
-                              (HOME_DIR, '~')]:
-            if self.path.startswith(prefix + '/'):
-                return alias + '/' + self.path[len(prefix) + 1:]
-
-        return self.path
+        return get_pretty_path(self.path, self.conf)
 
     def __str__(self):
         return "Node(\"{}\", type={}, {} deps, {} rev deps)".format(
@@ -223,6 +366,207 @@ class Node:
         return None
 
 
+def get_file_signature(path, contents=None, stat_result=None):
+    """
+    @param contents the contents of the file if the caller has already read them, so that the file
+                    does not have to be read again
+    @param stat_result the result of os.stat for the file, taken before its contents were read
+    @return a dictionary with the modification time, the size, and a hash of the file's contents,
+            used to detect changes to files that the dependency graph is built from.
+    """
+    if stat_result is None:
+        stat_result = os.stat(path)
+    if contents is None:
+        with open(path, 'rb') as input_file:
+            contents = input_file.read()
+    return dict(mtime=stat_result.st_mtime, size=stat_result.st_size,
+                sha1=hashlib.sha1(contents).hexdigest())
+
+
+def read_file_with_signature(path, with_signature):
+    """
+    Reads a file that the dependency graph is built from, computing its signature from the same
+    contents, so that the file is only read once.
+
+    @return a tuple of the contents of the given file as a string and its signature as returned by
+            get_file_signature, or None if with_signature is False
+    """
+    stat_result = os.stat(path)
+    with open(path, 'rb') as input_file:
+        contents = input_file.read()
+    signature = None
+    if with_signature:
+        signature = get_file_signature(path, contents, stat_result)
+    if not isinstance(contents, str):
+        contents = contents.decode('utf-8')
+    return contents, signature
+
+
+def is_file_unchanged(path, old_signature):
+    """
+    Checks if the given file is unchanged compared to a signature returned by get_file_signature.
+    Only reads the file if its modification time or size is different from the saved one. If the
+    contents are still the same, the modification time in old_signature is updated.
+    """
+    if not old_signature or not os.path.exists(path):
+        return False
+    stat_result = os.stat(path)
+    if stat_result.st_size != old_signature['size']:
+        return False
+    if stat_result.st_mtime == old_signature['mtime']:
+        return True
+    if get_file_signature(path)['sha1'] != old_signature['sha1']:
+        return False
+    old_signature['mtime'] = stat_result.st_mtime
+    return True
+
+
+def array_from_bytes(typecode, data):
+    result = array(typecode)
+    if hasattr(result, 'frombytes'):
+        result.frombytes(data)
+    else:
+        result.fromstring(data)
+    return result
+
+
+def array_to_bytes(arr):
+    if hasattr(arr, 'tobytes'):
+        return arr.tobytes()
+    return arr.tostring()
+
+
+def read_binary_graph(conf, input_path):
+    """
+    Reads a dependency graph saved with DependencyGraph.save_as_binary. Paths are relocated to the
+    build root and source root of the given configuration.
+
+    @return a (paths, node_type_ids, dep_offsets, dep_targets) tuple, where the last three items are
+            arrays, and dependencies are in the compressed sparse row form.
+    """
+    with open(input_path, 'rb') as input_file:
+        data = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        header_size = BINARY_GRAPH_HEADER_STRUCT.size
+        magic, version, header_len = BINARY_GRAPH_HEADER_STRUCT.unpack(data[:header_size])
+        if magic != BINARY_GRAPH_MAGIC:
+            raise RuntimeError("Not a binary dependency graph file: '{}'".format(input_path))
+        if version != BINARY_GRAPH_FORMAT_VERSION:
+            raise RuntimeError(
+                "Unsupported binary dependency graph format version {} in '{}'".format(
+                    version, input_path))
+        header = json.loads(data[header_size:header_size + header_len].decode('utf-8'))
+        if header['int_size'] != array('i').itemsize:
+            raise RuntimeError(
+                "'{}' was saved on a platform with {}-byte integers".format(
+                    input_path, header['int_size']))
+        data_start = header_size + header_len
+
+        def read_section(section_name):
+            offset, length = header['sections'][section_name]
+            return data[data_start + offset:data_start + offset + length]
+
+        def read_strings(section_name):
+            section_data = read_section(section_name).decode('utf-8')
+            if not section_data and header['num_nodes'] == 0:
+                return []
+            return section_data.split('\n')
+
+        dir_prefix_ids = array_from_bytes('b', read_section('dir_prefix_ids'))
+        dir_suffixes = read_strings('dir_suffixes')
+        node_dir_ids = array_from_bytes('i', read_section('node_dir_ids'))
+        node_basenames = read_strings('node_basenames')
+        node_type_ids = array_from_bytes('b', read_section('node_types'))
+        dep_offsets = array_from_bytes('i', read_section('dep_offsets'))
+        dep_targets = array_from_bytes('i', read_section('dep_targets'))
+    finally:
+        data.close()
+
+    prefix_by_alias = dict(get_path_prefixes(conf))
+    prefixes = [prefix_by_alias[alias] for alias in header['prefixes']]
+    dir_paths = []
+    for prefix_id, suffix in zip(dir_prefix_ids, dir_suffixes):
+        if prefix_id < 0:
+            dir_paths.append(suffix)
+        elif suffix:
+            dir_paths.append(prefixes[prefix_id] + '/' + suffix)
+        else:
+            dir_paths.append(prefixes[prefix_id])
+
+    paths = [dir_paths[dir_id] + '/' + basename
+             for dir_id, basename in zip(node_dir_ids, node_basenames)]
+    return paths, node_type_ids, dep_offsets, dep_targets
+
+
+def read_jsonl_graph(conf, input_path):
+    """
+    Reads a dependency graph saved with DependencyGraph.save_as_jsonl one line at a time. Paths are
+    relocated to the build root and source root of the given configuration.
+
+    @return a generator of (JSONL_NODE_RECORD, path, node type id) and (JSONL_DEPS_RECORD, node id,
+            dependency node ids) tuples, in the order they appear in the file
+    """
+    prefix_by_alias = dict(get_path_prefixes(conf))
+    num_nodes = 0
+    num_edges = 0
+    with open(input_path) as input_file:
+        header = json.loads(input_file.readline() or '{}')
+        if header.get('format') != JSONL_GRAPH_FORMAT_NAME:
+            raise RuntimeError(
+                    "Not a line-delimited JSON dependency graph file: '{}'".format(input_path))
+        if header['version'] != JSONL_GRAPH_FORMAT_VERSION:
+            raise RuntimeError(
+                    "Unsupported line-delimited JSON dependency graph format version {} in "
+                    "'{}'".format(header['version'], input_path))
+
+        for line in input_file:
+            record = json.loads(line)
+            if record[0] == JSONL_NODE_RECORD:
+                path = record[1]
+                if path.startswith('$'):
+                    alias, sep, rel_path = path.partition('/')
+                    path = prefix_by_alias[alias] + sep + rel_path
+                yield JSONL_NODE_RECORD, path, NODE_TYPES.index(record[2])
+                num_nodes += 1
+            elif record[0] == JSONL_DEPS_RECORD:
+                yield JSONL_DEPS_RECORD, record[1], record[2]
+                num_edges += len(record[2])
+            else:
+                raise RuntimeError("Unknown record type in '{}': {}".format(
+                    input_path, line.strip()))
+
+    if num_nodes != header['num_nodes'] or num_edges != header['num_edges']:
+        raise RuntimeError(
+                "Expected {} nodes and {} edges in '{}', found {} nodes and {} edges. The file "
+                "might be truncated.".format(header['num_nodes'], header['num_edges'],
+                                             input_path, num_nodes, num_edges))
+
+
+def get_path_prefixes(conf):
+    """
+    @return (alias, path) pairs of prefixes used to store paths in a relocatable way, most specific
+            first.
+    """
+    return [('$BUILD_ROOT', conf.build_root),
+            ('$YB_SRC_ROOT', conf.yb_src_root)]
+
+
+def get_relocatable_path(path, prefixes):
+    """
+    @param prefixes (alias, path) pairs returned by get_path_prefixes
+    @return the given path with the first matching prefix replaced with its alias
+
+    >>> get_relocatable_path('/b/lib/libx.so', [('$BUILD_ROOT', '/b'), ('$YB_SRC_ROOT', '/')])
+    '$BUILD_ROOT/lib/libx.so'
+    >>> get_relocatable_path('/usr/lib/liby.so', [('$BUILD_ROOT', '/b')])
+    '/usr/lib/liby.so'
+    """
+    for alias, prefix in prefixes:
+        if path.startswith(prefix + '/'):
+            return alias + path[len(prefix):]
+    return path
+
+
 def set_to_str(items):
     return ",\n".join(sorted(items))
 
@@ -251,6 +595,12 @@ class Configuration:
         self.ent_src_dir_path = os.path.join(self.yb_src_root, 'ent', 'src')
         self.rel_path_base_dirs = set([self.build_root, os.path.join(self.src_dir_path, 'yb')])
         self.incomplete_build = args.incomplete_build
+        self.parse_jobs = args.jobs
+        self.reverse_closure_cache_size = args.reverse_closure_cache_size
+        self.validation_mode = args.validation_mode
+        self.validation_sample_fraction = args.validation_sample_fraction
+        self.validation_threads = args.validation_threads
+        self.path_cache_size = args.path_cache_size
 
         self.file_regex = args.file_regex
         if not self.file_regex and args.file_name_glob:
@@ -260,47 +610,325 @@ class Configuration:
         assert os.path.exists(self.ent_src_dir_path)
 
 
+class FileSystemIndex:
+    """
+    An in-memory index of files and directories under a few base directories, built with one scan
+    of each base directory. Allows checking existence of files, and finding their real paths, with
+    no system calls in the common case. Symbolic links are recorded but not followed, and paths
+    going through them are left to the file system.
+    """
+    def __init__(self, base_dirs):
+        self.base_dirs = []
+        self.real_base_dirs = {}
+        self.entries = set()
+        self.symlinks = set()
+        start_time = datetime.now()
+        for base_dir in sorted(set(base_dirs)):
+            if not os.path.isdir(base_dir) or any(
+                    base_dir.startswith(indexed_dir + '/') for indexed_dir in self.base_dirs):
+                continue
+            self.base_dirs.append(base_dir)
+            self.real_base_dirs[base_dir] = os.path.realpath(base_dir)
+            self.scan(base_dir)
+        logging.info("Indexed %d files and directories in %s in %.2f sec" % (
+            len(self.entries), ', '.join(self.base_dirs),
+            (datetime.now() - start_time).total_seconds()))
+
+    def scan(self, base_dir):
+        self.entries.add(base_dir)
+        stack = [base_dir]
+        while stack:
+            dir_path = stack.pop()
+            try:
+                names = os.listdir(dir_path)
+            except OSError as ex:
+                logging.warning("Could not list directory '{}': {}".format(dir_path, ex))
+                continue
+            for name in names:
+                path = os.path.join(dir_path, name)
+                try:
+                    mode = os.lstat(path).st_mode
+                except OSError:
+                    continue
+                if stat.S_ISLNK(mode):
+                    self.symlinks.add(path)
+                    continue
+                self.entries.add(path)
+                if stat.S_ISDIR(mode):
+                    stack.append(path)
+
+    def get_base_dir(self, path):
+        """
+        @return the indexed base directory containing the given normalized absolute path, if the
+                path does not go through any symbolic links below that directory, or None
+        """
+        for base_dir in self.base_dirs:
+            if path == base_dir or path.startswith(base_dir + '/'):
+                parent_path = path
+                while parent_path != base_dir:
+                    if parent_path in self.symlinks:
+                        return None
+                    parent_path = os.path.dirname(parent_path)
+                return base_dir
+        return None
+
+    def exists(self, path):
+        """
+        @param path a normalized absolute path
+        @return whether the path exists, or None if the index cannot tell
+        """
+        if path in self.entries:
+            return True
+        if self.get_base_dir(path) is None:
+            return None
+        return False
+
+    def get_real_path(self, path):
+        """
+        @param path a normalized absolute path
+        @return the real path, or None if the index cannot tell
+        """
+        if path not in self.entries:
+            return None
+        base_dir = self.get_base_dir(path)
+        if base_dir is None:
+            return None
+        return self.real_base_dirs[base_dir] + path[len(base_dir):]
+
+
+class PathResolver:
+    """
+    Resolves relative paths found in build files against the base directories in the
+    configuration, and converts paths to canonical paths used as dependency graph node paths. Uses a
+    FileSystemIndex, if one has been built, instead of the file system, and falls back to the file
+    system for paths the index does not cover. Keeps a bounded cache of canonical paths shared by
+    everything that adds nodes to a dependency graph, and counts cache hits and misses.
+    """
+    def __init__(self, conf):
+        self.conf = conf
+        self.index = None
+        self.canonical_path_cache = LRUCache(conf.path_cache_size)
+        self.resolved_rel_paths = {}
+        self.unresolvable_rel_paths = set()
+        self.useful_base_dirs = set()
+        self.num_index_lookups = 0
+        self.num_file_system_lookups = 0
+
+    def build_index(self):
+        self.index = FileSystemIndex(
+                list(self.conf.rel_path_base_dirs) +
+                [self.conf.build_root_make, self.conf.src_dir_path, self.conf.ent_src_dir_path])
+
+    def exists(self, path):
+        if self.index:
+            exists = self.index.exists(path)
+            if exists is not None:
+                self.num_index_lookups += 1
+                return exists
+        self.num_file_system_lookups += 1
+        return os.path.exists(path)
+
+    def resolve_rel_path(self, rel_path):
+        if is_abs_path(rel_path):
+            return rel_path
+
+        if rel_path in self.unresolvable_rel_paths:
+            return None
+        existing_resolution = self.resolved_rel_paths.get(rel_path)
+        if existing_resolution:
+            return existing_resolution
+
+        candidates = set()
+        for base_dir in self.conf.rel_path_base_dirs:
+            candidate_path = os.path.abspath(os.path.join(base_dir, rel_path))
+            if self.exists(candidate_path):
+                self.useful_base_dirs.add(base_dir)
+                candidates.add(candidate_path)
+        if not candidates:
+            self.unresolvable_rel_paths.add(rel_path)
+            return None
+        if len(candidates) > 1:
+            logging.warning("Ambiguous ways to resolve '{}': '{}'".format(
+                rel_path, set_to_str(candidates)))
+            self.unresolvable_rel_paths.add(rel_path)
+            return None
+
+        resolved = list(candidates)[0]
+        self.resolved_rel_paths[rel_path] = resolved
+        return resolved
+
+    def canonicalize_path(self, path):
+        canonical_path = self.canonical_path_cache.get(path)
+        if canonical_path:
+            return canonical_path
+
+        if self.index and is_abs_path(path) and os.path.normpath(path) == path:
+            canonical_path = self.index.get_real_path(path)
+        if canonical_path:
+            self.num_index_lookups += 1
+        else:
+            self.num_file_system_lookups += 1
+            canonical_path = os.path.realpath(path)
+        if canonical_path.startswith(self.conf.build_root_make + '/'):
+            canonical_path = self.conf.build_root + '/' + \
+                             canonical_path[len(self.conf.build_root_make) + 1:]
+        self.canonical_path_cache.put(path, canonical_path)
+        return canonical_path
+
+    def get_stats(self):
+        return dict(
+            canonical_path_cache_hits=self.canonical_path_cache.hits,
+            canonical_path_cache_misses=self.canonical_path_cache.misses,
+            index_lookups=self.num_index_lookups,
+            file_system_lookups=self.num_file_system_lookups)
+
+    def add_stats(self, stats):
+        """
+        Adds counters returned by get_stats of another path resolver, e.g. one used by a worker
+        process, to the counters of this one.
+        """
+        self.canonical_path_cache.hits += stats['canonical_path_cache_hits']
+        self.canonical_path_cache.misses += stats['canonical_path_cache_misses']
+        self.num_index_lookups += stats['index_lookups']
+        self.num_file_system_lookups += stats['file_system_lookups']
+
+    def log_stats(self):
+        logging.info(
+                "Path resolution: %d canonical path cache hits, %d misses, %d lookups using the "
+                "file system index, %d using the file system" % (
+                    self.canonical_path_cache.hits, self.canonical_path_cache.misses,
+                    self.num_index_lookups, self.num_file_system_lookups))
+
+
+class GraphBuildPhase:
+    """
+    Statistics of one phase of building or loading a dependency graph. Code running the phase adds
+    phase-specific counters, such as the number of files and bytes read, and can set the
+    dependency graph and path resolver if it creates them.
+    """
+    def __init__(self, name, dep_graph, path_resolver):
+        self.name = name
+        self.dep_graph = dep_graph
+        self.path_resolver = path_resolver
+        self.counters = {}
+
+
+class GraphBuildProfiler:
+    """
+    Collects the wall time, counters, node and edge counts, and path resolution statistics of every
+    phase of building or loading a dependency graph, for the --profile option. When disabled,
+    phases are still run, but nothing is measured.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = []
+        self.start_time = datetime.now()
+
+    @contextlib.contextmanager
+    def phase(self, name, dep_graph=None, path_resolver=None):
+        """
+        A context manager for running a phase. Yields a GraphBuildPhase.
+        """
+        phase = GraphBuildPhase(name, dep_graph, path_resolver)
+        if not self.enabled:
+            yield phase
+            return
+
+        path_stats_before = path_resolver.get_stats() if path_resolver else {}
+        start_time = datetime.now()
+        yield phase
+        phase_json = dict(name=name,
+                          wall_time_sec=(datetime.now() - start_time).total_seconds())
+        phase_json.update(phase.counters)
+        if phase.dep_graph:
+            phase_json['num_nodes'] = phase.dep_graph.get_num_nodes()
+            phase_json['num_edges'] = phase.dep_graph.get_num_edges()
+        if phase.path_resolver:
+            path_stats = phase.path_resolver.get_stats()
+            for key, value in iteritems(path_stats):
+                path_stats[key] = value - path_stats_before.get(key, 0)
+            num_lookups = (path_stats['canonical_path_cache_hits'] +
+                           path_stats['canonical_path_cache_misses'])
+            path_stats['canonical_path_cache_hit_rate'] = (
+                    float(path_stats['canonical_path_cache_hits']) / num_lookups
+                    if num_lookups else None)
+            phase_json['path_resolution'] = path_stats
+        self.phases.append(phase_json)
+
+    def get_report(self):
+        return dict(
+            phases=self.phases,
+            total_wall_time_sec=(datetime.now() - self.start_time).total_seconds())
+
+    def save_report(self, output_path):
+        with open(output_path, 'w') as output_file:
+            json.dump(self.get_report(), output_file, indent=2, sort_keys=True)
+        logging.info("Saved the dependency graph build profile to '{}'".format(output_path))
+
+
 class DependencyGraphBuilder:
     """
     Builds a dependency graph from the contents of the build directory. Each node of the graph is
     a file (an executable, a dynamic library, or a source file).
     """
-    def __init__(self, conf):
+    def __init__(self, conf, profiler=None, record_build_inputs=False):
+        """
+        @param record_build_inputs whether to keep the edges contributed by each build file, and
+                                   signatures of the build files, for save_build_inputs
+        """
         self.conf = conf
+        self.record_build_inputs = record_build_inputs
+        self.profiler = profiler or GraphBuildProfiler(enabled=False)
         self.compile_dirs = set()
         self.compile_commands = None
-        self.useful_base_dirs = set()
-        self.unresolvable_rel_paths = set()
-        self.resolved_rel_paths = {}
-        self.dep_graph = DependencyGraph(conf)
+        self.path_resolver = PathResolver(conf)
+        self.dep_graph = DependencyGraph(conf, path_resolver=self.path_resolver)
         self.cmake_deps = {}
 
+        # Edges contributed by each depend.make / link.txt file, and signatures of these files.
+        # These are saved alongside the dependency graph and used for incremental rebuilds.
+        self.edges_by_build_file = {}
+        self.build_file_signatures = {}
+        self.cmake_deps_signature = None
+
+        # Edges added based on dependencies between CMake targets.
+        self.cmake_edges = []
+
+    def get_cmake_deps_path(self):
+        return os.path.join(self.conf.build_root, 'yb_cmake_deps.txt')
+
+    def profile_phase(self, name):
+        return self.profiler.phase(name, self.dep_graph, self.dep_graph.path_resolver)
+
     def load_cmake_deps(self):
-        cmake_deps_path = os.path.join(self.conf.build_root, 'yb_cmake_deps.txt')
+        cmake_deps_path = self.get_cmake_deps_path()
         logging.info("Loading dependencies between CMake targets from '{}'".format(
             cmake_deps_path))
-        with open(cmake_deps_path) as cmake_deps_file:
-            for line in cmake_deps_file:
-                line = line.strip()
-                if not line:
-                    continue
-                items = [item.strip() for item in line.split(':')]
-                if len(items) != 2:
-                    raise RuntimeError(
-                            "Expected to find two items when splitting line on ':', found {}:\n{}",
-                            len(items), line)
-                lhs, rhs = items
-                if lhs in IGNORED_CMAKE_TARGETS:
-                    continue
-                cmake_dep_set = self.cmake_deps.get(lhs)
-                if not cmake_dep_set:
-                    cmake_dep_set = set()
-                    self.cmake_deps[lhs] = cmake_dep_set
+        self.cmake_deps = {}
+        cmake_deps_contents, self.cmake_deps_signature = read_file_with_signature(
+                cmake_deps_path, self.record_build_inputs)
+        self.cmake_deps_size = len(cmake_deps_contents)
+        for line in cmake_deps_contents.split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            items = [item.strip() for item in line.split(':')]
+            if len(items) != 2:
+                raise RuntimeError(
+                        "Expected to find two items when splitting line on ':', found {}:\n{}",
+                        len(items), line)
+            lhs, rhs = items
+            if lhs in IGNORED_CMAKE_TARGETS:
+                continue
+            cmake_dep_set = self.cmake_deps.get(lhs)
+            if not cmake_dep_set:
+                cmake_dep_set = set()
+                self.cmake_deps[lhs] = cmake_dep_set
 
-                for cmake_dep in rhs.split(';'):
-                    if cmake_dep in IGNORED_CMAKE_TARGETS:
-                        continue
-                    cmake_dep_set.add(cmake_dep)
+            for cmake_dep in rhs.split(';'):
+                if cmake_dep in IGNORED_CMAKE_TARGETS:
+                    continue
+                cmake_dep_set.add(cmake_dep)
 
         self.cmake_targets = set()
         for cmake_target, cmake_target_deps in iteritems(self.cmake_deps):
@@ -308,32 +936,120 @@ class DependencyGraphBuilder:
         logging.info("Found {} CMake targets in '{}'".format(
             len(self.cmake_targets), cmake_deps_path))
 
-    def parse_link_and_depend_files(self):
+    def find_link_and_depend_files(self):
+        """
+        @return a list of all depend.make and link.txt files in the Make-based build tree.
+        """
+        file_paths = []
+        for root, dirs, files in os.walk(self.conf.build_root_make):
+            for file_name in files:
+                if file_name in BUILD_FILES_TO_PARSE:
+                    file_paths.append(os.path.join(root, file_name))
+        return file_paths
+
+    def parse_build_file(self, file_path, contents):
+        """
+        Parses a depend.make or a link.txt file. Does not modify the dependency graph, so that this
+        could be done in a worker process.
+
+        @param contents the contents of the file
+        @return a list of (dependent_path, dependency_paths) tuples, with all paths canonicalized
+        """
+        if os.path.basename(file_path) == 'depend.make':
+            edges = self.parse_depend_file(contents)
+        else:
+            edges = self.parse_link_txt_file(file_path, contents)
+        canonicalize_path = self.dep_graph.canonicalize_path
+        return [(canonicalize_path(dependent),
+                 [canonicalize_path(dependency) for dependency in dependencies])
+                for dependent, dependencies in edges]
+
+    def add_parsed_edges(self, file_path, edges):
+        """
+        Adds dependency edges returned by parse_build_file to the dependency graph.
+        """
+        is_link_txt = os.path.basename(file_path) == 'link.txt'
+        for dependent, dependencies in edges:
+            dependent_node = self.dep_graph.find_or_create_node(
+                    dependent, source_str=file_path, is_canonical=True)
+            if is_link_txt:
+                dependent_node.validate_existence()
+            for dependency in dependencies:
+                dependent_node.add_dependency(self.dep_graph.find_or_create_node(
+                    dependency, source_str=file_path, is_canonical=True))
+
+    def parse_link_and_depend_files(self, file_paths=None):
+        """
+        Parses the given depend.make and link.txt files, or all such files in the build tree if
+        file_paths is not specified, and adds the resulting edges to the dependency graph.
+
+        @return a dictionary with the number of files parsed and bytes read
+        """
         logging.info(
                 "Parsing link.txt and depend.make files from the build tree at '{}'".format(
                     self.conf.build_root_make))
         start_time = datetime.now()
 
+        if file_paths is None:
+            file_paths = self.find_link_and_depend_files()
+        num_jobs = min(self.conf.parse_jobs, max(1, len(file_paths)))
+        logging.info("Found {} link.txt and depend.make files, parsing them using {} {}".format(
+            len(file_paths), num_jobs, 'process' if num_jobs == 1 else 'processes'))
+
+        pool = None
+        if num_jobs > 1:
+            global parse_worker_builder
+            parse_worker_builder = self
+            pool = multiprocessing.Pool(num_jobs)
+            # Send files to workers in chunks to amortize inter-process communication overhead.
+            chunk_size = max(1, min(64, len(file_paths) // (num_jobs * 4)))
+            parse_results = pool.imap_unordered(
+                    parse_build_file_in_worker, file_paths, chunk_size)
+        else:
+            parse_results = (parse_build_file_with_signature(self, file_path) + (None,)
+                             for file_path in file_paths)
+
         num_parsed = 0
-        for root, dirs, files in os.walk(self.conf.build_root_make):
-            for file_name in files:
-                file_path = os.path.join(root, file_name)
-                if file_name == 'depend.make':
-                    self.parse_depend_file(file_path)
-                    num_parsed += 1
-                elif file_name == 'link.txt':
-                    self.parse_link_txt_file(file_path)
-                    num_parsed += 1
-            if num_parsed % 10 == 0:
-                print('.', end='', file=sys.stderr)
-                sys.stderr.flush()
+        num_bytes_read = 0
+        merge_time_sec = 0.0
+        try:
+            for file_path, num_bytes, signature, edges, path_stats in parse_results:
+                num_bytes_read += num_bytes
+                if path_stats:
+                    self.path_resolver.add_stats(path_stats)
+                merge_start_time = datetime.now()
+                self.add_parsed_edges(file_path, edges)
+                if self.record_build_inputs:
+                    self.edges_by_build_file[file_path] = edges
+                    self.build_file_signatures[file_path] = signature
+                merge_time_sec += (datetime.now() - merge_start_time).total_seconds()
+                num_parsed += 1
+                if num_parsed % 10 == 0:
+                    print('.', end='', file=sys.stderr)
+                    sys.stderr.flush()
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
         print('', file=sys.stderr)
         sys.stderr.flush()
 
-        logging.info("Parsed link.txt and depend.make files in %.2f seconds" %
-                     (datetime.now() - start_time).total_seconds())
+        elapsed_time_sec = (datetime.now() - start_time).total_seconds()
+        logging.info(
+                ("Parsed %d link.txt and depend.make files in %.2f seconds using %d %s "
+                 "(%.2f seconds waiting for parse results, %.2f seconds adding edges to the "
+                 "graph)") % (
+                    num_parsed, elapsed_time_sec, num_jobs,
+                    'process' if num_jobs == 1 else 'processes',
+                    elapsed_time_sec - merge_time_sec, merge_time_sec))
+        return dict(num_files=num_parsed, bytes_read=num_bytes_read, parse_jobs=num_jobs)
 
     def find_proto_files(self):
+        """
+        Adds .proto files in the source tree to the dependency graph.
+        @return the number of .proto files found
+        """
+        num_proto_files = 0
         for src_subtree_root in [self.conf.src_dir_path, self.conf.ent_src_dir_path]:
             logging.info("Finding .proto files in the source tree at '{}'".format(src_subtree_root))
             source_str = 'proto files in {}'.format(src_subtree_root)
@@ -343,6 +1059,17 @@ class DependencyGraphBuilder:
                         self.dep_graph.find_or_create_node(
                                 os.path.join(root, file_name),
                                 source_str=source_str)
+                        num_proto_files += 1
+        return num_proto_files
+
+    def load_and_match_cmake_deps(self, phase):
+        self.load_cmake_deps()
+        self.match_cmake_targets_with_files()
+        phase.counters.update(
+                num_files=1,
+                bytes_read=self.cmake_deps_size,
+                num_cmake_targets=len(self.cmake_targets),
+                num_cmake_edges=sum(len(dep_paths) for path, dep_paths in self.cmake_edges))
 
     def match_cmake_targets_with_files(self):
         logging.info("Matching CMake targets with the files found")
@@ -374,39 +1101,17 @@ class DependencyGraphBuilder:
 
         # We're not adding nodes into our graph for CMake targets. Instead, we're finding files
         # that correspond to CMake targets, and add dependencies to those files.
+        self.cmake_edges = []
         for cmake_target, cmake_target_deps in iteritems(self.cmake_deps):
             node = self.cmake_target_to_node[cmake_target]
-            for cmake_target_dep in cmake_target_deps:
-                node.add_dependency(self.cmake_target_to_node[cmake_target_dep])
+            dep_nodes = [self.cmake_target_to_node[cmake_target_dep]
+                         for cmake_target_dep in cmake_target_deps]
+            for dep_node in dep_nodes:
+                node.add_dependency(dep_node)
+            self.cmake_edges.append((node.path, [dep_node.path for dep_node in dep_nodes]))
 
     def resolve_rel_path(self, rel_path):
-        if is_abs_path(rel_path):
-            return rel_path
-
-        if rel_path in self.unresolvable_rel_paths:
-            return None
-        existing_resolution = self.resolved_rel_paths.get(rel_path)
-        if existing_resolution:
-            return existing_resolution
-
-        candidates = set()
-        for base_dir in self.conf.rel_path_base_dirs:
-            candidate_path = os.path.abspath(os.path.join(base_dir, rel_path))
-            if os.path.exists(candidate_path):
-                self.useful_base_dirs.add(base_dir)
-                candidates.add(candidate_path)
-        if not candidates:
-            self.unresolvable_rel_paths.add(rel_path)
-            return None
-        if len(candidates) > 1:
-            logging.warning("Ambiguous ways to resolve '{}': '{}'".format(
-                rel_path, set_to_str(candidates)))
-            self.unresolvable_rel_paths.add(rel_path)
-            return None
-
-        resolved = list(candidates)[0]
-        self.resolved_rel_paths[rel_path] = resolved
-        return resolved
+        return self.path_resolver.resolve_rel_path(rel_path)
 
     def resolve_dependent_rel_path(self, rel_path):
         if is_abs_path(rel_path):
@@ -417,22 +1122,23 @@ class DependencyGraphBuilder:
             "Don't know how to resolve relative path of a 'dependent': {}".format(
                 rel_path))
 
-    def parse_depend_file(self, depend_make_path):
-        with open(depend_make_path) as depend_file:
-            for line in depend_file:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
-                dependent, dependency = line.split(':')
-                dependent = self.resolve_dependent_rel_path(dependent.strip())
-                dependency = dependency.strip()
-                dependency = self.resolve_rel_path(dependency)
-                if dependency:
-                    dependent_node = self.dep_graph.find_or_create_node(
-                            dependent, source_str=depend_make_path)
-                    dependency_node = self.dep_graph.find_or_create_node(
-                            dependency, source_str=depend_make_path)
-                    dependent_node.add_dependency(dependency_node)
+    def parse_depend_file(self, contents):
+        dependencies_by_dependent = {}
+        for line in contents.split("\n"):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            dependent, dependency = line.split(':')
+            dependent = self.resolve_dependent_rel_path(dependent.strip())
+            dependency = dependency.strip()
+            dependency = self.resolve_rel_path(dependency)
+            if dependency:
+                dependencies = dependencies_by_dependent.get(dependent)
+                if dependencies is None:
+                    dependencies = []
+                    dependencies_by_dependent[dependent] = dependencies
+                dependencies.append(dependency)
+        return list(dependencies_by_dependent.items())
 
     def find_node_by_rel_path(self, rel_path):
         if is_abs_path(rel_path):
@@ -447,10 +1153,9 @@ class DependencyGraphBuilder:
             raise RuntimeError("Ambiguous nodes for relative path '{}'".format(rel_path))
         return candidates[0]
 
-    def parse_link_txt_file(self, link_txt_path):
+    def parse_link_txt_file(self, link_txt_path, contents):
         assert link_txt_path.startswith(self.conf.build_root_make + '/')
-        with open(link_txt_path) as link_txt_file:
-            link_command = link_txt_file.read().strip()
+        link_command = contents.strip()
         link_args = link_command.split()
         output_path = None
         inputs = []
@@ -468,24 +1173,16 @@ class DependencyGraphBuilder:
                 i += 1
             else:
                 if is_object_file(arg):
-                    node = self.dep_graph.find_or_create_node(
-                            os.path.abspath(os.path.join(base_dir, arg)))
-                    inputs.append(node.path)
+                    inputs.append(os.path.abspath(os.path.join(base_dir, arg)))
 
                 if ends_with_one_of(arg, LIBRARY_FILE_EXTENSIONS) and not arg.startswith('-'):
-                    node = self.dep_graph.find_or_create_node(
-                            os.path.abspath(os.path.join(base_dir, arg)),
-                            source_str=link_txt_path)
-                    inputs.append(node.path)
+                    inputs.append(os.path.abspath(os.path.join(base_dir, arg)))
 
             i += 1
 
         if not is_abs_path(output_path):
             output_path = os.path.abspath(os.path.join(base_dir, output_path))
-        output_node = self.dep_graph.find_or_create_node(output_path, source_str=link_txt_path)
-        output_node.validate_existence()
-        for input_node in inputs:
-            output_node.add_dependency(self.dep_graph.find_or_create_node(input_node))
+        return [(output_path, inputs)]
 
     def build(self):
         compile_commands_path = os.path.join(self.conf.build_root_make, 'compile_commands.json')
@@ -504,78 +1201,411 @@ class DependencyGraphBuilder:
                      '--no-rebuild-thirdparty',
                      '--build-root', self.conf.build_root_make])
 
-        logging.info("Loading compile commands from '{}'".format(compile_commands_path))
-        with open(compile_commands_path) as commands_file:
-            self.compile_commands = json.load(commands_file)
+        with self.profile_phase('load_compile_commands') as phase:
+            logging.info("Loading compile commands from '{}'".format(compile_commands_path))
+            with open(compile_commands_path) as commands_file:
+                self.compile_commands = json.load(commands_file)
+
+            for entry in self.compile_commands:
+                self.compile_dirs.add(entry['directory'])
+            phase.counters.update(num_files=1,
+                                  bytes_read=os.path.getsize(compile_commands_path),
+                                  num_compile_commands=len(self.compile_commands))
+
+        # Scanning the build and source trees once is a lot faster than checking every path
+        # mentioned in the build files separately.
+        with self.profile_phase('index_file_system') as phase:
+            self.path_resolver.build_index()
+            phase.counters['num_files'] = len(self.path_resolver.index.entries)
+        with self.profile_phase('parse_build_files') as phase:
+            phase.counters.update(self.parse_link_and_depend_files())
+        self.path_resolver.log_stats()
+        with self.profile_phase('find_proto_files') as phase:
+            phase.counters['num_files'] = self.find_proto_files()
+        with self.profile_phase('validate_existence') as phase:
+            phase.counters['num_files'] = self.dep_graph.validate_node_existence(
+                    VALIDATION_MODE_FULL)
+
+        with self.profile_phase('match_cmake_deps') as phase:
+            self.load_and_match_cmake_deps(phase)
 
-        for entry in self.compile_commands:
-            self.compile_dirs.add(entry['directory'])
-
-        self.parse_link_and_depend_files()
-        self.find_proto_files()
-        self.dep_graph.validate_node_existence()
+        return self.dep_graph
 
-        self.load_cmake_deps()
-        self.match_cmake_targets_with_files()
+    def save_build_inputs(self, output_path):
+        """
+        Saves signatures of all files the dependency graph was built from, along with the edges
+        contributed by each of them, so that the graph can later be updated incrementally. Paths
+        are stored once in a path table and referred to by their index.
+        """
+        path_to_index = {}
+        paths = []
+
+        def get_path_index(path):
+            path_index = path_to_index.get(path)
+            if path_index is None:
+                path_index = len(paths)
+                path_to_index[path] = path_index
+                paths.append(path)
+            return path_index
+
+        def edges_to_json(edges):
+            return [[get_path_index(dependent), [get_path_index(dep) for dep in dependencies]]
+                    for dependent, dependencies in edges]
+
+        build_files = {}
+        for file_path, edges in iteritems(self.edges_by_build_file):
+            build_files[file_path] = dict(
+                    signature=self.build_file_signatures[file_path],
+                    edges=edges_to_json(edges))
+        build_inputs = dict(
+            version=BUILD_INPUTS_FORMAT_VERSION,
+            build_root=self.conf.build_root,
+            build_files=build_files,
+            cmake_deps_signature=self.cmake_deps_signature,
+            cmake_edges=edges_to_json(self.cmake_edges),
+            paths=paths)
+        with open(output_path, 'w') as output_file:
+            json.dump(build_inputs, output_file)
+        logging.info("Saved the state of {} dependency graph build inputs to '{}'".format(
+            len(build_files), output_path))
 
-        return self.dep_graph
+    def load_build_inputs(self, input_path):
+        """
+        Loads the state saved by save_build_inputs.
+        @return True if the state was loaded successfully and is usable for an incremental update
+        """
+        with open(input_path) as input_file:
+            build_inputs = json.load(input_file)
+        if build_inputs.get('version') != BUILD_INPUTS_FORMAT_VERSION:
+            logging.info("Unsupported format version of '{}': {}".format(
+                input_path, build_inputs.get('version')))
+            return False
+        if build_inputs['build_root'] != self.conf.build_root:
+            logging.info("'{}' was saved for a different build root: '{}'".format(
+                input_path, build_inputs['build_root']))
+            return False
 
+        paths = build_inputs['paths']
 
-class DependencyGraph:
+        def edges_from_json(edges_json):
+            return [(paths[dependent_index], [paths[dep_index] for dep_index in dep_indexes])
+                    for dependent_index, dep_indexes in edges_json]
 
-    canonicalization_cache = {}
+        for file_path, build_file in iteritems(build_inputs['build_files']):
+            self.edges_by_build_file[file_path] = edges_from_json(build_file['edges'])
+            self.build_file_signatures[file_path] = build_file['signature']
+        self.cmake_deps_signature = build_inputs['cmake_deps_signature']
+        self.cmake_edges = edges_from_json(build_inputs['cmake_edges'])
+        return True
 
-    def __init__(self, conf, json_data=None):
+    def update_incrementally(self, dep_graph):
         """
-        @param json_data optional results of JSON parsing
+        Updates a previously saved dependency graph by re-parsing only those depend.make / link.txt
+        files that were added or changed since the graph was built, and re-matching CMake targets.
+        Edges that are no longer contributed by any input file are removed from the graph.
+
+        @param dep_graph the saved dependency graph. It is modified in place.
+        @return True if the graph was modified
         """
-        self.conf = conf
-        self.node_by_path = {}
-        if json_data:
-            self.init_from_json(json_data)
-        self.nodes_by_basename = None
+        start_time = datetime.now()
+        self.dep_graph = dep_graph
 
-    def find_node(self, path, must_exist=True, source_str=None):
-        assert source_str is None or not must_exist
-        path = os.path.abspath(path)
-        node = self.node_by_path.get(path)
-        if node:
-            return node
-        if must_exist:
-            raise RuntimeError(
-                    ("Node not found by path: '{}' (expected to already have this node in our "
-                     "graph, not adding).").format(path))
-        node = Node(path, self, source_str)
-        self.node_by_path[path] = node
-        return node
+        current_file_paths = set(self.find_link_and_depend_files())
+        removed_file_paths = set(self.edges_by_build_file.keys()) - current_file_paths
+        changed_file_paths = sorted(
+                [file_path for file_path in current_file_paths
+                 if not is_file_unchanged(file_path, self.build_file_signatures.get(file_path))])
+        cmake_deps_changed = not is_file_unchanged(
+                self.get_cmake_deps_path(), self.cmake_deps_signature)
 
-    def find_or_create_node(self, path, source_str=None):
-        """
-        Finds a node with the given path or creates it if it does not exist.
-        @param source_str a string description of how we came up with this node's path
-        """
+        logging.info(
+                "Found {} changed, {} removed, {} unchanged link.txt and depend.make files, "
+                "yb_cmake_deps.txt {}".format(
+                    len(changed_file_paths), len(removed_file_paths),
+                    len(current_file_paths) - len(changed_file_paths),
+                    'changed' if cmake_deps_changed else 'unchanged'))
+        if not changed_file_paths and not removed_file_paths and not cmake_deps_changed:
+            return False
 
-        canonical_path = self.canonicalization_cache.get(path)
-        if not canonical_path:
-            canonical_path = os.path.realpath(path)
-            if canonical_path.startswith(self.conf.build_root_make + '/'):
-                canonical_path = self.conf.build_root + '/' + \
-                                 canonical_path[len(self.conf.build_root_make) + 1:]
-            self.canonicalization_cache[path] = canonical_path
+        # Edges that might have to be removed from the graph, unless some other input file still
+        # contributes them.
+        old_edges = []
+        for file_path in list(removed_file_paths) + changed_file_paths:
+            old_edges.extend(self.edges_by_build_file.pop(file_path, []))
+            self.build_file_signatures.pop(file_path, None)
+        old_edges.extend(self.cmake_edges)
+
+        with self.profile_phase('parse_build_files') as phase:
+            phase.counters.update(self.parse_link_and_depend_files(changed_file_paths))
+        with self.profile_phase('find_proto_files') as phase:
+            phase.counters['num_files'] = self.find_proto_files()
+
+        # Some link outputs might have been added or removed, so always re-match CMake targets.
+        with self.profile_phase('match_cmake_deps') as phase:
+            self.load_and_match_cmake_deps(phase)
+
+        current_edges = set()
+        for edges in list(self.edges_by_build_file.values()) + [self.cmake_edges]:
+            for dependent, dependencies in edges:
+                for dependency in dependencies:
+                    current_edges.add((dependent, dependency))
+
+        num_removed_edges = 0
+        affected_nodes = set()
+        for dependent, dependencies in old_edges:
+            dependent_node = dep_graph.node_by_path.get(dependent)
+            if not dependent_node:
+                continue
+            for dependency in dependencies:
+                dependency_node = dep_graph.node_by_path.get(dependency)
+                if (dependency_node and dependency_node in dependent_node.deps and
+                        (dependent, dependency) not in current_edges):
+                    dependent_node.remove_dependency(dependency_node)
+                    affected_nodes.update([dependent_node, dependency_node])
+                    num_removed_edges += 1
+
+        # Remove nodes that are no longer connected to anything. Protobuf files are added to the
+        # graph even without any edges, so we only remove them if they no longer exist.
+        num_removed_nodes = 0
+        for node in affected_nodes:
+            if (not node.deps and not node.reverse_deps and
+                    (not node.path.endswith('.proto') or not os.path.exists(node.path))):
+                dep_graph.remove_node(node)
+                num_removed_nodes += 1
 
-        return self.find_node(canonical_path, must_exist=False, source_str=source_str)
+        logging.info(
+                "Updated the dependency graph incrementally in %.2f sec: re-parsed %d files, "
+                "removed %d edges and %d nodes" % (
+                    (datetime.now() - start_time).total_seconds(), len(changed_file_paths),
+                    num_removed_edges, num_removed_nodes))
+        return True
 
-    def init_from_json(self, json_nodes):
-        id_to_node = {}
-        id_to_dep_ids = {}
-        for node_json in json_nodes:
-            node_id = node_json['id']
-            id_to_node[node_id] = self.find_or_create_node(node_json['path'])
-            id_to_dep_ids[node_id] = node_json['deps']
-        for node_id, dep_ids in iteritems(id_to_dep_ids):
-            node = id_to_node[node_id]
-            for dep_id in dep_ids:
-                node.add_dependency(id_to_node[dep_id])
+
+def parse_build_file_with_signature(builder, file_path):
+    """
+    @return a tuple of the given path, the size of the file, its signature if the builder records
+            build inputs (otherwise None), and the edges parsed from it
+    """
+    contents, signature = read_file_with_signature(file_path, builder.record_build_inputs)
+    return file_path, len(contents), signature, builder.parse_build_file(file_path, contents)
+
+
+# The builder used by worker processes parsing depend.make / link.txt files. This is set in the
+# parent process before the process pool is created, so workers inherit it when they are forked.
+parse_worker_builder = None
+
+
+def parse_build_file_in_worker(file_path):
+    """
+    @return the result of parse_build_file_with_signature, followed by the path resolution
+            counters accumulated in this worker process while parsing the file, so that the parent
+            process can include them in its own statistics
+    """
+    path_resolver = parse_worker_builder.path_resolver
+    stats_before = path_resolver.get_stats()
+    result = parse_build_file_with_signature(parse_worker_builder, file_path)
+    stats_after = path_resolver.get_stats()
+    path_stats = dict((key, stats_after[key] - stats_before[key]) for key in stats_after)
+    return result + (path_stats,)
+
+
+class BaseDependencyGraph:
+    """
+    Queries shared by all dependency graph implementations. Subclasses provide get_nodes,
+    get_node_by_path, get_num_nodes, and find_reverse_reachable_nodes.
+    """
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.nodes_by_basename = None
+
+        # Test programs and, for every node, a bitmap of test programs (bit i corresponding to
+        # test_closure_tests[i]) that transitively depend on it. Computed on demand by
+        # precompute_test_closure.
+        self.test_closure_tests = None
+        self.test_closure_masks = None
+
+        # Paths of nodes already validated in the lazy validation mode.
+        self.validated_paths = set()
+
+    def invalidate_query_caches(self):
+        self.test_closure_tests = None
+        self.test_closure_masks = None
+
+    def get_reverse_shortest_paths(self, start_nodes):
+        """
+        Runs a breadth-first search over reverse dependencies from the given nodes.
+
+        @return a (distances, parents) tuple. distances maps every node transitively depending on
+                any of the given nodes (and the given nodes themselves) to the smallest number of
+                dependency edges between it and one of the given nodes. parents maps the same nodes
+                to lists of their dependencies that are one edge closer to the given nodes, i.e.
+                the previous nodes on all shortest paths.
+        """
+        distances = dict((node, 0) for node in start_nodes)
+        parents = dict((node, []) for node in start_nodes)
+        current_level = list(distances.keys())
+        distance = 0
+        while current_level:
+            distance += 1
+            next_level = []
+            for node in current_level:
+                for rev_dep in node.reverse_deps:
+                    if rev_dep not in distances:
+                        distances[rev_dep] = distance
+                        parents[rev_dep] = [node]
+                        next_level.append(rev_dep)
+                    elif distances[rev_dep] == distance:
+                        parents[rev_dep].append(node)
+            current_level = next_level
+        return distances, parents
+
+    def get_reverse_distances(self, start_nodes):
+        """
+        @return a dictionary mapping every node transitively depending on any of the given nodes
+                (and the given nodes themselves) to the smallest number of dependency edges between
+                it and one of the given nodes
+        """
+        return self.get_reverse_shortest_paths(start_nodes)[0]
+
+    def find_affected_nodes(self, start_nodes, requested_node_type=NODE_TYPE_ANY):
+        if self.conf.verbose:
+            logging.info("Starting with the following initial nodes:")
+            for node in start_nodes:
+                logging.info("    {}".format(node))
+
+        start_nodes = set(start_nodes)
+        if requested_node_type == 'test' and self.test_closure_masks is not None:
+            mask = 0
+            for node in start_nodes:
+                mask |= self.test_closure_masks[node]
+            return set([test_node for i, test_node in enumerate(self.test_closure_tests)
+                        if (mask >> i) & 1 and test_node not in start_nodes])
+
+        return set([node for node in self.find_reverse_reachable_nodes(start_nodes)
+                    if ((requested_node_type == NODE_TYPE_ANY or
+                         node.node_type == requested_node_type) and
+                        node not in start_nodes)])
+
+    def get_strongly_connected_components(self, get_neighbors, roots=None):
+        """
+        Finds strongly connected components of the graph, with edges given by get_neighbors, using
+        an iterative version of Tarjan's algorithm. Components are produced in such an order that
+        all components reachable from a component are produced before it.
+
+        @param get_neighbors a function returning nodes a given node has edges to, e.g. its
+                             dependencies or its reverse dependencies
+        @param roots nodes to start from. Only components reachable from them are produced.
+                     Defaults to all nodes.
+        @return a generator of sets of nodes
+        """
+        index_by_node = {}
+        lowlink_by_node = {}
+        component_stack = []
+        on_component_stack = set()
+        for root in self.get_nodes() if roots is None else roots:
+            if root in index_by_node:
+                continue
+            index_by_node[root] = lowlink_by_node[root] = len(index_by_node)
+            component_stack.append(root)
+            on_component_stack.add(root)
+            work_stack = [(root, iter(get_neighbors(root)))]
+            while work_stack:
+                node, neighbors_iter = work_stack[-1]
+                descended = False
+                for neighbor in neighbors_iter:
+                    if neighbor not in index_by_node:
+                        index_by_node[neighbor] = lowlink_by_node[neighbor] = len(index_by_node)
+                        component_stack.append(neighbor)
+                        on_component_stack.add(neighbor)
+                        work_stack.append((neighbor, iter(get_neighbors(neighbor))))
+                        descended = True
+                        break
+                    if neighbor in on_component_stack:
+                        lowlink_by_node[node] = min(lowlink_by_node[node], index_by_node[neighbor])
+                if descended:
+                    continue
+
+                work_stack.pop()
+                if work_stack:
+                    parent = work_stack[-1][0]
+                    lowlink_by_node[parent] = min(lowlink_by_node[parent], lowlink_by_node[node])
+                if lowlink_by_node[node] != index_by_node[node]:
+                    continue
+
+                component = set()
+                while True:
+                    member = component_stack.pop()
+                    on_component_stack.discard(member)
+                    component.add(member)
+                    if member == node:
+                        break
+                yield component
+
+    def precompute_test_closure(self):
+        """
+        Computes, for every node, the set of test programs that transitively depend on it, as a
+        bitmap. After this, finding affected test programs for any number of changed files only
+        takes a few bitwise operations per file.
+
+        Strongly connected components of the reverse dependency graph are produced in such an
+        order that the bitmaps of all components reachable from a component are already available.
+        """
+        start_time = datetime.now()
+        test_nodes = sorted([node for node in self.get_nodes() if node.node_type == 'test'],
+                            key=lambda node: node.path)
+        test_bits = dict((node, 1 << i) for i, node in enumerate(test_nodes))
+
+        masks = {}
+        for component in self.get_strongly_connected_components(
+                lambda node: node.reverse_deps):
+            mask = 0
+            for member in component:
+                mask |= test_bits.get(member, 0)
+                for rev_dep in member.reverse_deps:
+                    if rev_dep not in component:
+                        mask |= masks[rev_dep]
+            for member in component:
+                masks[member] = mask
+
+        self.test_closure_tests = test_nodes
+        self.test_closure_masks = masks
+        logging.info("Computed the transitive closure for %d test programs in %.2f sec" % (
+            len(test_nodes), (datetime.now() - start_time).total_seconds()))
+
+    def get_input_digests(self, nodes, get_file_digest):
+        """
+        Computes a Merkle-style digest of all transitive inputs of each of the given nodes, e.g. of
+        the sources, headers, object files, and libraries a test program is built from, and of the
+        test program itself. The digest of a node covers the path (relative to the build root or
+        the source root) and the contents of its file, and the digests of its dependencies. Nodes
+        in a dependency cycle share a digest covering all of them.
+
+        @param get_file_digest a function returning a digest of a file's contents, or None if the
+                               file does not exist
+        @return a dictionary mapping the given nodes and all their transitive dependencies to hex
+                digests
+        """
+        start_time = datetime.now()
+        prefixes = get_path_prefixes(self.conf)
+        digests = {}
+        for component in self.get_strongly_connected_components(
+                lambda node: node.deps, roots=nodes):
+            members = sorted(
+                    '%s:%s' % (get_relocatable_path(member.path, prefixes),
+                               get_file_digest(member.path))
+                    for member in component)
+            dep_digests = sorted(set(
+                    digests[dep] for member in component for dep in member.deps
+                    if dep not in component))
+            digest = hashlib.sha1(
+                    "\n".join(members + ['deps:'] + dep_digests).encode('utf-8')).hexdigest()
+            for member in component:
+                digests[member] = digest
+        logging.info("Computed digests of transitive inputs of %d nodes (%d nodes total) in %.2f "
+                     "sec" % (len(nodes), len(digests),
+                              (datetime.now() - start_time).total_seconds()))
+        return digests
 
     def find_nodes_by_regex(self, regex_str):
         filter_re = re.compile(regex_str)
@@ -591,40 +1621,210 @@ class DependencyGraph:
                     lambda node: os.path.basename(node.path))
         return self.nodes_by_basename.get(basename)
 
-    def find_affected_nodes(self, start_nodes, requested_node_type=NODE_TYPE_ANY):
-        if self.conf.verbose:
-            logging.info("Starting with the following initial nodes:")
-            for node in start_nodes:
-                logging.info("    {}".format(node))
-
-        results = set()
-        visited = set()
-
-        def dfs(node):
-            if ((requested_node_type == NODE_TYPE_ANY or node.node_type == requested_node_type) and
-                    node not in start_nodes):
-                results.add(node)
-            if node in visited:
-                return
-            visited.add(node)
-            for dep in node.reverse_deps:
-                dfs(dep)
-
-        for node in start_nodes:
-            dfs(node)
-
-        return results
-
     def affected_basenames_by_basename_for_test(self, basename, node_type=NODE_TYPE_ANY):
         nodes_for_basename = self.find_nodes_by_basename(basename)
         if not nodes_for_basename:
             self.dump_debug_info()
             raise RuntimeError(
                     "No nodes found for file name '{}' (total number of nodes: {})".format(
-                        basename, len(self.node_by_path)))
+                        basename, self.get_num_nodes()))
         return set([os.path.basename(node.path)
                     for node in self.find_affected_nodes(nodes_for_basename, node_type)])
 
+    def validate_node_existence(self, validation_mode=None):
+        """
+        Checks that files corresponding to the nodes of this graph exist.
+
+        @param validation_mode one of VALIDATION_MODES, defaults to the configured one. In the lazy
+                               mode, nodes are only validated as they are used by queries, in
+                               validate_query_nodes.
+        @return the number of nodes validated
+        """
+        validation_mode = validation_mode or self.conf.validation_mode
+        if validation_mode in [VALIDATION_MODE_LAZY, VALIDATION_MODE_NONE]:
+            logging.info("Skipping validation of build artifacts (validation mode: {})".format(
+                validation_mode))
+            return 0
+
+        logging.info("Validating existence of build artifacts")
+        nodes = list(self.get_nodes())
+        if validation_mode == VALIDATION_MODE_SAMPLED:
+            num_samples = int(math.ceil(len(nodes) * self.conf.validation_sample_fraction))
+            nodes = random.sample(nodes, min(len(nodes), max(1, num_samples)))
+        return self.validate_nodes(nodes, validation_mode)
+
+    def validate_query_nodes(self, nodes):
+        """
+        Validates existence of nodes used by a query, if using the lazy validation mode. Every node
+        is only validated once.
+        """
+        if self.conf.validation_mode != VALIDATION_MODE_LAZY:
+            return
+        nodes = [node for node in nodes if node.path not in self.validated_paths]
+        self.validate_nodes(nodes, VALIDATION_MODE_LAZY)
+        self.validated_paths.update(node.path for node in nodes)
+
+    def validate_nodes(self, nodes, validation_mode):
+        """
+        Checks existence of files corresponding to the given nodes. The stat calls are spread
+        across a pool of threads, which helps a lot on network file systems.
+
+        @return the number of nodes validated
+        """
+        if self.conf.incomplete_build or not nodes:
+            return 0
+
+        start_time = datetime.now()
+        paths = [node.path for node in nodes]
+        num_threads = min(self.conf.validation_threads, len(paths))
+        if num_threads > 1:
+            pool = ThreadPool(num_threads)
+            try:
+                exists_flags = pool.map(os.path.exists, paths,
+                                        chunksize=max(1, len(paths) // (num_threads * 4)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            exists_flags = [os.path.exists(path) for path in paths]
+
+        for node, exists in zip(nodes, exists_flags):
+            if not exists:
+                node.validate_existence()
+        logging.info(
+                "Validated existence of %d out of %d build artifacts (validation mode: %s) in "
+                "%.2f sec using %d threads" % (
+                    len(paths), self.get_num_nodes(), validation_mode,
+                    (datetime.now() - start_time).total_seconds(), num_threads))
+        return len(paths)
+
+    def get_num_edges(self):
+        return sum(len(node.deps) for node in self.get_nodes())
+
+    def dump_debug_info(self):
+        logging.info("Dumping all graph nodes for debugging ({} nodes):".format(
+            self.get_num_nodes()))
+        for node in sorted(self.get_nodes(), key=lambda node: str(node)):
+            logging.info(node)
+
+
+class DependencyGraph(BaseDependencyGraph):
+
+    def __init__(self, conf, json_data=None, path_resolver=None):
+        """
+        @param json_data optional results of JSON parsing
+        @param path_resolver a PathResolver to canonicalize paths with, e.g. one shared with a
+                             DependencyGraphBuilder
+        """
+        BaseDependencyGraph.__init__(self, conf)
+        self.node_by_path = {}
+        self.path_resolver = path_resolver or PathResolver(conf)
+
+        # Node -> frozenset of nodes that transitively depend on it. Shared between queries.
+        self.reverse_closure_cache = LRUCache(conf.reverse_closure_cache_size)
+        if json_data:
+            self.init_from_json(json_data)
+
+    def find_node(self, path, must_exist=True, source_str=None):
+        assert source_str is None or not must_exist
+        path = os.path.abspath(path)
+        node = self.node_by_path.get(path)
+        if node:
+            return node
+        if must_exist:
+            raise RuntimeError(
+                    ("Node not found by path: '{}' (expected to already have this node in our "
+                     "graph, not adding).").format(path))
+        # Paths of new nodes come from find_or_create_node and are already canonical.
+        node = Node(path, self, source_str, node_type=get_node_type_by_path(path))
+        self.node_by_path[path] = node
+        return node
+
+    def canonicalize_path(self, path):
+        return self.path_resolver.canonicalize_path(path)
+
+    def find_or_create_node(self, path, source_str=None, is_canonical=False):
+        """
+        Finds a node with the given path or creates it if it does not exist.
+        @param source_str a string description of how we came up with this node's path
+        @param is_canonical whether the path has already been canonicalized using
+                            canonicalize_path
+        """
+        if not is_canonical:
+            path = self.canonicalize_path(path)
+        return self.find_node(path, must_exist=False, source_str=source_str)
+
+    def init_from_json(self, json_nodes):
+        id_to_node = {}
+        id_to_dep_ids = {}
+        for node_json in json_nodes:
+            node_id = node_json['id']
+            id_to_node[node_id] = self.find_or_create_node(node_json['path'])
+            id_to_dep_ids[node_id] = node_json['deps']
+        for node_id, dep_ids in iteritems(id_to_dep_ids):
+            node = id_to_node[node_id]
+            for dep_id in dep_ids:
+                node.add_dependency(id_to_node[dep_id])
+
+    def init_from_jsonl(self, input_path):
+        """
+        Loads a graph saved with save_as_jsonl, creating nodes and edges as records are read. Paths
+        are not canonicalized again.
+        """
+        nodes = []
+        for record_type, key, value in read_jsonl_graph(self.conf, input_path):
+            if record_type == JSONL_NODE_RECORD:
+                node = Node(key, self, source_str=input_path, node_type=NODE_TYPES[value])
+                self.node_by_path[key] = node
+                nodes.append(node)
+            else:
+                node = nodes[key]
+                for dep_id in value:
+                    node.add_dependency(nodes[dep_id])
+
+    def remove_node(self, node):
+        assert not node.deps and not node.reverse_deps, \
+            "Cannot remove a node that still has edges: {}".format(node)
+        del self.node_by_path[node.path]
+
+    def invalidate_query_caches(self):
+        BaseDependencyGraph.invalidate_query_caches(self)
+        if len(self.reverse_closure_cache):
+            self.reverse_closure_cache.clear()
+
+    def get_reverse_closure(self, node):
+        """
+        @return a frozenset of all nodes that transitively depend on the given node. Results are
+                cached, and cached results for nodes found along the way are reused.
+        """
+        closure = self.reverse_closure_cache.get(node)
+        if closure is not None:
+            return closure
+
+        reached = set()
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            for rev_dep in current.reverse_deps:
+                if rev_dep in reached:
+                    continue
+                reached.add(rev_dep)
+                rev_dep_closure = self.reverse_closure_cache.get(rev_dep)
+                if rev_dep_closure is None:
+                    stack.append(rev_dep)
+                else:
+                    reached.update(rev_dep_closure)
+
+        closure = frozenset(reached)
+        self.reverse_closure_cache.put(node, closure)
+        return closure
+
+    def find_reverse_reachable_nodes(self, start_nodes):
+        results = set()
+        for node in start_nodes:
+            results.update(self.get_reverse_closure(node))
+        return results
+
     def save_as_json(self, output_path):
         """
         Converts the dependency graph into a JSON representation, where every node is given an id,
@@ -658,37 +1858,333 @@ class DependencyGraph:
 
         logging.info("Saved dependency graph to '{}'".format(output_path))
 
-    def validate_node_existence(self):
-        logging.info("Validating existence of build artifacts")
-        for node in self.get_nodes():
-            node.validate_existence()
+    def save_as_binary(self, output_path):
+        """
+        Saves the dependency graph in the binary format described at BINARY_GRAPH_MAGIC.
+        """
+        prefixes = get_path_prefixes(self.conf)
+        nodes = sorted(self.get_nodes(), key=lambda node: node.path)
+        node_ids = dict((node, node_id) for node_id, node in enumerate(nodes))
+
+        dir_to_id = {}
+        dir_prefix_ids = array('b')
+        dir_suffixes = []
+        node_dir_ids = array('i')
+        node_basenames = []
+        node_types = array('b')
+        dep_offsets = array('i', [0])
+        dep_targets = array('i')
+        for node in nodes:
+            assert '\n' not in node.path, "Unexpected newline in path: {}".format(node.path)
+            dir_path, basename = os.path.split(node.path)
+            dir_id = dir_to_id.get(dir_path)
+            if dir_id is None:
+                dir_id = len(dir_suffixes)
+                dir_to_id[dir_path] = dir_id
+                prefix_id = -1
+                suffix = dir_path
+                for i, (alias, prefix) in enumerate(prefixes):
+                    if dir_path == prefix or dir_path.startswith(prefix + '/'):
+                        prefix_id = i
+                        suffix = dir_path[len(prefix) + 1:]
+                        break
+                dir_prefix_ids.append(prefix_id)
+                dir_suffixes.append(suffix)
+            node_dir_ids.append(dir_id)
+            node_basenames.append(basename)
+            node_types.append(NODE_TYPES.index(node.node_type))
+            dep_targets.extend(sorted(node_ids[dep] for dep in node.deps))
+            dep_offsets.append(len(dep_targets))
+
+        sections = [
+            ('dir_prefix_ids', array_to_bytes(dir_prefix_ids)),
+            ('dir_suffixes', '\n'.join(dir_suffixes).encode('utf-8')),
+            ('node_dir_ids', array_to_bytes(node_dir_ids)),
+            ('node_basenames', '\n'.join(node_basenames).encode('utf-8')),
+            ('node_types', array_to_bytes(node_types)),
+            ('dep_offsets', array_to_bytes(dep_offsets)),
+            ('dep_targets', array_to_bytes(dep_targets))
+        ]
+        section_offsets = {}
+        offset = 0
+        for section_name, section_data in sections:
+            section_offsets[section_name] = [offset, len(section_data)]
+            offset += len(section_data)
+        header = json.dumps(dict(
+            prefixes=[alias for alias, prefix in prefixes],
+            num_nodes=len(nodes),
+            num_edges=len(dep_targets),
+            int_size=dep_targets.itemsize,
+            sections=section_offsets)).encode('utf-8')
+
+        with open(output_path, 'wb') as output_file:
+            output_file.write(BINARY_GRAPH_HEADER_STRUCT.pack(
+                BINARY_GRAPH_MAGIC, BINARY_GRAPH_FORMAT_VERSION, len(header)))
+            output_file.write(header)
+            for section_name, section_data in sections:
+                output_file.write(section_data)
+
+        logging.info("Saved dependency graph ({} nodes, {} edges) to '{}'".format(
+            len(nodes), len(dep_targets), output_path))
+
+    def save_as_jsonl(self, output_path):
+        """
+        Saves the dependency graph in the line-delimited JSON format described at
+        JSONL_GRAPH_FORMAT_NAME, one node or one node's dependencies per line.
+        """
+        prefixes = get_path_prefixes(self.conf)
+        nodes = sorted(self.get_nodes(), key=lambda node: node.path)
+        node_ids = dict((node, node_id) for node_id, node in enumerate(nodes))
+        num_edges = sum(len(node.deps) for node in nodes)
+
+        with open(output_path, 'w') as output_file:
+            output_file.write(json.dumps(dict(
+                format=JSONL_GRAPH_FORMAT_NAME,
+                version=JSONL_GRAPH_FORMAT_VERSION,
+                num_nodes=len(nodes),
+                num_edges=num_edges)) + "\n")
+            for node in nodes:
+                output_file.write(json.dumps([
+                    JSONL_NODE_RECORD,
+                    get_relocatable_path(node.path, prefixes),
+                    node.node_type]) + "\n")
+            for node_id, node in enumerate(nodes):
+                if node.deps:
+                    output_file.write(json.dumps([
+                        JSONL_DEPS_RECORD,
+                        node_id,
+                        sorted(node_ids[dep] for dep in node.deps)]) + "\n")
+
+        logging.info("Saved dependency graph ({} nodes, {} edges) to '{}'".format(
+            len(nodes), num_edges, output_path))
+
+    def init_from_binary(self, input_path):
+        """
+        Loads a graph saved with save_as_binary. Paths are not canonicalized again.
+        """
+        paths, node_type_ids, dep_offsets, dep_targets = read_binary_graph(self.conf, input_path)
+        nodes = []
+        for path, node_type_id in zip(paths, node_type_ids):
+            node = Node(path, self, source_str=input_path, node_type=NODE_TYPES[node_type_id])
+            self.node_by_path[path] = node
+            nodes.append(node)
+
+        for node_id, node in enumerate(nodes):
+            for dep_id in dep_targets[dep_offsets[node_id]:dep_offsets[node_id + 1]]:
+                node.add_dependency(nodes[dep_id])
 
     def get_nodes(self):
         return self.node_by_path.values()
 
-    def dump_debug_info(self):
-        logging.info("Dumping all graph nodes for debugging ({} nodes):".format(
-            len(self.node_by_path)))
-        for node in sorted(self.get_nodes(), key=lambda node: str(node)):
-            logging.info(node)
+    def get_node_by_path(self, path):
+        return self.node_by_path.get(path)
+
+    def get_num_nodes(self):
+        return len(self.node_by_path)
+
+
+class CompactNode(object):
+    """
+    A lightweight handle to a node of a CompactDependencyGraph. Provides the same read-only
+    interface as Node, but all data lives in the arrays of the graph.
+    """
+    __slots__ = ['dep_graph', 'node_id']
+
+    def __init__(self, dep_graph, node_id):
+        self.dep_graph = dep_graph
+        self.node_id = node_id
+
+    @property
+    def path(self):
+        return self.dep_graph.paths[self.node_id]
+
+    @property
+    def node_type(self):
+        return NODE_TYPES[self.dep_graph.node_type_ids[self.node_id]]
+
+    @property
+    def conf(self):
+        return self.dep_graph.conf
+
+    @property
+    def deps(self):
+        return self.dep_graph.get_nodes_by_ids(self.dep_graph.get_dep_ids(self.node_id))
+
+    @property
+    def reverse_deps(self):
+        return self.dep_graph.get_nodes_by_ids(self.dep_graph.get_reverse_dep_ids(self.node_id))
+
+    def __eq__(self, other):
+        return (isinstance(other, CompactNode) and
+                self.node_id == other.node_id and
+                self.dep_graph is other.dep_graph)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return self.node_id
+
+    def is_source(self):
+        return self.node_type == 'source'
+
+    def validate_existence(self):
+        validate_path_existence(self.path, self.conf, self.dep_graph.source_str)
+
+    def get_pretty_path(self):
+        return get_pretty_path(self.path, self.conf)
+
+    def __str__(self):
+        return "Node(\"{}\", type={}, {} deps, {} rev deps)".format(
+                self.get_pretty_path(), self.node_type,
+                len(self.dep_graph.get_dep_ids(self.node_id)),
+                len(self.dep_graph.get_reverse_dep_ids(self.node_id)))
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class CompactDependencyGraph(BaseDependencyGraph):
+    """
+    A read-only dependency graph that stores nodes as integer ids, and forward and reverse
+    dependencies in compressed sparse row (CSR) form in integer arrays. This uses a lot less memory
+    than DependencyGraph, where every node has its own sets of dependencies and reverse
+    dependencies, and is faster to traverse.
+    """
+
+    def __init__(self, conf, paths, node_type_ids, dep_offsets, dep_targets, source_str):
+        """
+        @param paths canonical node paths, indexed by node id
+        @param node_type_ids indexes of node types in NODE_TYPES, indexed by node id
+        @param dep_offsets, dep_targets dependencies of node i are
+               dep_targets[dep_offsets[i]:dep_offsets[i + 1]]
+        @param source_str a description of where this graph was loaded from
+        """
+        BaseDependencyGraph.__init__(self, conf)
+        self.paths = paths
+        self.node_type_ids = node_type_ids
+        self.dep_offsets = dep_offsets
+        self.dep_targets = dep_targets
+        self.source_str = source_str
+        self.path_to_id = None
+
+        # Build the reverse adjacency arrays by counting the number of reverse dependencies of each
+        # node, computing offsets, and then filling in the targets.
+        num_nodes = len(paths)
+        rev_counts = array('i', [0]) * (num_nodes + 1)
+        for dep_id in dep_targets:
+            rev_counts[dep_id + 1] += 1
+        for node_id in range(num_nodes):
+            rev_counts[node_id + 1] += rev_counts[node_id]
+        self.rev_offsets = rev_counts
+        self.rev_targets = array('i', [0]) * len(dep_targets)
+        next_rev_index = array('i', rev_counts[:num_nodes])
+        for node_id in range(num_nodes):
+            for dep_id in dep_targets[dep_offsets[node_id]:dep_offsets[node_id + 1]]:
+                self.rev_targets[next_rev_index[dep_id]] = node_id
+                next_rev_index[dep_id] += 1
+
+    @staticmethod
+    def from_binary(conf, input_path):
+        paths, node_type_ids, dep_offsets, dep_targets = read_binary_graph(conf, input_path)
+        return CompactDependencyGraph(
+                conf, paths, node_type_ids, dep_offsets, dep_targets, source_str=input_path)
+
+    @staticmethod
+    def from_jsonl(conf, input_path):
+        paths = []
+        node_type_ids = array('b')
+        dep_offsets = array('i', [0])
+        dep_targets = array('i')
+        for record_type, key, value in read_jsonl_graph(conf, input_path):
+            if record_type == JSONL_NODE_RECORD:
+                paths.append(key)
+                node_type_ids.append(value)
+            else:
+                # Nodes without dependencies have no records.
+                while len(dep_offsets) <= key:
+                    dep_offsets.append(len(dep_targets))
+                dep_targets.extend(value)
+                dep_offsets.append(len(dep_targets))
+        while len(dep_offsets) <= len(paths):
+            dep_offsets.append(len(dep_targets))
+        return CompactDependencyGraph(
+                conf, paths, node_type_ids, dep_offsets, dep_targets, source_str=input_path)
+
+    @staticmethod
+    def from_dependency_graph(dep_graph):
+        nodes = sorted(dep_graph.get_nodes(), key=lambda node: node.path)
+        node_ids = dict((node, node_id) for node_id, node in enumerate(nodes))
+        dep_offsets = array('i', [0])
+        dep_targets = array('i')
+        for node in nodes:
+            dep_targets.extend(sorted(node_ids[dep] for dep in node.deps))
+            dep_offsets.append(len(dep_targets))
+        return CompactDependencyGraph(
+                dep_graph.conf,
+                [node.path for node in nodes],
+                array('b', [NODE_TYPES.index(node.node_type) for node in nodes]),
+                dep_offsets,
+                dep_targets,
+                source_str='in-memory dependency graph')
+
+    def get_dep_ids(self, node_id):
+        return self.dep_targets[self.dep_offsets[node_id]:self.dep_offsets[node_id + 1]]
+
+    def get_reverse_dep_ids(self, node_id):
+        return self.rev_targets[self.rev_offsets[node_id]:self.rev_offsets[node_id + 1]]
+
+    def get_nodes_by_ids(self, node_ids):
+        return [CompactNode(self, node_id) for node_id in node_ids]
+
+    def get_nodes(self):
+        return self.get_nodes_by_ids(range(len(self.paths)))
+
+    def get_node_by_path(self, path):
+        if self.path_to_id is None:
+            self.path_to_id = dict((path, node_id) for node_id, path in enumerate(self.paths))
+        node_id = self.path_to_id.get(path)
+        if node_id is None:
+            return None
+        return CompactNode(self, node_id)
+
+    def get_num_nodes(self):
+        return len(self.paths)
+
+    def get_num_edges(self):
+        return len(self.dep_targets)
+
+    def find_reverse_reachable_nodes(self, start_nodes):
+        visited = bytearray(len(self.paths))
+        start_ids = set(node.node_id for node in start_nodes)
+        stack = list(start_ids)
+        for node_id in stack:
+            visited[node_id] = 1
+        reached_ids = []
+        rev_offsets = self.rev_offsets
+        rev_targets = self.rev_targets
+        while stack:
+            node_id = stack.pop()
+            for rev_dep_id in rev_targets[rev_offsets[node_id]:rev_offsets[node_id + 1]]:
+                if not visited[rev_dep_id]:
+                    visited[rev_dep_id] = 1
+                    stack.append(rev_dep_id)
+                    reached_ids.append(rev_dep_id)
+
+        return self.get_nodes_by_ids(reached_ids)
 
 
 class DependencyGraphTest(unittest.TestCase):
     dep_graph = None
 
-    # Basename -> basenames affected by it.
-    affected_basenames_cache = {}
-
     def get_affected_basenames(self, initial_basename):
-        affected_basenames = self.affected_basenames_cache.get(initial_basename)
-        if not affected_basenames:
-            affected_basenames = self.dep_graph.affected_basenames_by_basename_for_test(
-                    initial_basename)
-            self.affected_basenames_cache[initial_basename] = affected_basenames
-            if self.dep_graph.conf.verbose:
-                # This is useful to get inspiration for new tests.
-                logging.info("Files affected by {}:\n    {}".format(
-                    initial_basename, "\n    ".join(sorted(affected_basenames))))
+        # Reverse dependency closures are cached by the dependency graph itself.
+        affected_basenames = self.dep_graph.affected_basenames_by_basename_for_test(
+                initial_basename)
+        if self.dep_graph.conf.verbose:
+            # This is useful to get inspiration for new tests.
+            logging.info("Files affected by {}:\n    {}".format(
+                initial_basename, "\n    ".join(sorted(affected_basenames))))
         return affected_basenames
 
     def assert_affected_by(self, expected_affected_basenames, initial_basename):
@@ -747,6 +2243,202 @@ class DependencyGraphTest(unittest.TestCase):
             ], 'yb-bulk_load.cc')
 
 
+def get_graph_cache_path(build_root, graph_format):
+    return os.path.join(build_root, GRAPH_FILE_NAMES[graph_format])
+
+
+def get_graph_format_by_path(graph_path):
+    for graph_format, file_name in iteritems(GRAPH_FILE_NAMES):
+        if graph_path.endswith(os.path.splitext(file_name)[1]):
+            return graph_format
+    raise RuntimeError("Unknown dependency graph file format: '{}'".format(graph_path))
+
+
+def load_dependency_graph(conf, graph_path, graph_backend=GRAPH_BACKEND_OBJECTS):
+    graph_format = get_graph_format_by_path(graph_path)
+    if graph_backend == GRAPH_BACKEND_COMPACT and graph_format == GRAPH_FORMAT_BINARY:
+        return CompactDependencyGraph.from_binary(conf, graph_path)
+    if graph_backend == GRAPH_BACKEND_COMPACT and graph_format == GRAPH_FORMAT_JSONL:
+        return CompactDependencyGraph.from_jsonl(conf, graph_path)
+
+    dep_graph = DependencyGraph(conf)
+    if graph_format == GRAPH_FORMAT_BINARY:
+        dep_graph.init_from_binary(graph_path)
+    elif graph_format == GRAPH_FORMAT_JSONL:
+        dep_graph.init_from_jsonl(graph_path)
+    else:
+        with open(graph_path) as graph_input_file:
+            dep_graph.init_from_json(json.load(graph_input_file))
+    if graph_backend == GRAPH_BACKEND_COMPACT:
+        return CompactDependencyGraph.from_dependency_graph(dep_graph)
+    return dep_graph
+
+
+def save_dependency_graph(dep_graph, graph_path):
+    # Write to a temporary file first, so that readers such as the dependency graph server never see
+    # a partially written graph.
+    tmp_path = graph_path + '.tmp'
+    graph_format = get_graph_format_by_path(graph_path)
+    if graph_format == GRAPH_FORMAT_BINARY:
+        dep_graph.save_as_binary(tmp_path)
+    elif graph_format == GRAPH_FORMAT_JSONL:
+        dep_graph.save_as_jsonl(tmp_path)
+    else:
+        dep_graph.save_as_json(tmp_path)
+    os.rename(tmp_path, graph_path)
+
+
+def get_max_rss_kb():
+    # On Linux, ru_maxrss is in kilobytes.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure_graph_loading(conf, graph_path, graph_backend, result_queue, max_queries=100):
+    """
+    Loads the dependency graph and reports the time it took and the peak memory usage increase, as
+    well as the time to find tests affected by a sample of source files. This is run in a separate
+    process so that the memory measurements of different formats do not interfere with each other.
+    """
+    max_rss_before_kb = get_max_rss_kb()
+    start_time = datetime.now()
+    dep_graph = load_dependency_graph(conf, graph_path, graph_backend)
+    elapsed_time_sec = (datetime.now() - start_time).total_seconds()
+    max_rss_increase_kb = get_max_rss_kb() - max_rss_before_kb
+
+    source_nodes = sorted([node for node in dep_graph.get_nodes() if node.node_type == 'source'],
+                          key=lambda node: node.path)
+    query_nodes = source_nodes[::max(1, len(source_nodes) // max_queries)][:max_queries]
+    start_time = datetime.now()
+    for node in query_nodes:
+        dep_graph.find_affected_nodes([node], 'test')
+    query_time_sec = (datetime.now() - start_time).total_seconds()
+
+    result_queue.put(dict(
+        load_time_sec=elapsed_time_sec,
+        max_rss_increase_kb=max_rss_increase_kb,
+        num_nodes=dep_graph.get_num_nodes(),
+        num_queries=len(query_nodes),
+        query_time_sec=query_time_sec))
+
+
+def generate_synthetic_graph(conf, num_nodes, seed=0):
+    """
+    Generates a dependency graph of roughly the given size with a structure similar to that of a
+    real build: modules with headers, sources, object files, a library, and test programs, where
+    modules depend on some of the modules before them. Used for benchmarking graph formats on graphs
+    larger than the one at hand. No files are created.
+    """
+    rand = random.Random(seed)
+    dep_graph = DependencyGraph(conf)
+
+    def add_node(path, node_type, deps=()):
+        node = Node(path, dep_graph, source_str='synthetic graph', node_type=node_type)
+        dep_graph.node_by_path[path] = node
+        for dep in deps:
+            node.add_dependency(dep)
+        return node
+
+    headers_per_module = 50
+    sources_per_module = 40
+    tests_per_module = 5
+    nodes_per_module = (
+            headers_per_module + 2 * sources_per_module + 1 + 3 * tests_per_module)
+    num_modules = max(1, int(math.ceil(float(num_nodes) / nodes_per_module)))
+    all_headers = []
+    libraries = []
+    for module_index in range(num_modules):
+        module_name = 'synthetic%d' % module_index
+        src_dir = os.path.join(conf.src_dir_path, 'yb', module_name)
+        obj_dir = os.path.join(conf.build_root, 'src', 'yb', module_name, 'CMakeFiles',
+                               module_name + '.dir')
+        headers = [add_node(os.path.join(src_dir, 'file%d.h' % i), 'source')
+                   for i in range(headers_per_module)]
+
+        def add_object(source_name):
+            # Include headers of this module and, less often, of the modules before it.
+            included_headers = rand.sample(headers, 10) + rand.sample(all_headers,
+                                                                      min(10, len(all_headers)))
+            source = add_node(os.path.join(src_dir, source_name), 'source')
+            return add_node(os.path.join(obj_dir, source_name + '.o'), 'object',
+                            [source] + included_headers)
+
+        objects = [add_object('file%d.cc' % i) for i in range(sources_per_module)]
+        library = add_node(
+                os.path.join(conf.build_root, 'lib', 'lib%s.so' % module_name), 'library',
+                objects + rand.sample(libraries, min(3, len(libraries))))
+        for i in range(tests_per_module):
+            test_name = '%s_file%d-test' % (module_name, i)
+            add_node(os.path.join(conf.build_root, 'tests-' + module_name, test_name), 'test',
+                     [add_object(test_name + '.cc'), library])
+        all_headers.extend(headers)
+        libraries.append(library)
+    return dep_graph
+
+
+def benchmark_graph_loading(conf, graph_paths, num_iterations=3):
+    """
+    Compares load time, memory usage, and query time of the given saved dependency graph files,
+    with all in-memory graph backends.
+    """
+    for graph_path in graph_paths:
+        graph_format = get_graph_format_by_path(graph_path)
+        for graph_backend in GRAPH_BACKENDS:
+            results = []
+            for i in range(num_iterations):
+                result_queue = multiprocessing.Queue()
+                process = multiprocessing.Process(
+                        target=measure_graph_loading,
+                        args=(conf, graph_path, graph_backend, result_queue))
+                process.start()
+                results.append(result_queue.get())
+                process.join()
+
+            print("Format: %-8s backend: %-8s file size: %8.1f KB, %d nodes, best load time: "
+                  "%.3f sec, max RSS increase: %.1f MB, %d affected test queries: %.3f sec" % (
+                      graph_format,
+                      graph_backend,
+                      os.path.getsize(graph_path) / 1024.0,
+                      results[0]['num_nodes'],
+                      min(result['load_time_sec'] for result in results),
+                      max(result['max_rss_increase_kb'] for result in results) / 1024.0,
+                      results[0]['num_queries'],
+                      min(result['query_time_sec'] for result in results)))
+
+
+def save_graph_in_all_formats(dep_graph, graph_dir, overwrite=False):
+    """
+    @return paths of the dependency graph saved in the given directory in every format. Files that
+            already exist are only overwritten if requested.
+    """
+    graph_paths = []
+    for graph_format in sorted(GRAPH_FILE_NAMES.keys()):
+        graph_path = get_graph_cache_path(graph_dir, graph_format)
+        if overwrite or not os.path.exists(graph_path):
+            save_dependency_graph(dep_graph, graph_path)
+        graph_paths.append(graph_path)
+    return graph_paths
+
+
+def benchmark_synthetic_graph_loading(conf, num_nodes):
+    """
+    Saves a synthetic dependency graph of the given size in all formats to a temporary directory,
+    and compares loading it. The graph is freed before loading, so that memory measurements only
+    include what loading takes.
+    """
+    start_time = datetime.now()
+    dep_graph = generate_synthetic_graph(conf, num_nodes)
+    logging.info("Generated a synthetic dependency graph with %d nodes in %.2f sec" % (
+        dep_graph.get_num_nodes(), (datetime.now() - start_time).total_seconds()))
+    graph_dir = tempfile.mkdtemp(prefix='synthetic_dependency_graph_')
+    try:
+        graph_paths = save_graph_in_all_formats(dep_graph, graph_dir, overwrite=True)
+        del dep_graph
+        gc.collect()
+        benchmark_graph_loading(conf, graph_paths)
+    finally:
+        shutil.rmtree(graph_dir)
+
+
 def run_self_test(dep_graph):
     logging.info("Running a self-test of the {} tool".format(os.path.basename(__file__)))
     DependencyGraphTest.dep_graph = dep_graph
@@ -796,6 +2488,658 @@ def get_file_category(rel_path):
     return 'other'
 
 
+def get_git_diff_file_changes(conf, git_diff):
+    """
+    @return the list of paths, relative to the source root, of files changed in the given diff
+    """
+    git_diff_output = subprocess.check_output(
+            ['git', 'diff', git_diff, '--name-only'], cwd=conf.yb_src_root)
+    return [file_path.strip() for file_path in git_diff_output.split("\n") if file_path.strip()]
+
+
+def get_initial_nodes(conf, dep_graph, file_changes=None, file_regex=None):
+    """
+    Finds the nodes to start dependency graph queries from.
+
+    @param file_changes paths of changed files relative to the source root, or None to select nodes
+                        using a regular expression
+    @param file_regex regular expression for node paths, defaults to the one from the configuration
+    @return a tuple of the set of initial nodes and a dictionary of file changes by category
+    """
+    if file_changes is None:
+        file_regex = file_regex or conf.file_regex
+        logging.info("Using file name regex: {}".format(file_regex))
+        return dep_graph.find_nodes_by_regex(file_regex), {}
+
+    initial_nodes = set()
+    file_paths = set()
+    for file_path in file_changes:
+        # Resolve paths relative to the git repository root.
+        file_path = os.path.realpath(os.path.join(conf.yb_src_root, file_path))
+        file_paths.add(file_path)
+        node = dep_graph.get_node_by_path(file_path)
+        if node:
+            initial_nodes.add(node)
+
+    if not initial_nodes:
+        logging.warning("Did not find any graph nodes for this set of files: {}".format(
+            file_paths))
+        for basename in set([os.path.basename(file_path) for file_path in file_paths]):
+            logging.warning("Nodes for basename '{}': {}".format(
+                basename, dep_graph.find_nodes_by_basename(basename)))
+
+    file_changes_by_category = group_by(file_changes, get_file_category)
+    for category, changes in file_changes_by_category.items():
+        logging.info("File changes in category '{}':".format(category))
+        for change in sorted(changes):
+            logging.info("    {}".format(change))
+    return initial_nodes, file_changes_by_category
+
+
+def run_query(dep_graph, cmd, initial_nodes, node_type=NODE_TYPE_ANY):
+    results = set()
+    if cmd == LIST_AFFECTED_CMD:
+        results = dep_graph.find_affected_nodes(initial_nodes, node_type)
+    elif cmd == LIST_DEPS_CMD:
+        for node in initial_nodes:
+            results.update(node.deps)
+    elif cmd == LIST_REVERSE_DEPS_CMD:
+        for node in initial_nodes:
+            results.update(node.reverse_deps)
+    else:
+        raise RuntimeError("Unimplemented command '{}'".format(cmd))
+    dep_graph.validate_query_nodes(set(initial_nodes) | results)
+    return results
+
+
+def find_shortest_dependency_paths(dep_graph, initial_nodes, target_node, max_paths):
+    """
+    Explains why the target node is affected by changes to the initial nodes.
+
+    @return up to max_paths shortest chains of dependencies, each a list of nodes starting with one
+            of the initial nodes and ending with the target node. Empty if the target node does not
+            depend on any of the initial nodes.
+    """
+    distances, parents = dep_graph.get_reverse_shortest_paths(initial_nodes)
+    if target_node not in distances:
+        return []
+
+    paths = []
+    # Depth-first search from the target node back to the initial nodes over shortest path edges.
+    stack = [[target_node]]
+    while stack and len(paths) < max_paths:
+        reversed_path = stack.pop()
+        node_parents = parents[reversed_path[-1]]
+        if not node_parents:
+            paths.append(list(reversed(reversed_path)))
+            continue
+        for parent in sorted(node_parents, key=lambda node: node.path, reverse=True):
+            stack.append(reversed_path + [parent])
+    return paths
+
+
+def find_hub_nodes(dep_graph, initial_nodes, max_hubs):
+    """
+    Finds the headers and libraries responsible for the most affected test programs: for every
+    such node, counts the affected test programs that have a shortest chain of dependencies from one
+    of the initial nodes starting at or going through it. The initial nodes themselves are
+    included, so that with many changed files, the ones affecting the most tests stand out.
+
+    @return up to max_hubs (number of test programs, node) tuples, most test programs first
+    """
+    distances, parents = dep_graph.get_reverse_shortest_paths(initial_nodes)
+    test_bit_by_node = {}
+    for node in sorted(distances, key=lambda node: node.path):
+        if node.node_type == 'test' and distances[node] > 0:
+            test_bit_by_node[node] = 1 << len(test_bit_by_node)
+
+    # Bitmaps of affected test programs reachable over shortest path edges, computed starting from
+    # the nodes farthest away from the initial nodes.
+    masks = {}
+    for node in sorted(distances, key=lambda node: distances[node], reverse=True):
+        mask = masks.get(node, 0) | test_bit_by_node.get(node, 0)
+        masks[node] = mask
+        for parent in parents[node]:
+            masks[parent] = masks.get(parent, 0) | mask
+
+    hubs = [(bin(masks[node]).count('1'), node) for node in distances
+            if node.node_type in ['source', 'library'] and masks[node]]
+    hubs.sort(key=lambda hub: (-hub[0], hub[1].path))
+    return hubs[:max_hubs]
+
+
+def find_node_by_name(dep_graph, name):
+    """
+    @param name a path or a basename of a node
+    """
+    if is_abs_path(name):
+        node = dep_graph.get_node_by_path(os.path.realpath(name))
+        nodes = [node] if node else []
+    else:
+        nodes = dep_graph.find_nodes_by_basename(name) or []
+    if not nodes:
+        raise RuntimeError("No dependency graph node found for '{}'".format(name))
+    if len(nodes) > 1:
+        raise RuntimeError("Multiple dependency graph nodes found for '{}': {}".format(
+            name, ', '.join(sorted(node.path for node in nodes))))
+    return list(nodes)[0]
+
+
+def explain_affected_nodes(dep_graph, initial_nodes, target_name=None, max_paths=3,
+                           max_hubs=20):
+    """
+    Prints shortest chains of dependencies from the initial nodes to the given target node, or, if
+    no target node is given, the headers and libraries through which changes to the initial nodes
+    affect the most test programs.
+    """
+    if target_name:
+        target_node = find_node_by_name(dep_graph, target_name)
+        paths = find_shortest_dependency_paths(dep_graph, initial_nodes, target_node, max_paths)
+        if not paths:
+            print("{} is not affected by changes to the {} initial nodes".format(
+                target_node.get_pretty_path(), len(initial_nodes)))
+        for path in paths:
+            print(' -> '.join(node.get_pretty_path() for node in path))
+        logging.info("Found {} shortest paths of length {} to {}".format(
+            len(paths), len(paths[0]) - 1 if paths else 0, target_node.get_pretty_path()))
+        return
+
+    hubs = find_hub_nodes(dep_graph, initial_nodes, max_hubs)
+    for num_tests, node in hubs:
+        print("%6d %-8s %s" % (num_tests, node.node_type, node.get_pretty_path()))
+    logging.info("Listed {} headers and libraries through which changes to the {} initial nodes "
+                 "affect the most test programs".format(len(hubs), len(initial_nodes)))
+
+
+def find_affected_nodes_with_header_analysis(
+        conf, dep_graph, initial_nodes, node_type, header_analysis, git_diff=None,
+        file_changes=None):
+    """
+    Finds affected nodes like the "affected" command does, but only considers an object file
+    affected by a changed header if HeaderImpactAnalyzer confirms that the object file's translation
+    unit really includes the header (and, in the symbols mode, mentions identifiers changed in it).
+
+    @param header_analysis one of HEADER_ANALYSIS_MODES other than HEADER_ANALYSIS_NONE
+    @param git_diff the "git diff" argument that file_changes came from, needed for the symbols
+                    mode
+    @return a tuple of the set of affected nodes and a dictionary describing how much smaller it
+            is than the set of affected nodes found without this analysis
+    """
+    compile_commands_path = os.path.join(conf.build_root_make, 'compile_commands.json')
+    if not os.path.exists(compile_commands_path):
+        raise RuntimeError("Header impact analysis needs compile commands at '{}'".format(
+            compile_commands_path))
+    start_time = datetime.now()
+    analyzer = HeaderImpactAnalyzer(compile_commands_path)
+
+    changed_identifiers_by_path = None
+    if header_analysis == HEADER_ANALYSIS_SYMBOLS:
+        if git_diff:
+            changed_identifiers_by_path = get_changed_identifiers_by_path(
+                    conf.yb_src_root, git_diff,
+                    [file_path for file_path in file_changes if is_header(file_path)])
+        else:
+            logging.warning("Symbol-level header impact analysis needs --git-diff or "
+                            "--git-commit, only checking includes")
+
+    initial_nodes = set(initial_nodes)
+    start_nodes = set()
+    num_skipped_objects = 0
+    for node in initial_nodes:
+        if node.node_type != 'source' or not is_header(node.path):
+            start_nodes.add(node)
+            continue
+        changed_identifiers = None
+        if changed_identifiers_by_path is not None:
+            changed_identifiers = changed_identifiers_by_path.get(node.path)
+        for rev_dep in node.reverse_deps:
+            if (rev_dep.node_type != 'object' or
+                    analyzer.is_object_affected(rev_dep.path, node.path, changed_identifiers)):
+                start_nodes.add(rev_dep)
+            else:
+                num_skipped_objects += 1
+
+    results = dep_graph.find_affected_nodes(start_nodes, node_type)
+    results.update(node for node in start_nodes
+                   if node_type == NODE_TYPE_ANY or node.node_type == node_type)
+    results -= initial_nodes
+
+    unfiltered_results = dep_graph.find_affected_nodes(initial_nodes, node_type)
+    num_tests = len([node for node in results if node.node_type == 'test'])
+    num_unfiltered_tests = len([node for node in unfiltered_results if node.node_type == 'test'])
+    logging.info(
+            "Header impact analysis (%s mode) ruled out %d object files, reducing the number of "
+            "affected nodes from %d to %d, and test programs from %d to %d (%.1f%% fewer), in "
+            "%.2f sec" % (
+                header_analysis, num_skipped_objects, len(unfiltered_results), len(results),
+                num_unfiltered_tests, num_tests,
+                100.0 * (num_unfiltered_tests - num_tests) / max(num_unfiltered_tests, 1),
+                (datetime.now() - start_time).total_seconds()))
+    dep_graph.validate_query_nodes(initial_nodes | results)
+    return results, dict(mode=header_analysis,
+                         num_skipped_objects=num_skipped_objects,
+                         num_affected_nodes_before=len(unfiltered_results),
+                         num_affected_nodes_after=len(results),
+                         num_affected_tests_before=num_unfiltered_tests,
+                         num_affected_tests_after=num_tests)
+
+
+def get_test_priorities(dep_graph, initial_nodes, affected_tests, test_history=None):
+    """
+    Ranks affected test programs by relevance to the changed files. A test program is more relevant
+    if it is closer to the changed files in the dependency graph, and if it depends on more of the
+    changed files, e.g. on many of the changed headers. Test programs that failed more often
+    according to historical test reports are also ranked higher, and among equally relevant test
+    programs, faster ones go first.
+
+    @param test_history an optional TestHistory
+    @return a list of dictionaries describing test programs, most relevant first
+    """
+    affected_tests = set(affected_tests)
+    distances = dep_graph.get_reverse_distances(initial_nodes)
+    fan_in = defaultdict(int)
+    for node in initial_nodes:
+        for test_node in dep_graph.find_affected_nodes([node], 'test'):
+            fan_in[test_node] += 1
+    stats_by_basename = test_history.get_stats_by_basename() if test_history else {}
+
+    priority_by_basename = {}
+    for test_node in affected_tests:
+        basename = os.path.basename(test_node.path)
+        distance = distances[test_node]
+        score = float(fan_in[test_node]) / distance
+        priority = dict(test_program=basename, distance=distance, fan_in=fan_in[test_node])
+        stats = stats_by_basename.get(basename)
+        if stats:
+            score *= 1 + HISTORICAL_FAILURE_RATE_WEIGHT * stats.get_failure_rate()
+            priority['failure_rate'] = round(stats.get_failure_rate(), 3)
+            priority['expected_time_sec'] = round(stats.get_avg_elapsed_time_sec(), 2)
+        priority['score'] = round(score, 4)
+
+        existing_priority = priority_by_basename.get(basename)
+        if existing_priority is None or existing_priority['score'] < priority['score']:
+            priority_by_basename[basename] = priority
+
+    return sorted(priority_by_basename.values(),
+                  key=lambda priority: (-priority['score'],
+                                        priority.get('expected_time_sec', float('inf')),
+                                        priority['test_program']))
+
+
+def get_test_config(dep_graph, initial_nodes, results, file_changes_by_category,
+                    test_history=None, time_budget_sec=None):
+    """
+    Decides which tests to run based on the results of a query for affected nodes.
+
+    @param test_history an optional TestHistory used to prioritize test programs
+    @param time_budget_sec an optional limit on the total expected running time of C++ test
+                           programs, for run_tests_on_spark.py to apply in the order of priority
+    @return a "test configuration" dictionary as consumed by run_tests_on_spark.py
+    """
+    test_basename_list = sorted(
+            [os.path.basename(node.path) for node in results if node.node_type == 'test'])
+    affected_basenames = set([os.path.basename(node.path) for node in results])
+
+    # These are ALL tests, not just tests affected by the changes in question, used mostly
+    # for logging.
+    all_test_programs = [node for node in dep_graph.get_nodes() if node.node_type == 'test']
+    all_test_basenames = set([os.path.basename(node.path) for node in all_test_programs])
+
+    # A very conservative way to decide whether to run all tests. If there are changes in any
+    # categories (meaning the changeset is non-empty), and there are changes in categories other
+    # than C++ / Java / files known not to affect unit tests, we force re-running all tests.
+    updated_categories = set(file_changes_by_category.keys())
+    unsafe_categories = updated_categories - CATEGORIES_NOT_CAUSING_RERUN_OF_ALL_TESTS
+    user_said_all_tests = get_bool_env_var('YB_RUN_ALL_TESTS')
+    run_all_tests = bool(unsafe_categories) or user_said_all_tests
+
+    user_said_all_cpp_tests = get_bool_env_var('YB_RUN_ALL_CPP_TESTS')
+    user_said_all_java_tests = get_bool_env_var('YB_RUN_ALL_JAVA_TESTS')
+    cpp_files_changed = 'c++' in updated_categories
+    java_files_changed = 'java' in updated_categories
+    yb_master_or_tserver_changed = bool(affected_basenames & set(['yb-master', 'yb-tserver']))
+
+    run_cpp_tests = run_all_tests or cpp_files_changed or user_said_all_cpp_tests
+    run_java_tests = (
+            run_all_tests or java_files_changed or yb_master_or_tserver_changed or
+            user_said_all_java_tests
+        )
+
+    if run_all_tests:
+        if user_said_all_tests:
+            logging.info("User explicitly specified that all tests should be run")
+        else:
+            logging.info(
+                "All tests should be run based on file changes in these categories: {}".format(
+                    ', '.join(sorted(unsafe_categories))))
+    else:
+        if run_cpp_tests:
+            if user_said_all_cpp_tests:
+                logging.info("User explicitly specified that all C++ tests should be run")
+            else:
+                logging.info('Will run some C++ tests, some C++ files changed')
+        if run_java_tests:
+            if user_said_all_java_tests:
+                logging.info("User explicitly specified that all Java tests should be run")
+            else:
+                logging.info('Will run all Java tests, ' +
+                             ' and '.join(
+                                 (['some Java files changed'] if java_files_changed else []) +
+                                 (['yb-{master,tserver} binaries changed']
+                                  if yb_master_or_tserver_changed else [])))
+
+    if run_cpp_tests and not test_basename_list and not run_all_tests:
+        logging.info('There are no C++ test programs affected by the changes, '
+                     'will skip running C++ tests.')
+        run_cpp_tests = False
+
+    test_conf = dict(
+        run_cpp_tests=run_cpp_tests,
+        run_java_tests=run_java_tests,
+        file_changes_by_category=file_changes_by_category,
+        run_all_tests=run_all_tests
+    )
+    if not run_all_tests:
+        test_conf['cpp_test_programs'] = test_basename_list
+        test_conf['cpp_test_program_priorities'] = get_test_priorities(
+                dep_graph, initial_nodes, [node for node in results if node.node_type == 'test'],
+                test_history)
+        if time_budget_sec:
+            test_conf['time_budget_sec'] = time_budget_sec
+        logging.info(
+                "{} C++ test programs should be run (out of {} possible, {}%)".format(
+                    len(test_basename_list),
+                    len(all_test_basenames),
+                    "%.1f" % (100.0 * len(test_basename_list) / len(all_test_basenames))))
+        if len(test_basename_list) != len(all_test_basenames):
+            logging.info("The following C++ test programs will be run: {}".format(
+                ", ".join(sorted(test_basename_list))))
+    return test_conf
+
+
+def get_test_program_digests(conf, dep_graph, test_conf):
+    """
+    @return a dictionary mapping paths of C++ test programs to run according to the given test
+            configuration, relative to the build root, to digests of their transitive inputs. Used
+            by run_tests_on_spark.py to skip tests that already passed with the same inputs. The
+            digests also cover the test scripts and the yb-master / yb-tserver executables.
+    """
+    test_nodes = [node for node in dep_graph.get_nodes() if node.node_type == 'test']
+    if 'cpp_test_programs' in test_conf:
+        test_basenames = set(test_conf['cpp_test_programs'])
+        test_nodes = [node for node in test_nodes
+                      if os.path.basename(node.path) in test_basenames]
+    server_nodes = [node for node in dep_graph.get_nodes()
+                    if node.node_type == 'executable' and
+                    os.path.basename(node.path) in TEST_SERVER_EXECUTABLES]
+    file_digest_cache = FileDigestCache(
+            os.path.join(conf.build_root, FILE_DIGEST_CACHE_FILE_NAME))
+    digests = dep_graph.get_input_digests(test_nodes + server_nodes,
+                                          file_digest_cache.get_digest)
+    untracked_inputs = sorted(
+            ['%s:%s' % (rel_path, file_digest_cache.get_digest(
+                os.path.join(conf.yb_src_root, rel_path)))
+             for rel_path in TEST_SCRIPT_INPUTS] +
+            ['%s:%s' % (os.path.relpath(node.path, conf.build_root), digests[node])
+             for node in server_nodes])
+    file_digest_cache.save()
+    return dict((os.path.relpath(node.path, conf.build_root),
+                 hashlib.sha1("\n".join([digests[node]] + untracked_inputs).encode(
+                     'utf-8')).hexdigest())
+                for node in test_nodes)
+
+
+def write_test_config(test_conf, output_path):
+    with open(output_path, 'w') as output_file:
+        output_file.write(json.dumps(test_conf, indent=2) + "\n")
+    logging.info("Wrote a test configuration to {}".format(output_path))
+
+
+def sort_results(results):
+    return sorted(results, key=lambda node: [node.node_type, node.path])
+
+
+def print_results(results):
+    for node in sort_results(results):
+        print(node)
+    logging.info("Found {} results".format(len(results)))
+
+
+def diff_dependency_graphs(dep_graph, base_dep_graph):
+    """
+    Compares two dependency graphs, e.g. of two build types, or of the same build type at two
+    commits. Paths are compared relative to the build root and the source root of each graph, so
+    that graphs from different build roots can be compared.
+
+    A test program's transitive inputs are considered changed if anything it transitively depends
+    on, or the test program itself, has different dependencies in the two graphs. Test programs
+    whose transitive inputs did not change have identical dependency closures in both graphs.
+    Changes in the contents of files are not taken into account.
+
+    @return a dictionary with added and removed nodes and edges (relative to base_dep_graph), and
+            lists of test programs that were added, removed, changed, and unchanged
+    """
+    def get_nodes_by_key(graph):
+        prefixes = get_path_prefixes(graph.conf)
+        return dict((get_relocatable_path(node.path, prefixes), node)
+                    for node in graph.get_nodes())
+
+    def get_edges(nodes_by_key):
+        key_by_path = dict((node.path, key) for key, node in iteritems(nodes_by_key))
+        return set((key, key_by_path[dep.path])
+                   for key, node in iteritems(nodes_by_key) for dep in node.deps)
+
+    start_time = datetime.now()
+    nodes_by_key = get_nodes_by_key(dep_graph)
+    base_nodes_by_key = get_nodes_by_key(base_dep_graph)
+    edges = get_edges(nodes_by_key)
+    base_edges = get_edges(base_nodes_by_key)
+
+    added_nodes = set(nodes_by_key) - set(base_nodes_by_key)
+    removed_nodes = set(base_nodes_by_key) - set(nodes_by_key)
+    added_edges = edges - base_edges
+    removed_edges = base_edges - edges
+
+    # Nodes that were added, removed, or have different dependencies, and everything depending on
+    # them in either graph.
+    changed_keys = (added_nodes | removed_nodes |
+                    set(dependent for dependent, dependency in added_edges | removed_edges))
+    affected_keys = set(changed_keys)
+    for graph, graph_nodes_by_key in [(dep_graph, nodes_by_key),
+                                      (base_dep_graph, base_nodes_by_key)]:
+        key_by_path = dict((node.path, key) for key, node in iteritems(graph_nodes_by_key))
+        start_nodes = [graph_nodes_by_key[key] for key in changed_keys
+                       if key in graph_nodes_by_key]
+        affected_keys.update(key_by_path[node.path]
+                             for node in graph.find_reverse_reachable_nodes(start_nodes))
+
+    tests = set(key for key, node in iteritems(nodes_by_key) if node.node_type == 'test')
+    base_tests = set(key for key, node in iteritems(base_nodes_by_key)
+                     if node.node_type == 'test')
+    common_tests = tests & base_tests
+    logging.info(
+            "Compared dependency graphs in %.2f sec: %d nodes added, %d removed, %d edges added, "
+            "%d removed, %d of %d common test programs have changed transitive inputs" % (
+                (datetime.now() - start_time).total_seconds(), len(added_nodes),
+                len(removed_nodes), len(added_edges), len(removed_edges),
+                len(common_tests & affected_keys), len(common_tests)))
+    return dict(
+        added_nodes=sorted(added_nodes),
+        removed_nodes=sorted(removed_nodes),
+        added_edges=sorted(added_edges),
+        removed_edges=sorted(removed_edges),
+        added_tests=sorted(tests - base_tests),
+        removed_tests=sorted(base_tests - tests),
+        changed_tests=sorted(common_tests & affected_keys),
+        unchanged_tests=sorted(common_tests - affected_keys))
+
+
+def get_server_socket_path(args):
+    return args.socket_path or os.path.join(args.build_root, SERVER_SOCKET_FILE_NAME)
+
+
+def get_graph_file_stat(graph_path):
+    file_stat = os.stat(graph_path)
+    return (file_stat.st_mtime, file_stat.st_size, file_stat.st_ino)
+
+
+class DependencyGraphServer:
+    """
+    Keeps a dependency graph loaded in memory and answers queries about it. The graph is reloaded
+    from disk before answering a query if the saved graph file has changed.
+
+    Requests and responses are JSON objects. A request has a "command" (one of QUERY_COMMANDS or
+    SERVER_STATUS_REQUEST), and either a "file_changes" list of paths relative to the source root
+    or a "file_regex". It may also specify a "node_type", and ask for a "test_config", optionally
+    with a "time_budget_sec".
+    """
+    def __init__(self, conf, args, dep_graph, graph_path, test_history=None):
+        self.conf = conf
+        self.args = args
+        self.dep_graph = dep_graph
+        self.graph_path = graph_path
+        self.test_history = test_history
+        self.graph_file_stat = get_graph_file_stat(graph_path)
+        self.num_requests = 0
+        self.num_reloads = 0
+
+    def reload_if_changed(self):
+        graph_file_stat = get_graph_file_stat(self.graph_path)
+        if graph_file_stat == self.graph_file_stat:
+            return
+
+        logging.info("Dependency graph at '{}' changed, reloading".format(self.graph_path))
+        start_time = datetime.now()
+        dep_graph = load_dependency_graph(self.conf, self.graph_path, self.args.graph_backend)
+        dep_graph.validate_node_existence()
+        if self.args.precompute_test_closure:
+            dep_graph.precompute_test_closure()
+        self.dep_graph = dep_graph
+        self.graph_file_stat = graph_file_stat
+        self.num_reloads += 1
+        logging.info("Reloaded dependency graph in %.2f sec" %
+                     (datetime.now() - start_time).total_seconds())
+
+    def handle_request(self, request):
+        self.num_requests += 1
+        self.reload_if_changed()
+
+        cmd = request.get('command')
+        if cmd == SERVER_STATUS_REQUEST:
+            return dict(graph_path=self.graph_path,
+                        num_nodes=self.dep_graph.get_num_nodes(),
+                        num_requests=self.num_requests,
+                        num_reloads=self.num_reloads)
+        if cmd not in QUERY_COMMANDS:
+            raise ValueError("Unknown command: {}".format(cmd))
+
+        file_changes = request.get('file_changes')
+        file_regex = request.get('file_regex')
+        if file_changes is None and not file_regex:
+            raise ValueError("Either file_changes or file_regex has to be specified")
+
+        initial_nodes, file_changes_by_category = get_initial_nodes(
+                self.conf, self.dep_graph, file_changes=file_changes, file_regex=file_regex)
+        results = run_query(self.dep_graph, cmd, initial_nodes,
+                            request.get('node_type', NODE_TYPE_ANY))
+        response = dict(results=[dict(path=node.path,
+                                      node_type=node.node_type,
+                                      description=str(node))
+                                 for node in sort_results(results)])
+        if request.get('test_config'):
+            response['test_config'] = get_test_config(
+                    self.dep_graph, initial_nodes, results, file_changes_by_category,
+                    test_history=self.test_history,
+                    time_budget_sec=request.get('time_budget_sec', self.args.time_budget_sec))
+        return response
+
+
+class DependencyGraphRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads requests to the dependency graph server, one JSON object per line, and writes a JSON
+    response line for each of them. A response with an "error" key is sent for failed requests.
+    """
+    # Makes reads from the client socket fail instead of waiting forever for idle clients.
+    timeout = SERVER_CLIENT_TIMEOUT_SEC
+
+    def handle(self):
+        while True:
+            try:
+                line = self.rfile.readline()
+            except socket.timeout:
+                logging.info("Closing a connection idle for more than %d sec" % self.timeout)
+                return
+            if not line:
+                return
+            if not line.strip():
+                continue
+            try:
+                response = self.server.graph_server.handle_request(json.loads(line))
+            except Exception as ex:
+                logging.exception("Failed to handle request: {}".format(line.strip()))
+                response = dict(error=str(ex))
+            self.wfile.write(json.dumps(response) + "\n")
+            self.wfile.flush()
+
+
+def serve_dependency_graph(conf, args, dep_graph, graph_path, test_history=None):
+    """
+    Serves dependency graph queries on a Unix domain socket until interrupted. Requests are handled
+    one at a time, which is sufficient because every query only takes a small fraction of the time
+    that loading the graph from scratch would. Clients that stay idle for more than
+    SERVER_CLIENT_TIMEOUT_SEC are disconnected, so that they do not block others.
+    """
+    socket_path = get_server_socket_path(args)
+    if os.path.exists(socket_path):
+        if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            raise RuntimeError("Not a socket: {}".format(socket_path))
+        try:
+            query_dependency_graph_server(socket_path, dict(command=SERVER_STATUS_REQUEST))
+        except socket.error:
+            logging.info("Removing a stale socket at '{}'".format(socket_path))
+            os.remove(socket_path)
+        else:
+            raise RuntimeError(
+                    "A dependency graph server is already running at '{}'".format(socket_path))
+
+    server = socketserver.UnixStreamServer(socket_path, DependencyGraphRequestHandler)
+    server.graph_server = DependencyGraphServer(conf, args, dep_graph, graph_path, test_history)
+    logging.info("Serving dependency graph queries on '{}'".format(socket_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down the dependency graph server")
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def query_dependency_graph_server(socket_path, request):
+    """
+    Sends one request to a dependency graph server started with the "serve" command.
+
+    @return the response as a dictionary
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock_file = sock.makefile('rw')
+        sock_file.write(json.dumps(request) + "\n")
+        sock_file.flush()
+        response_line = sock_file.readline()
+        sock_file.close()
+    finally:
+        sock.close()
+
+    if not response_line:
+        raise RuntimeError("No response from the dependency graph server at '{}'".format(
+            socket_path))
+    response = json.loads(response_line)
+    if 'error' in response:
+        raise RuntimeError("Dependency graph server error: {}".format(response['error']))
+    return response
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='A tool for working with the dependency graph')
@@ -832,10 +3176,145 @@ def main():
                         help='Output a "test configuration file", which is a JSON containing the '
                              'resulting list of C++ tests to run to this file, a flag indicating '
                              'wheter to run Java tests or not, etc.')
+    parser.add_argument('--header-analysis',
+                        default=HEADER_ANALYSIS_NONE,
+                        choices=HEADER_ANALYSIS_MODES,
+                        help='For the {} command, narrow down the impact of changed headers: '
+                             '"includes" only considers translation units that include a changed '
+                             'header through #include directives (rather than e.g. a precompiled '
+                             'header), and "symbols" additionally requires a translation unit or '
+                             'another header it includes to mention an identifier changed in the '
+                             'header, based on --git-diff or --git-commit. The symbols mode is a '
+                             'heuristic and could miss uses e.g. through macros.'.format(
+                                 LIST_AFFECTED_CMD))
+    parser.add_argument('--test-history-dir',
+                        help='A directory with historical test reports saved by '
+                             'run_tests_on_spark.py, e.g. its --reports-dir or a per-build-type '
+                             'subdirectory of it. Historical failure rates and running times of '
+                             'test programs are used to prioritize them in the test '
+                             'configuration.')
+    parser.add_argument('--max-test-history-reports',
+                        type=int,
+                        default=DEFAULT_MAX_REPORTS,
+                        help='Maximum number of most recent test reports to load from '
+                             '--test-history-dir.')
+    parser.add_argument('--time-budget-sec',
+                        type=float,
+                        help='Limit on the total expected running time of C++ test programs to '
+                             'put into the test configuration. Test programs are run in the order '
+                             'of priority until their expected running times add up to this.')
     parser.add_argument('--incomplete-build',
                         action='store_true',
                         help='Skip checking for file existence. Allows using the tool after '
                              'build artifacts have been deleted.')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='Update the saved dependency graph by re-parsing only the '
+                             'depend.make, link.txt, and yb_cmake_deps.txt files that changed '
+                             'since the graph was saved. Falls back to rebuilding the graph from '
+                             'scratch if the state of the inputs was not saved.')
+    parser.add_argument('--graph-format',
+                        default=GRAPH_FORMAT_JSON,
+                        choices=sorted(GRAPH_FILE_NAMES.keys()),
+                        help='Format of the saved dependency graph in the build root. The binary '
+                             'format is faster to load. The jsonl format is line-delimited JSON '
+                             'that is loaded one record at a time, without parsing the whole '
+                             'file in memory first. Use the {} command to compare the '
+                             'formats.'.format(BENCHMARK_LOAD_CMD))
+    parser.add_argument('--graph-backend',
+                        default=GRAPH_BACKEND_OBJECTS,
+                        choices=GRAPH_BACKENDS,
+                        help='In-memory representation of the dependency graph to use for queries. '
+                             'The compact representation stores nodes and edges in integer arrays, '
+                             'and is fastest to load from the binary graph format.')
+    parser.add_argument('--reverse-closure-cache-size',
+                        type=int,
+                        default=256,
+                        help='Maximum number of per-node sets of transitively dependent nodes to '
+                             'cache between dependency graph queries.')
+    parser.add_argument('--precompute-test-closure',
+                        action='store_true',
+                        help='Precompute the set of test programs depending on every node as a '
+                             'bitmap. Makes queries for affected tests with many changed files '
+                             'much faster, at the cost of a one-time computation.')
+    parser.add_argument('--validation-mode',
+                        default=VALIDATION_MODE_FULL,
+                        choices=VALIDATION_MODES,
+                        help='How to check that build artifacts in a saved dependency graph exist: '
+                             'check all of them, a random sample of them, only the ones used by '
+                             'the query (lazy), or none.')
+    parser.add_argument('--validation-sample-fraction',
+                        type=float,
+                        default=0.05,
+                        help='Fraction of build artifacts to check in the sampled validation '
+                             'mode.')
+    parser.add_argument('--validation-threads',
+                        type=int,
+                        default=8,
+                        help='Number of threads to check existence of build artifacts with.')
+    parser.add_argument('--path-cache-size',
+                        type=int,
+                        default=1000000,
+                        help='Maximum number of canonical paths to cache while building or loading '
+                             'the dependency graph.')
+    parser.add_argument('--socket-path',
+                        help='Unix domain socket for the {} command to listen on, and for '
+                             '--use-server to connect to. Defaults to {} in the build '
+                             'root.'.format(SERVE_CMD, SERVER_SOCKET_FILE_NAME))
+    parser.add_argument('--use-server',
+                        action='store_true',
+                        help='Send the query to a dependency graph server started with the {} '
+                             'command instead of loading the dependency graph.'.format(SERVE_CMD))
+    parser.add_argument('--synthetic-graph-nodes',
+                        type=int,
+                        help='With the {} command, benchmark loading a generated dependency graph '
+                             'with about this many nodes instead of the graph of the build '
+                             'root, e.g. 200000.'.format(BENCHMARK_LOAD_CMD))
+    parser.add_argument('--explain-target',
+                        help='With the {} command, a path or a basename of a node, usually a '
+                             'test program, to print shortest chains of dependencies to from the '
+                             'initial nodes. Without this, the {} command lists headers and '
+                             'libraries through which the initial nodes affect the most test '
+                             'programs.'.format(EXPLAIN_CMD, EXPLAIN_CMD))
+    parser.add_argument('--max-paths',
+                        type=int,
+                        default=3,
+                        help='Maximum number of shortest paths for --explain-target to print.')
+    parser.add_argument('--max-hubs',
+                        type=int,
+                        default=20,
+                        help='Maximum number of headers and libraries for the {} command to list '
+                             'without --explain-target.'.format(EXPLAIN_CMD))
+    parser.add_argument('--test-input-digests',
+                        action='store_true',
+                        help='Add digests of the contents of all transitive inputs of every C++ '
+                             'test program to run to the test configuration. This allows '
+                             'run_tests_on_spark.py to skip tests that already passed with '
+                             'exactly the same inputs.')
+    parser.add_argument('--base-build-root',
+                        help='With the {} command, the build root of the dependency graph to '
+                             'compare with, e.g. of a different build type.'.format(
+                                 DIFF_GRAPHS_CMD))
+    parser.add_argument('--base-graph',
+                        help='With the {} command, a saved dependency graph to compare with, '
+                             'e.g. one saved at a different commit. Defaults to the graph in '
+                             '--base-build-root.'.format(DIFF_GRAPHS_CMD))
+    parser.add_argument('--diff-output',
+                        help='Save the JSON output of the {} command to this file instead of '
+                             'printing it.'.format(DIFF_GRAPHS_CMD))
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help='Save a JSON report with the wall time, number of files and bytes '
+                             'read, path resolution cache hit rates, and node and edge counts '
+                             'of every phase of building or loading the dependency graph.')
+    parser.add_argument('--profile-output',
+                        help='Where to save the report of --profile. Defaults to '
+                             'dependency_graph_profile.json in the build root.')
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        help='Number of worker processes to use for parsing depend.make and '
+                             'link.txt files when rebuilding the dependency graph.')
     args = parser.parse_args()
 
     if args.file_regex and args.file_name_glob:
@@ -845,12 +3324,18 @@ def main():
     if (not args.file_regex and
             not args.file_name_glob and
             not args.rebuild_graph and
+            not args.incremental and
             not args.git_diff and
             not args.git_commit and
-            cmd != SELF_TEST_CMD):
+            cmd not in [SELF_TEST_CMD, BENCHMARK_LOAD_CMD, SERVE_CMD, DIFF_GRAPHS_CMD]):
         raise RuntimeError(
-                "Neither of --file-regex, --file-name-glob, --git-{diff,commit}, or "
-                "--rebuild-graph are specified, and the command is not " + SELF_TEST_CMD)
+                "Neither of --file-regex, --file-name-glob, --git-{diff,commit}, --rebuild-graph, "
+                "or --incremental are specified, and the command is not {}, {}, {}, or {}".format(
+                    SELF_TEST_CMD, BENCHMARK_LOAD_CMD, SERVE_CMD, DIFF_GRAPHS_CMD))
+
+    if cmd == DIFF_GRAPHS_CMD and not args.base_build_root and not args.base_graph:
+        raise RuntimeError("The {} command requires --base-build-root or --base-graph".format(
+            DIFF_GRAPHS_CMD))
 
     log_level = logging.INFO
     logging.basicConfig(
@@ -865,165 +3350,181 @@ def main():
     if args.git_diff and args.git_commit:
         raise RuntimeError('--git-diff and --git-commit are incompatible')
 
+    if args.jobs < 1:
+        raise RuntimeError('--jobs must be at least 1, got: {}'.format(args.jobs))
+
+    if args.validation_threads < 1:
+        raise RuntimeError('--validation-threads must be at least 1, got: {}'.format(
+            args.validation_threads))
+
+    if not 0 < args.validation_sample_fraction <= 1:
+        raise RuntimeError('--validation-sample-fraction must be in (0, 1], got: {}'.format(
+            args.validation_sample_fraction))
+
     if args.git_commit:
         args.git_diff = "{}^..{}".format(args.git_commit, args.git_commit)
 
-    graph_cache_path = os.path.join(args.build_root, 'dependency_graph.json')
+    if args.use_server:
+        if cmd not in QUERY_COMMANDS:
+            raise RuntimeError("--use-server only works with these commands: {}".format(
+                ', '.join(QUERY_COMMANDS)))
+        request = dict(command=cmd,
+                       node_type=args.node_type,
+                       test_config=bool(args.output_test_config))
+        if args.time_budget_sec:
+            request['time_budget_sec'] = args.time_budget_sec
+        if args.git_diff:
+            request['file_changes'] = get_git_diff_file_changes(conf, args.git_diff)
+        else:
+            request['file_regex'] = conf.file_regex
+        response = query_dependency_graph_server(get_server_socket_path(args), request)
+        if args.output_test_config:
+            write_test_config(response['test_config'], args.output_test_config)
+        else:
+            for result in response['results']:
+                print(result['description'])
+            logging.info("Found {} results".format(len(response['results'])))
+        return
+
+    if cmd == BENCHMARK_LOAD_CMD and args.synthetic_graph_nodes:
+        benchmark_synthetic_graph_loading(conf, args.synthetic_graph_nodes)
+        return
+
+    graph_cache_path = get_graph_cache_path(args.build_root, args.graph_format)
+    build_inputs_path = os.path.join(args.build_root, 'dependency_graph_inputs.json')
+    profiler = GraphBuildProfiler(enabled=args.profile)
+    # Signatures of build files and the edges they contribute are only needed for incremental
+    # updates, so we only record and save them with --incremental.
+    dep_graph_builder = DependencyGraphBuilder(conf, profiler,
+                                               record_build_inputs=args.incremental)
+    if args.incremental and not args.rebuild_graph and os.path.isfile(graph_cache_path) and (
+            not os.path.isfile(build_inputs_path) or
+            not dep_graph_builder.load_build_inputs(build_inputs_path)):
+        logging.info("No usable state of dependency graph build inputs found at '{}', will "
+                     "rebuild the dependency graph from scratch".format(build_inputs_path))
+        args.rebuild_graph = True
+
+    def save_graph_and_build_inputs(dep_graph):
+        with profiler.phase('save_graph', dep_graph) as phase:
+            save_dependency_graph(dep_graph, graph_cache_path)
+            phase.counters.update(graph_format=args.graph_format,
+                                  bytes_written=os.path.getsize(graph_cache_path))
+        if args.incremental:
+            with profiler.phase('save_build_inputs') as phase:
+                dep_graph_builder.save_build_inputs(build_inputs_path)
+                phase.counters['bytes_written'] = os.path.getsize(build_inputs_path)
+        elif os.path.exists(build_inputs_path):
+            # The saved build inputs no longer match the saved graph.
+            os.remove(build_inputs_path)
+
     if args.rebuild_graph or not os.path.isfile(graph_cache_path):
         logging.info("Generating a dependency graph at '{}'".format(graph_cache_path))
-        dep_graph_builder = DependencyGraphBuilder(conf)
         dep_graph = dep_graph_builder.build()
-        dep_graph.save_as_json(graph_cache_path)
+        save_graph_and_build_inputs(dep_graph)
     else:
         start_time = datetime.now()
-        with open(graph_cache_path) as graph_input_file:
-            dep_graph = DependencyGraph(conf, json_data=json.load(graph_input_file))
+        with profiler.phase('load_graph') as phase:
+            # Incremental updates modify the graph, so they need the mutable representation.
+            dep_graph = load_dependency_graph(
+                    conf, graph_cache_path,
+                    GRAPH_BACKEND_OBJECTS if args.incremental else args.graph_backend)
+            phase.dep_graph = dep_graph
+            phase.path_resolver = getattr(dep_graph, 'path_resolver', None)
+            phase.counters.update(graph_format=args.graph_format,
+                                  num_files=1,
+                                  bytes_read=os.path.getsize(graph_cache_path))
         logging.info("Loaded dependency graph from '%s' in %.2f sec" %
                      (graph_cache_path, (datetime.now() - start_time).total_seconds()))
-        dep_graph.validate_node_existence()
+        if args.incremental and dep_graph_builder.update_incrementally(dep_graph):
+            save_graph_and_build_inputs(dep_graph)
+        with profiler.phase('validate_existence', dep_graph) as phase:
+            phase.counters['num_files'] = dep_graph.validate_node_existence()
+
+    if (args.graph_backend == GRAPH_BACKEND_COMPACT and
+            not isinstance(dep_graph, CompactDependencyGraph)):
+        with profiler.phase('convert_to_compact') as phase:
+            dep_graph = CompactDependencyGraph.from_dependency_graph(dep_graph)
+            phase.dep_graph = dep_graph
+
+    if args.precompute_test_closure:
+        with profiler.phase('precompute_test_closure', dep_graph):
+            dep_graph.precompute_test_closure()
+
+    if args.profile:
+        profiler.save_report(args.profile_output or
+                             os.path.join(args.build_root, 'dependency_graph_profile.json'))
+
+    if cmd == BENCHMARK_LOAD_CMD:
+        benchmark_graph_loading(conf, save_graph_in_all_formats(dep_graph, conf.build_root))
+        return
 
     if cmd == SELF_TEST_CMD:
         run_self_test(dep_graph)
         return
 
-    updated_categories = None
-    file_changes = []
+    test_history = None
+    if args.test_history_dir and (args.output_test_config or cmd == SERVE_CMD):
+        test_history = load_test_history(args.test_history_dir, args.max_test_history_reports)
+
+    if cmd == SERVE_CMD:
+        serve_dependency_graph(conf, args, dep_graph, graph_cache_path, test_history)
+        return
+
+    if cmd == DIFF_GRAPHS_CMD:
+        base_args = copy.copy(args)
+        base_args.build_root = args.base_build_root or args.build_root
+        base_conf = Configuration(base_args)
+        base_graph_path = args.base_graph or get_graph_cache_path(
+                base_conf.build_root, args.graph_format)
+        base_dep_graph = load_dependency_graph(base_conf, base_graph_path, args.graph_backend)
+        logging.info("Loaded the base dependency graph from '{}'".format(base_graph_path))
+        graph_diff = diff_dependency_graphs(dep_graph, base_dep_graph)
+        graph_diff.update(graph=graph_cache_path, base_graph=base_graph_path)
+        if args.diff_output:
+            with open(args.diff_output, 'w') as output_file:
+                json.dump(graph_diff, output_file, indent=2, sort_keys=True)
+            logging.info("Saved the dependency graph diff to '{}'".format(args.diff_output))
+        else:
+            print(json.dumps(graph_diff, indent=2, sort_keys=True))
+        return
+
+    file_changes = None
     if args.git_diff:
-        old_working_dir = os.getcwd()
-        os.chdir(conf.yb_src_root)
-        git_diff_output = subprocess.check_output(
-                ['git', 'diff', args.git_diff, '--name-only'])
-
-        initial_nodes = set()
-        file_paths = set()
-        for file_path in git_diff_output.split("\n"):
-            file_path = file_path.strip()
-            if not file_path:
-                continue
-            file_changes.append(file_path)
-            # It is important that we invoke os.path.realpath with the current directory set to
-            # the git repository root.
-            file_path = os.path.realpath(file_path)
-            file_paths.add(file_path)
-            node = dep_graph.node_by_path.get(file_path)
-            if node:
-                initial_nodes.add(node)
-
-        os.chdir(old_working_dir)
-
-        if not initial_nodes:
-            logging.warning("Did not find any graph nodes for this set of files: {}".format(
-                file_paths))
-            for basename in set([os.path.basename(file_path) for file_path in file_paths]):
-                logging.warning("Nodes for basename '{}': {}".format(
-                    basename, dep_graph.find_nodes_by_basename(basename)))
-
-        file_changes_by_category = group_by(file_changes, get_file_category)
-        for category, changes in file_changes_by_category.items():
-            logging.info("File changes in category '{}':".format(category))
-            for change in sorted(changes):
-                logging.info("    {}".format(change))
-        updated_categories = set(file_changes_by_category.keys())
-
-    elif conf.file_regex:
-        logging.info("Using file name regex: {}".format(conf.file_regex))
-        initial_nodes = dep_graph.find_nodes_by_regex(conf.file_regex)
-    else:
+        file_changes = get_git_diff_file_changes(conf, args.git_diff)
+    elif not conf.file_regex:
         raise RuntimeError("Could not figure out how to generate the initial set of files")
 
-    results = set()
-    if cmd == LIST_AFFECTED_CMD:
-        results = dep_graph.find_affected_nodes(initial_nodes, args.node_type)
-    elif cmd == LIST_DEPS_CMD:
-        for node in initial_nodes:
-            results.update(node.deps)
-    elif cmd == LIST_REVERSE_DEPS_CMD:
-        for node in initial_nodes:
-            results.update(node.reverse_deps)
+    initial_nodes, file_changes_by_category = get_initial_nodes(
+            conf, dep_graph, file_changes=file_changes)
+    if cmd == EXPLAIN_CMD:
+        explain_affected_nodes(dep_graph, initial_nodes, args.explain_target,
+                               max_paths=args.max_paths, max_hubs=args.max_hubs)
+        return
+
+    header_impact = None
+    if cmd == LIST_AFFECTED_CMD and args.header_analysis != HEADER_ANALYSIS_NONE:
+        results, header_impact = find_affected_nodes_with_header_analysis(
+                conf, dep_graph, initial_nodes, args.node_type, args.header_analysis,
+                git_diff=args.git_diff, file_changes=file_changes)
     else:
-        raise RuntimeError("Unimplemented command '{}'".format(command))
+        results = run_query(dep_graph, cmd, initial_nodes, args.node_type)
 
     if args.output_test_config:
-        test_basename_list = sorted(
-                [os.path.basename(node.path) for node in results if node.node_type == 'test'])
-        affected_basenames = set([os.path.basename(node.path) for node in results])
-
-        # These are ALL tests, not just tests affected by the changes in question, used mostly
-        # for logging.
-        all_test_programs = [node for node in dep_graph.get_nodes() if node.node_type == 'test']
-        all_test_basenames = set([os.path.basename(node.path) for node in all_test_programs])
-
-        # A very conservative way to decide whether to run all tests. If there are changes in any
-        # categories (meaning the changeset is non-empty), and there are changes in categories other
-        # than C++ / Java / files known not to affect unit tests, we force re-running all tests.
-        unsafe_categories = updated_categories - CATEGORIES_NOT_CAUSING_RERUN_OF_ALL_TESTS
-        user_said_all_tests = get_bool_env_var('YB_RUN_ALL_TESTS')
-        run_all_tests = bool(unsafe_categories) or user_said_all_tests
-
-        user_said_all_cpp_tests = get_bool_env_var('YB_RUN_ALL_CPP_TESTS')
-        user_said_all_java_tests = get_bool_env_var('YB_RUN_ALL_JAVA_TESTS')
-        cpp_files_changed = 'c++' in updated_categories
-        java_files_changed = 'java' in updated_categories
-        yb_master_or_tserver_changed = bool(affected_basenames & set(['yb-master', 'yb-tserver']))
-
-        run_cpp_tests = run_all_tests or cpp_files_changed or user_said_all_cpp_tests
-        run_java_tests = (
-                run_all_tests or java_files_changed or yb_master_or_tserver_changed or
-                user_said_all_java_tests
-            )
-
-        if run_all_tests:
-            if user_said_all_tests:
-                logging.info("User explicitly specified that all tests should be run")
-            else:
-                logging.info(
-                    "All tests should be run based on file changes in these categories: {}".format(
-                        ', '.join(sorted(unsafe_categories))))
-        else:
-            if run_cpp_tests:
-                if user_said_all_cpp_tests:
-                    logging.info("User explicitly specified that all C++ tests should be run")
-                else:
-                    logging.info('Will run some C++ tests, some C++ files changed')
-            if run_java_tests:
-                if user_said_all_java_tests:
-                    logging.info("User explicitly specified that all Java tests should be run")
-                else:
-                    logging.info('Will run all Java tests, ' +
-                                 ' and '.join(
-                                     (['some Java files changed'] if java_files_changed else []) +
-                                     (['yb-{master,tserver} binaries changed']
-                                      if yb_master_or_tserver_changed else [])))
-
-        if run_cpp_tests and not test_basename_list and not run_all_tests:
-            logging.info('There are no C++ test programs affected by the changes, '
-                         'will skip running C++ tests.')
-            run_cpp_tests = False
-
-        test_conf = dict(
-            run_cpp_tests=run_cpp_tests,
-            run_java_tests=run_java_tests,
-            file_changes_by_category=file_changes_by_category
-        )
-        if not run_all_tests:
-            test_conf['cpp_test_programs'] = test_basename_list
-            logging.info(
-                    "{} C++ test programs should be run (out of {} possible, {}%)".format(
-                        len(test_basename_list),
-                        len(all_test_basenames),
-                        "%.1f" % (100.0 * len(test_basename_list) / len(all_test_basenames))))
-            if len(test_basename_list) != len(all_test_basenames):
-                logging.info("The following C++ test programs will be run: {}".format(
-                    ", ".join(sorted(test_basename_list))))
-
-        with open(args.output_test_config, 'w') as output_file:
-            output_file.write(json.dumps(test_conf, indent=2) + "\n")
-        logging.info("Wrote a test configuration to {}".format(args.output_test_config))
+        test_conf = get_test_config(dep_graph, initial_nodes, results, file_changes_by_category,
+                                    test_history=test_history,
+                                    time_budget_sec=args.time_budget_sec)
+        if header_impact:
+            test_conf['header_impact'] = header_impact
+        # When all tests should be run, e.g. because of changes to files the dependency graph
+        # does not know about, don't let run_tests_on_spark.py skip any tests based on digests.
+        if (args.test_input_digests and test_conf['run_cpp_tests'] and
+                not test_conf['run_all_tests']):
+            test_conf['cpp_test_program_digests'] = get_test_program_digests(
+                    conf, dep_graph, test_conf)
+        write_test_config(test_conf, args.output_test_config)
     else:
         # For ad-hoc command-line use, mostly for testing and sanity-checking.
-        for node in sorted(results, key=lambda node: [node.node_type, node.path]):
-            print(node)
-        logging.info("Found {} results".format(len(results)))
+        print_results(results)
 
 
 if __name__ == '__main__':
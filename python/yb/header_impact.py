@@ -0,0 +1,413 @@
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Finer-grained analysis of which translation units are affected by header changes than what
+depend.make files give us. A depend.make file lists every header an object file was compiled
+against, including headers that only come from forced includes (-include) such as precompiled
+header chains. Here we follow the actual #include directives of every translation unit, using the
+include directories from compile_commands.json, and optionally check whether a translation unit
+mentions any of the identifiers changed in a header.
+"""
+
+import json
+import logging
+import os
+import re
+import shlex
+import subprocess
+
+from collections import defaultdict
+
+
+INCLUDE_DIRECTIVE_RE = re.compile(r'^\s*#\s*include\s*([<"])([^>"]+)[>"]', re.MULTILINE)
+IDENTIFIER_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+LINE_COMMENT_RE = re.compile(r'//.*$')
+BLOCK_COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+STRING_LITERAL_RE = re.compile(r'"(?:[^"\\]|\\.)*"')
+CHAR_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.)+'")
+TYPE_KEYWORD_RE = re.compile(r'\b(?:class|struct|union|enum)\b')
+HUNK_HEADER_RE = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@')
+
+HEADER_FILE_EXTENSIONS = ['.h', '.hpp', '.hxx', '.inc']
+
+# Identifiers that are too common to tell us anything about whether a translation unit uses a
+# changed declaration.
+CPP_KEYWORDS = set([
+    'alignas', 'alignof', 'auto', 'bool', 'break', 'case', 'catch', 'char', 'class', 'const',
+    'constexpr', 'const_cast', 'continue', 'decltype', 'default', 'delete', 'do', 'double',
+    'dynamic_cast', 'else', 'enum', 'explicit', 'extern', 'false', 'final', 'float', 'for',
+    'friend', 'goto', 'if', 'inline', 'int', 'long', 'mutable', 'namespace', 'new', 'noexcept',
+    'nullptr', 'operator', 'override', 'private', 'protected', 'public', 'register',
+    'reinterpret_cast', 'return', 'short', 'signed', 'sizeof', 'static', 'static_assert',
+    'static_cast', 'struct', 'switch', 'template', 'this', 'throw', 'true', 'try', 'typedef',
+    'typeid', 'typename', 'union', 'unsigned', 'using', 'virtual', 'void', 'volatile', 'while',
+    'std', 'size_t', 'string', 'vector', 'int32_t', 'int64_t', 'uint32_t', 'uint64_t', 'uint8_t'])
+
+# Modes of header impact analysis.
+HEADER_ANALYSIS_NONE = 'none'
+HEADER_ANALYSIS_INCLUDES = 'includes'
+HEADER_ANALYSIS_SYMBOLS = 'symbols'
+HEADER_ANALYSIS_MODES = [HEADER_ANALYSIS_NONE, HEADER_ANALYSIS_INCLUDES, HEADER_ANALYSIS_SYMBOLS]
+
+
+def is_header(path):
+    return os.path.splitext(path)[1] in HEADER_FILE_EXTENSIONS
+
+
+def get_include_directives(contents):
+    """
+    @return a list of (included name, whether the name is in quotes) tuples
+
+    >>> get_include_directives('#include "yb/util/status.h"\\n  #  include <vector>\\n// x')
+    [('yb/util/status.h', True), ('vector', False)]
+    """
+    return [(name, quote == '"') for quote, name in INCLUDE_DIRECTIVE_RE.findall(contents)]
+
+
+def get_identifiers(line):
+    """
+    @return the set of identifiers in a line of C++ code, except for keywords and the contents of
+            string literals and line comments
+
+    >>> sorted(get_identifiers('  static const int kMaxSize = Foo("bar"); // baz'))
+    ['Foo', 'kMaxSize']
+    """
+    line = LINE_COMMENT_RE.sub('', STRING_LITERAL_RE.sub('""', line))
+    return set(IDENTIFIER_RE.findall(line)) - CPP_KEYWORDS
+
+
+def get_type_body_lines(contents):
+    """
+    Finds the lines where changes could change the layout of a class, e.g. adding a data member or
+    a virtual function, which affects every translation unit using the class, whether or not it
+    mentions the new member. This only matches braces, so a function returning e.g. "struct Foo *"
+    is also treated as a type body, which is safe.
+
+    @return the set of numbers, starting from 1, of the lines within the body of a class, struct,
+            union, or enum definition, including the lines with its braces
+
+    >>> sorted(get_type_body_lines('\\n'.join([
+    ...     'class A {', '  int x; /* } */', '};', 'void f() {', "  g('{');", '}', 'struct B',
+    ...     '{ int y; };', 'enum class C : int { kX };'])))
+    [1, 2, 3, 8, 9]
+    """
+    contents = BLOCK_COMMENT_RE.sub(lambda match: "\n" * match.group(0).count("\n"), contents)
+    lines_in_bodies = set()
+    # Whether each of the currently open braces starts a type body.
+    open_braces = []
+    num_open_type_bodies = 0
+    # The code since the last brace or semicolon.
+    declaration = ''
+    for line_number, line in enumerate(contents.split("\n"), 1):
+        if num_open_type_bodies:
+            lines_in_bodies.add(line_number)
+        if line.lstrip().startswith('#'):
+            continue
+        line = LINE_COMMENT_RE.sub(
+                '', CHAR_LITERAL_RE.sub("''", STRING_LITERAL_RE.sub('""', line)))
+        for char in line:
+            if char == '{':
+                is_type_body = TYPE_KEYWORD_RE.search(declaration) is not None
+                open_braces.append(is_type_body)
+                if is_type_body:
+                    num_open_type_bodies += 1
+                    lines_in_bodies.add(line_number)
+                declaration = ''
+            elif char == '}':
+                if open_braces and open_braces.pop():
+                    num_open_type_bodies -= 1
+                declaration = ''
+            elif char == ';':
+                declaration = ''
+            else:
+                declaration += char
+        declaration += ' '
+    return lines_in_bodies
+
+
+class CompileCommand:
+    """
+    The parts of a compile_commands.json entry that matter for resolving includes.
+
+    >>> command = CompileCommand({
+    ...     'directory': '/build', 'file': '/src/a.cc',
+    ...     'command': 'c++ -I/src -Igen -iquote /q -isystem /sys -include pch.h -o a.o -c a.cc'})
+    >>> command.output_path
+    '/build/a.o'
+    >>> command.quote_dirs
+    ['/q']
+    >>> command.angle_dirs
+    ['/src', '/build/gen', '/sys']
+    >>> command.forced_includes
+    ['/build/pch.h']
+    """
+    def __init__(self, entry):
+        directory = entry['directory']
+        self.source_path = os.path.join(directory, entry['file'])
+        args = entry.get('arguments') or shlex.split(entry['command'])
+
+        self.output_path = None
+        self.quote_dirs = []
+        self.angle_dirs = []
+        self.forced_includes = []
+        system_dirs = []
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            for flag, values in [('-iquote', self.quote_dirs),
+                                 ('-isystem', system_dirs),
+                                 ('-include', self.forced_includes),
+                                 ('-I', self.angle_dirs),
+                                 ('-o', None)]:
+                # Compilers have other flags starting with "-o", so only accept "-o <path>".
+                if not arg.startswith(flag) or flag == '-o' and arg != flag:
+                    continue
+                value = arg[len(flag):]
+                if not value and i + 1 < len(args):
+                    i += 1
+                    value = args[i]
+                value = os.path.join(directory, value)
+                if values is None:
+                    self.output_path = value
+                else:
+                    values.append(value)
+                break
+            i += 1
+        self.angle_dirs += system_dirs
+        self.include_dirs_key = (tuple(self.quote_dirs), tuple(self.angle_dirs))
+
+
+class HeaderImpactAnalyzer:
+    """
+    Decides whether an object file is really affected by a change to a header it was compiled
+    against.
+    """
+    def __init__(self, compile_commands_path):
+        with open(compile_commands_path) as commands_file:
+            entries = json.load(commands_file)
+        self.command_by_output_path = {}
+        for entry in entries:
+            command = CompileCommand(entry)
+            if command.output_path:
+                self.command_by_output_path[os.path.realpath(command.output_path)] = command
+
+        self.include_directives_by_path = {}
+        self.resolved_includes_cache = {}
+        self.include_closure_cache = {}
+        self.identifiers_by_path = {}
+        self.is_file_cache = {}
+        logging.info("Loaded {} compile commands from '{}'".format(
+            len(self.command_by_output_path), compile_commands_path))
+
+    def is_file(self, path):
+        result = self.is_file_cache.get(path)
+        if result is None:
+            result = os.path.isfile(path)
+            self.is_file_cache[path] = result
+        return result
+
+    def read_file(self, path):
+        try:
+            with open(path) as input_file:
+                return input_file.read()
+        except IOError as ex:
+            logging.warning("Could not read '{}': {}".format(path, ex))
+            return ''
+
+    def get_resolved_includes(self, path, command):
+        """
+        @return real paths of files included from the given file, resolved the same way the
+                compiler would do it for the given compile command. Includes that cannot be
+                resolved, such as system headers, are skipped.
+        """
+        cache_key = (path, command.include_dirs_key)
+        resolved_includes = self.resolved_includes_cache.get(cache_key)
+        if resolved_includes is not None:
+            return resolved_includes
+
+        include_directives = self.include_directives_by_path.get(path)
+        if include_directives is None:
+            include_directives = get_include_directives(self.read_file(path))
+            self.include_directives_by_path[path] = include_directives
+
+        resolved_includes = []
+        for name, is_quoted in include_directives:
+            search_dirs = command.angle_dirs
+            if is_quoted:
+                search_dirs = [os.path.dirname(path)] + command.quote_dirs + search_dirs
+            for search_dir in search_dirs:
+                candidate_path = os.path.join(search_dir, name)
+                if self.is_file(candidate_path):
+                    resolved_includes.append(os.path.realpath(candidate_path))
+                    break
+        self.resolved_includes_cache[cache_key] = resolved_includes
+        return resolved_includes
+
+    def get_include_closure(self, command):
+        """
+        @return real paths of the source file of the given compile command and of all headers it
+                includes through #include directives, directly or transitively. Headers that only
+                come from forced includes are not part of this.
+        """
+        closure = self.include_closure_cache.get(command.output_path)
+        if closure is not None:
+            return closure
+
+        source_path = os.path.realpath(command.source_path)
+        closure = set([source_path])
+        stack = [source_path]
+        while stack:
+            for included_path in self.get_resolved_includes(stack.pop(), command):
+                if included_path not in closure:
+                    closure.add(included_path)
+                    stack.append(included_path)
+        self.include_closure_cache[command.output_path] = closure
+        return closure
+
+    def get_file_identifiers(self, path):
+        identifiers = self.identifiers_by_path.get(path)
+        if identifiers is None:
+            identifiers = set(IDENTIFIER_RE.findall(self.read_file(path)))
+            self.identifiers_by_path[path] = identifiers
+        return identifiers
+
+    def is_object_affected(self, object_path, header_path, changed_identifiers=None):
+        """
+        @param changed_identifiers identifiers on the changed lines of the header, or None to only
+                                   check whether the header is really included
+        @return whether the given object file has to be considered affected by a change to the
+                given header. Object files we don't have compile commands for are always
+                considered affected, and so are all object files compiled against a header that
+                has been deleted, as we can't tell which of them would still include it.
+        """
+        command = self.command_by_output_path.get(object_path)
+        if command is None or not self.is_file(header_path):
+            return True
+        closure = self.get_include_closure(command)
+        if header_path not in closure:
+            return False
+        if changed_identifiers is None:
+            return True
+        for path in closure:
+            if path != header_path and not changed_identifiers.isdisjoint(
+                    self.get_file_identifiers(path)):
+                return True
+        return False
+
+
+def parse_changed_identifiers(diff_output):
+    """
+    Finds identifiers on added and removed lines of every file in the output of "git diff". A file
+    maps to None if we should not try to narrow down the impact of changing it based on
+    identifiers, e.g. because a preprocessor directive changed.
+
+    >>> result = parse_changed_identifiers('\\n'.join([
+    ...     'diff --git a/src/a.h b/src/a.h', '--- a/src/a.h', '+++ b/src/a.h', '@@ -1 +1 @@',
+    ...     '-int Foo();', '+int Foo(int x);',
+    ...     'diff --git a/src/b.h b/src/b.h', '--- a/src/b.h', '+++ b/src/b.h', '@@ -1 +1 @@',
+    ...     '+#define BAR 1']))
+    >>> sorted(result['src/a.h'])
+    ['Foo', 'x']
+    >>> result['src/b.h'] is None
+    True
+    """
+    identifiers_by_path = {}
+    current_path = None
+    for line in diff_output.split("\n"):
+        if line.startswith('+++ ') or line.startswith('--- '):
+            if line.startswith('+++ b/'):
+                current_path = line[len('+++ b/'):]
+                identifiers_by_path.setdefault(current_path, set())
+            elif line.startswith('--- a/'):
+                current_path = line[len('--- a/'):]
+                identifiers_by_path.setdefault(current_path, set())
+            continue
+        if current_path is None or not line[:1] in ['+', '-']:
+            continue
+        if identifiers_by_path[current_path] is None:
+            continue
+        if line[1:].lstrip().startswith('#'):
+            identifiers_by_path[current_path] = None
+        else:
+            identifiers_by_path[current_path].update(get_identifiers(line[1:]))
+    return identifiers_by_path
+
+
+def parse_changed_lines(diff_output):
+    """
+    Finds the lines around which files changed according to the output of "git diff -U0", as line
+    numbers in the new versions of the files. For removed lines, these are the lines before and
+    after the removed ones.
+
+    >>> parse_changed_lines('\\n'.join([
+    ...     'diff --git a/src/a.h b/src/a.h', '--- a/src/a.h', '+++ b/src/a.h',
+    ...     '@@ -3 +3,2 @@', '-int Foo();', '+int Foo(int x);', '+int Bar();',
+    ...     '@@ -10,2 +10,0 @@', '-int Baz();', '-int Qux();']))
+    {'src/a.h': [3, 4, 10, 11]}
+    """
+    changed_lines_by_path = {}
+    current_path = None
+    for line in diff_output.split("\n"):
+        if line.startswith('+++ b/'):
+            current_path = line[len('+++ b/'):]
+        elif line.startswith('--- a/'):
+            current_path = line[len('--- a/'):]
+        match = HUNK_HEADER_RE.match(line)
+        if current_path is None or not match:
+            continue
+        start_line = int(match.group(1))
+        num_lines = int(match.group(2)) if match.group(2) is not None else 1
+        changed_lines = changed_lines_by_path.setdefault(current_path, [])
+        if num_lines:
+            changed_lines.extend(range(start_line, start_line + num_lines))
+        else:
+            changed_lines.extend([start_line, start_line + 1])
+    return changed_lines_by_path
+
+
+def get_changed_identifiers_by_path(yb_src_root, git_diff, rel_paths):
+    """
+    @return a dictionary mapping real paths of the given files to identifiers changed in them
+            according to "git diff", or to None if any change to them should be considered
+            significant. A file also maps to None if one of the changed identifiers is used
+            elsewhere in it, e.g. by an inline function, because then including that file is enough
+            to be affected by the change, if it changed within a class, struct, union, or enum
+            body, as that may change the layout of the type, or if it has been deleted.
+    """
+    diff_output = subprocess.check_output(
+            ['git', 'diff', '-U0', git_diff, '--'] + list(rel_paths), cwd=yb_src_root)
+    changed_lines_by_path = parse_changed_lines(diff_output)
+    result = {}
+    for rel_path, identifiers in parse_changed_identifiers(diff_output).items():
+        path = os.path.realpath(os.path.join(yb_src_root, rel_path))
+        if not os.path.isfile(path):
+            identifiers = None
+        if identifiers:
+            with open(path) as input_file:
+                contents = input_file.read()
+            type_body_lines = get_type_body_lines(contents)
+            if any(line_number in type_body_lines
+                   for line_number in changed_lines_by_path.get(rel_path, [])):
+                identifiers = None
+        if identifiers:
+            num_lines_by_identifier = defaultdict(int)
+            for line in contents.split("\n"):
+                for identifier in get_identifiers(line) & identifiers:
+                    num_lines_by_identifier[identifier] += 1
+            # An identifier from an added line appears at least on that line, so appearing on more
+            # lines means it is used elsewhere in the file.
+            if any(num_lines > 1 for num_lines in num_lines_by_identifier.values()):
+                identifiers = None
+        result[path] = identifiers
+    return result
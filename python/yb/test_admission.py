@@ -0,0 +1,199 @@
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Admission control for tests running in parallel on one host, e.g. in multiple Spark executor
+processes. Before a test starts, it reserves the CPU, memory and ports it is expected to need, and
+it waits while tests already running on the same host leave too little of these. Reservations are
+kept in a file shared by all test processes of the same user on the host, protected by an fcntl
+lock.
+"""
+
+import collections
+import contextlib
+import errno
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+
+# Resources a test is expected to need while running, or that a host has for all tests together.
+ResourceProfile = collections.namedtuple(
+        'ResourceProfile',
+        ['cpu_cores',
+         'memory_bytes',
+         'num_ports'])
+
+DEFAULT_MAX_MEMORY_FRACTION = 0.8
+
+# Tests that start mini-clusters pick random ports for every master and tablet server, and tend to
+# run into "address already in use" errors when too many of them run on the same host.
+DEFAULT_MAX_PORTS_PER_HOST = 120
+
+ADMISSION_POLL_INTERVAL_SEC = 0.5
+ADMISSION_LOGGING_INTERVAL_SEC = 60
+
+
+def get_total_memory_bytes():
+    """
+    @return the amount of physical memory on this machine, or None if we can't find it out
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError):
+        return None
+
+
+def get_host_capacity(max_memory_fraction=DEFAULT_MAX_MEMORY_FRACTION,
+                      max_ports=DEFAULT_MAX_PORTS_PER_HOST):
+    """
+    @return the ResourceProfile of what all tests running on this host together may use
+    """
+    total_memory_bytes = get_total_memory_bytes()
+    return ResourceProfile(
+            cpu_cores=multiprocessing.cpu_count(),
+            memory_bytes=int(total_memory_bytes * max_memory_fraction) if total_memory_bytes
+            else float('inf'),
+            num_ports=max_ports)
+
+
+def get_max_profile(profiles):
+    """
+    @return a profile of what running the tests with the given profiles one after another needs
+
+    >>> get_max_profile([ResourceProfile(1.0, 100, 0), ResourceProfile(0.5, 200, 30)])
+    ResourceProfile(cpu_cores=1.0, memory_bytes=200, num_ports=30)
+    """
+    return ResourceProfile(*[max(values) for values in zip(*profiles)])
+
+
+@contextlib.contextmanager
+def no_admission_control():
+    yield
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as ex:
+        return ex.errno == errno.EPERM
+    return True
+
+
+class HostAdmissionController:
+    """
+    Decides whether a test may start on this host, based on the resources reserved by tests that
+    are already running. A test is always admitted when nothing else is running, so that tests
+    that need more than the whole host can still run.
+
+    >>> state_path = tempfile.mktemp()
+    >>> controller = HostAdmissionController(ResourceProfile(4, 1000, 60), state_path)
+    >>> controller.try_reserve('a', ResourceProfile(3, 500, 30))
+    True
+    >>> controller.try_reserve('b', ResourceProfile(2, 100, 0))
+    False
+    >>> controller.try_reserve('b', ResourceProfile(1, 500, 30))
+    True
+    >>> controller.release('a')
+    >>> controller.try_reserve('c', ResourceProfile(8, 5000, 0))
+    False
+    >>> controller.release('b')
+    >>> controller.try_reserve('c', ResourceProfile(8, 5000, 0))
+    True
+    >>> os.remove(state_path)
+    """
+    def __init__(self, capacity, state_path=None):
+        self.capacity = capacity
+        self.state_path = state_path or os.path.join(
+            tempfile.gettempdir(), 'yb_test_admission_%d.json' % os.getuid())
+
+    def update_reservations(self, update_func):
+        """
+        Calls the given function with the dictionary of current reservations of live processes,
+        while holding the lock on the state file, and saves the reservations the function leaves.
+
+        @return the return value of the function
+        """
+        fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o666)
+        with os.fdopen(fd, 'r+') as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            try:
+                contents = state_file.read()
+                reservations = {}
+                if contents:
+                    try:
+                        reservations = json.loads(contents)
+                    except ValueError as ex:
+                        logging.warning("Ignoring invalid test admission state in '{}': {}".format(
+                            self.state_path, ex))
+                # Forget reservations of tests whose processes died without releasing them.
+                reservations = dict(
+                    (key, reservation) for key, reservation in reservations.items()
+                    if is_process_alive(reservation['pid']))
+                result = update_func(reservations)
+                state_file.seek(0)
+                state_file.truncate()
+                json.dump(reservations, state_file)
+                state_file.flush()
+            finally:
+                fcntl.flock(state_file, fcntl.LOCK_UN)
+        return result
+
+    def try_reserve(self, key, profile):
+        """
+        Reserves resources of the given profile under the given key if they are available.
+
+        @return whether the resources have been reserved
+        """
+        def reserve(reservations):
+            used = [sum(reservation['profile'][i] for reservation in reservations.values())
+                    for i in range(len(profile))]
+            if reservations and any(used_amount + amount > capacity_amount
+                                    for used_amount, amount, capacity_amount
+                                    in zip(used, profile, self.capacity)):
+                return False
+            reservations[key] = dict(pid=os.getpid(), profile=list(profile))
+            return True
+        return self.update_reservations(reserve)
+
+    def release(self, key):
+        def remove_reservation(reservations):
+            reservations.pop(key, None)
+        self.update_reservations(remove_reservation)
+
+    @contextlib.contextmanager
+    def admit(self, profile, description):
+        """
+        Waits until resources of the given profile are available, and keeps them reserved while
+        the body of the "with" statement runs.
+        """
+        key = '%d_%f' % (os.getpid(), time.time())
+        start_time_sec = time.time()
+        last_log_time_sec = start_time_sec
+        while not self.try_reserve(key, profile):
+            time.sleep(ADMISSION_POLL_INTERVAL_SEC)
+            if time.time() - last_log_time_sec > ADMISSION_LOGGING_INTERVAL_SEC:
+                logging.info("Waiting for resources to run %s (%s) for %.1f sec" % (
+                    description, profile, time.time() - start_time_sec))
+                last_log_time_sec = time.time()
+        if time.time() - start_time_sec > ADMISSION_POLL_INTERVAL_SEC:
+            logging.info("Waited for %.1f sec for resources to run %s" % (
+                time.time() - start_time_sec, description))
+        try:
+            yield
+        finally:
+            self.release(key)
@@ -0,0 +1,154 @@
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+A cache of the list of C++ test programs known to CTest and of the gtest tests in every test
+program, saved in the build root across test runs, so that only test programs that have been
+rebuilt since then have to be listed again.
+"""
+
+import json
+import logging
+import os
+import re
+
+from yb.test_result_cache import write_json_atomically
+
+
+TEST_LISTING_CACHE_FILE_NAME = 'test_listing_cache.json'
+
+CTEST_FILE_NAME = 'CTestTestfile.cmake'
+
+# CTest files generated by CMake refer to the CTest files of subdirectories this way.
+CTEST_SUBDIRS_RE = re.compile(r'^\s*subdirs\s*\(\s*"?([^")]+?)"?\s*\)',
+                              re.MULTILINE | re.IGNORECASE)
+
+
+def get_file_signature(path):
+    """
+    @return a [size, modification time] list identifying the current version of the given file, or
+            None if the file does not exist
+    """
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return [stat_result.st_size, stat_result.st_mtime]
+
+
+def find_ctest_files(build_root):
+    """
+    @return paths of the CTest files that ctest reads when run in the given build root: the
+            top-level one and the ones of subdirectories it refers to, recursively
+    """
+    ctest_file_paths = []
+    dirs_to_visit = [build_root]
+    while dirs_to_visit:
+        ctest_file_path = os.path.join(dirs_to_visit.pop(), CTEST_FILE_NAME)
+        if not os.path.isfile(ctest_file_path):
+            continue
+        ctest_file_paths.append(ctest_file_path)
+        with open(ctest_file_path) as ctest_file:
+            for subdir in CTEST_SUBDIRS_RE.findall(ctest_file.read()):
+                dirs_to_visit.append(os.path.join(os.path.dirname(ctest_file_path), subdir))
+    return sorted(ctest_file_paths)
+
+
+class TestListingCache:
+    """
+    Lists of tests keyed by test program path relative to the build root, and by the size and
+    modification time of the test program. The list of test programs is keyed by sizes and
+    modification times of all CTest files.
+
+    >>> import shutil, tempfile
+    >>> build_root = tempfile.mkdtemp()
+    >>> os.mkdir(os.path.join(build_root, 'tests-util'))
+    >>> with open(os.path.join(build_root, CTEST_FILE_NAME), 'w') as ctest_file:
+    ...     ctest_file.write('subdirs("tests-util")\\n')
+    >>> with open(os.path.join(build_root, 'tests-util', 'bitmap-test'), 'w') as test_program:
+    ...     test_program.write('binary')
+    >>> cache = TestListingCache(build_root)
+    >>> cache.get_test_programs() is None
+    True
+    >>> cache.set_test_programs(['tests-util/bitmap-test'])
+    >>> cache.set_tests('tests-util/bitmap-test', ['tests-util/bitmap-test:::BitmapTest.A'])
+    >>> cache.save()
+    >>> cache = TestListingCache(build_root)
+    >>> cache.get_test_programs()
+    [u'tests-util/bitmap-test']
+    >>> cache.get_tests('tests-util/bitmap-test')
+    [u'tests-util/bitmap-test:::BitmapTest.A']
+    >>> with open(os.path.join(build_root, 'tests-util', 'bitmap-test'), 'w') as test_program:
+    ...     test_program.write('rebuilt binary')
+    >>> cache.get_tests('tests-util/bitmap-test') is None
+    True
+    >>> with open(os.path.join(build_root, 'tests-util', CTEST_FILE_NAME), 'w') as ctest_file:
+    ...     ctest_file.write('add_test(bitmap-test)\\n')
+    >>> cache.get_test_programs() is None
+    True
+    >>> shutil.rmtree(build_root)
+    """
+    def __init__(self, build_root, cache_path=None):
+        self.build_root = build_root
+        self.cache_path = cache_path or os.path.join(build_root, TEST_LISTING_CACHE_FILE_NAME)
+        self.clear()
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path) as cache_file:
+                    self.entries = json.load(cache_file)
+            except ValueError as ex:
+                logging.warning("Ignoring invalid test listing cache '{}': {}".format(
+                    self.cache_path, ex))
+
+    def clear(self):
+        self.entries = dict(ctest=None, test_programs={})
+
+    def get_ctest_file_signatures(self):
+        return dict((os.path.relpath(ctest_file_path, self.build_root),
+                     get_file_signature(ctest_file_path))
+                    for ctest_file_path in find_ctest_files(self.build_root))
+
+    def get_test_programs(self):
+        """
+        @return the cached list of test programs known to CTest, or None if it is not available or
+                any of the CTest files changed
+        """
+        ctest_entry = self.entries['ctest']
+        if ctest_entry and ctest_entry['ctest_files'] == self.get_ctest_file_signatures():
+            return ctest_entry['test_programs']
+        return None
+
+    def set_test_programs(self, test_programs):
+        self.entries['ctest'] = dict(ctest_files=self.get_ctest_file_signatures(),
+                                     test_programs=test_programs)
+
+    def get_tests(self, rel_test_program):
+        """
+        @return the cached list of test descriptors of the given test program, or None if it is
+                not available or the test program changed
+        """
+        entry = self.entries['test_programs'].get(rel_test_program)
+        signature = get_file_signature(os.path.join(self.build_root, rel_test_program))
+        if entry and signature and entry['signature'] == signature:
+            return entry['tests']
+        return None
+
+    def set_tests(self, rel_test_program, test_descriptor_strs):
+        self.entries['test_programs'][rel_test_program] = dict(
+            signature=get_file_signature(os.path.join(self.build_root, rel_test_program)),
+            tests=test_descriptor_strs)
+
+    def save(self):
+        write_json_atomically(self.entries, self.cache_path)
+        logging.info("Saved lists of tests of {} test programs to '{}'".format(
+            len(self.entries['test_programs']), self.cache_path))
@@ -0,0 +1,345 @@
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+An append-only SQLite database of historical test reports saved by run_tests_on_spark.py, with one
+row per test run. New reports are ingested from the report directory the database is kept in
+whenever it is opened, so that reports only have to be parsed once, and questions like "what is
+the 95th percentile of the running time of this test over its last 30 runs" or "which tests are
+the flakiest" can be answered quickly.
+
+Usage:
+    python/yb/test_report_store.py --reports-dir <dir> percentiles --test <test descriptor>
+    python/yb/test_report_store.py --reports-dir <dir> flakiest
+    python/yb/test_report_store.py --reports-dir <dir> slowest
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from yb import test_reports
+from yb.test_reports import TestHistory, get_descriptor_without_attempt_index, get_test_program, \
+                            get_percentile
+
+
+REPORT_STORE_FILE_NAME = 'test_report_store.sqlite'
+
+# Seconds to wait for other processes, e.g. test runs ingesting the same reports, to unlock the
+# database.
+REPORT_STORE_LOCK_TIMEOUT_SEC = 120
+
+# Reports that cannot be parsed are only recorded as such once they are this old, as they might
+# still be being written.
+UNPARSEABLE_REPORT_GRACE_PERIOD_SEC = 3600
+
+DEFAULT_MAX_TEST_RUNS = 30
+DEFAULT_NUM_RESULTS = 20
+
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS reports (
+        report_id INTEGER PRIMARY KEY,
+        report_path TEXT NOT NULL UNIQUE,
+        report_time REAL NOT NULL,
+        build_type TEXT,
+        jenkins_job TEXT,
+        build_id TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS test_runs (
+        report_id INTEGER NOT NULL,
+        descriptor TEXT NOT NULL,
+        test TEXT NOT NULL,
+        test_program TEXT NOT NULL,
+        language TEXT,
+        elapsed_time_sec REAL,
+        exit_code INTEGER,
+        cpu_time_sec REAL,
+        max_rss_bytes INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS test_runs_by_test ON test_runs (test, report_id)",
+    "CREATE INDEX IF NOT EXISTS test_runs_by_report ON test_runs (report_id)",
+    "CREATE INDEX IF NOT EXISTS reports_by_time ON reports (report_time)",
+]
+
+
+class TestReportStore:
+    """
+    >>> import shutil, tempfile
+    >>> report_dir = tempfile.mkdtemp()
+    >>> import json
+    >>> for i, exit_code in enumerate([0, 1, 0]):
+    ...     with open(os.path.join(report_dir, 'report_%d.json' % i), 'w') as report_file:
+    ...         json.dump({'conf': {'build_type': 'debug'}, 'tests': {
+    ...             'tests-util/bitmap-test:::BitmapTest.A':
+    ...                 {'elapsed_time_sec': 1.0 + i, 'exit_code': exit_code},
+    ...             'tests-util/bitmap-test:::BitmapTest.B':
+    ...                 {'elapsed_time_sec': 10.0, 'exit_code': 0}}}, report_file)
+    ...     os.utime(report_file.name, (1000 + i, 1000 + i))
+    >>> with open(os.path.join(report_dir, 'report_partial.json'), 'w') as report_file:
+    ...     report_file.write('{"tests": ')
+    >>> store = TestReportStore(report_dir)
+    >>> store.ingest_report_dir()
+    3
+    >>> store.ingest_report_dir()
+    0
+    >>> os.utime(report_file.name, (500, 500))
+    >>> store.ingest_report_dir()
+    1
+    >>> store.get_elapsed_time_percentiles('tests-util/bitmap-test:::BitmapTest.A', [50, 95])
+    [2.0, 3.0]
+    >>> store.get_flakiest_tests()
+    [(u'tests-util/bitmap-test:::BitmapTest.A', 3, 1)]
+    >>> store.get_slowest_test_programs()
+    [(u'tests-util/bitmap-test', 12.0, 3)]
+    >>> history = store.load_test_history(max_reports=2)
+    >>> history.get_test_stats('tests-util/bitmap-test:::BitmapTest.A').num_runs
+    2
+    >>> store.close()
+    >>> shutil.rmtree(report_dir)
+    """
+    def __init__(self, report_dir, db_path=None):
+        self.report_dir = report_dir
+        self.db_path = db_path or os.path.join(report_dir, REPORT_STORE_FILE_NAME)
+        self.connection = sqlite3.connect(self.db_path, timeout=REPORT_STORE_LOCK_TIMEOUT_SEC)
+        with self.connection:
+            for statement in SCHEMA_STATEMENTS:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    def add_report(self, report, report_path, report_time):
+        """
+        Adds the test runs from a report loaded from the given path, in a single transaction.
+
+        @return False if the report is already in the database, e.g. because another test run
+                ingested it at the same time
+        """
+        conf = report.get('conf') or {}
+        jenkins_env_vars = report.get('jenkins_env_vars') or {}
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO reports "
+                "(report_path, report_time, build_type, jenkins_job, build_id) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (report_path, report_time, conf.get('build_type'),
+                 jenkins_env_vars.get('JOB_NAME'), jenkins_env_vars.get('BUILD_ID')))
+            if not cursor.rowcount:
+                return False
+            report_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO test_runs (report_id, descriptor, test, test_program, language, "
+                "elapsed_time_sec, exit_code, cpu_time_sec, max_rss_bytes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(report_id, descriptor_str, get_descriptor_without_attempt_index(descriptor_str),
+                  get_test_program(descriptor_str), test_report.get('language'),
+                  test_report.get('elapsed_time_sec'), test_report.get('exit_code'),
+                  test_report.get('cpu_time_sec'), test_report.get('max_rss_bytes'))
+                 for descriptor_str, test_report in report.get('tests', {}).items()])
+        return True
+
+    def ingest_report_dir(self):
+        """
+        Adds reports in the report directory and its subdirectories that are not in the database
+        yet. Short reports without per-test results, and reports that cannot be parsed once they are
+        older than UNPARSEABLE_REPORT_GRACE_PERIOD_SEC, are recorded without any test runs, so that
+        we don't try to parse them again. Younger reports that cannot be parsed are skipped.
+
+        @return the number of reports added
+        """
+        start_time_sec = time.time()
+        known_report_paths = set(
+            row[0] for row in self.connection.execute("SELECT report_path FROM reports"))
+        num_added = 0
+        for report_path in test_reports.find_report_paths(self.report_dir, max_reports=None):
+            rel_report_path = os.path.relpath(report_path, self.report_dir)
+            if rel_report_path in known_report_paths:
+                continue
+            report_time = os.path.getmtime(report_path)
+            try:
+                report = test_reports.load_report(report_path)
+            except (IOError, ValueError) as ex:
+                logging.warning("Could not load test report from '{}': {}".format(
+                    report_path, ex))
+                if time.time() - report_time < UNPARSEABLE_REPORT_GRACE_PERIOD_SEC:
+                    continue
+                report = {}
+            if not isinstance(report, dict):
+                report = {}
+            if self.add_report(report, rel_report_path, report_time):
+                num_added += 1
+        if num_added:
+            logging.info("Added %d test reports from '%s' to '%s' in %.2f sec" % (
+                num_added, self.report_dir, self.db_path, time.time() - start_time_sec))
+        return num_added
+
+    def get_recent_report_ids_query(self, max_reports):
+        return "SELECT report_id FROM reports ORDER BY report_time DESC LIMIT %d" % (
+            max_reports if max_reports else -1)
+
+    def load_test_history(self, max_reports=test_reports.DEFAULT_MAX_REPORTS):
+        """
+        @return a TestHistory of the given number of most recent reports
+        """
+        start_time_sec = time.time()
+        tests_by_report_id = {}
+        for row in self.connection.execute(
+                "SELECT report_id, descriptor, elapsed_time_sec, exit_code, cpu_time_sec, "
+                "max_rss_bytes FROM test_runs WHERE report_id IN (%s)" %
+                self.get_recent_report_ids_query(max_reports)):
+            report_id, descriptor_str, elapsed_time_sec, exit_code, cpu_time_sec, \
+                max_rss_bytes = row
+            tests_by_report_id.setdefault(report_id, {})[descriptor_str] = dict(
+                elapsed_time_sec=elapsed_time_sec, exit_code=exit_code,
+                cpu_time_sec=cpu_time_sec, max_rss_bytes=max_rss_bytes)
+        history = TestHistory()
+        for report_id in sorted(tests_by_report_id.keys()):
+            history.add_report({'tests': tests_by_report_id[report_id]})
+        logging.info("Loaded statistics of %d test programs from %d test reports in '%s' in "
+                     "%.2f sec" % (len(history.stats_by_program), history.num_reports,
+                                   self.db_path, time.time() - start_time_sec))
+        return history
+
+    def get_elapsed_time_percentiles(self, descriptor_str, percentiles,
+                                     max_test_runs=DEFAULT_MAX_TEST_RUNS):
+        """
+        @return the given percentiles of the elapsed time of the given test (any attempt) over
+                its most recent runs, or Nones if the test has never run
+        """
+        elapsed_times = sorted(row[0] for row in self.connection.execute(
+            "SELECT elapsed_time_sec FROM test_runs JOIN reports USING (report_id) "
+            "WHERE test = ? AND elapsed_time_sec IS NOT NULL "
+            "ORDER BY report_time DESC LIMIT ?",
+            (get_descriptor_without_attempt_index(descriptor_str), max_test_runs)))
+        return [get_percentile(elapsed_times, percentile) for percentile in percentiles]
+
+    def get_flakiest_tests(self, max_reports=test_reports.DEFAULT_MAX_REPORTS,
+                           num_results=DEFAULT_NUM_RESULTS):
+        """
+        @return (test, number of runs, number of failures) tuples of tests that both passed and
+                failed in the given number of most recent reports, with the highest failure rates
+        """
+        return self.connection.execute(
+            "SELECT test, COUNT(*) AS num_runs, SUM(exit_code != 0) AS num_failures "
+            "FROM test_runs WHERE report_id IN (%s) GROUP BY test "
+            "HAVING num_failures > 0 AND num_failures < num_runs "
+            "ORDER BY CAST(num_failures AS REAL) / num_runs DESC, num_runs DESC LIMIT ?" %
+            self.get_recent_report_ids_query(max_reports), (num_results,)).fetchall()
+
+    def get_slowest_test_programs(self, max_reports=test_reports.DEFAULT_MAX_REPORTS,
+                                  num_results=DEFAULT_NUM_RESULTS):
+        """
+        @return (test program, average total elapsed time of its tests per report, number of
+                reports) tuples of the test programs taking the longest in the given number of most
+                recent reports
+        """
+        return self.connection.execute(
+            "SELECT test_program, SUM(elapsed_time_sec) / COUNT(DISTINCT report_id) AS avg_time, "
+            "COUNT(DISTINCT report_id) FROM test_runs WHERE report_id IN (%s) "
+            "GROUP BY test_program ORDER BY avg_time DESC LIMIT ?" %
+            self.get_recent_report_ids_query(max_reports), (num_results,)).fetchall()
+
+
+def load_test_history(report_dir, max_reports=test_reports.DEFAULT_MAX_REPORTS):
+    """
+    Like test_reports.load_test_history, but ingests new reports into the report store in the given
+    directory and loads the history from there. Falls back to parsing the reports directly if the
+    report store cannot be used, e.g. because the directory is not writable.
+
+    @return a TestHistory
+    """
+    try:
+        store = TestReportStore(report_dir)
+        try:
+            store.ingest_report_dir()
+            return store.load_test_history(max_reports)
+        finally:
+            store.close()
+    except sqlite3.Error as ex:
+        logging.warning("Could not use the test report store in '{}', loading test reports "
+                        "directly: {}".format(report_dir, ex))
+    return test_reports.load_test_history(report_dir, max_reports)
+
+
+PERCENTILES_CMD = 'percentiles'
+FLAKIEST_CMD = 'flakiest'
+SLOWEST_CMD = 'slowest'
+INGEST_CMD = 'ingest'
+COMMANDS = [PERCENTILES_CMD, FLAKIEST_CMD, SLOWEST_CMD, INGEST_CMD]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Queries historical test reports saved by run_tests_on_spark.py')
+    parser.add_argument('command', choices=COMMANDS, help='Command to perform')
+    parser.add_argument('--reports-dir', required=True,
+                        help='A directory with test reports, e.g. the --reports-dir of '
+                             'run_tests_on_spark.py or a per-build-type subdirectory of it. The '
+                             'report store is kept in this directory.')
+    parser.add_argument('--test',
+                        help='Test descriptor for the {} command, e.g. '
+                             'tests-util/bitmap-test:::BitmapTest.TestBitmap'.format(
+                                 PERCENTILES_CMD))
+    parser.add_argument('--max-test-runs', type=int, default=DEFAULT_MAX_TEST_RUNS,
+                        help='Number of most recent runs of the test to compute percentiles of '
+                             'its elapsed time over.')
+    parser.add_argument('--max-reports', type=int, default=test_reports.DEFAULT_MAX_REPORTS,
+                        help='Number of most recent reports to look at for the {} and {} '
+                             'commands.'.format(FLAKIEST_CMD, SLOWEST_CMD))
+    parser.add_argument('--num-results', type=int, default=DEFAULT_NUM_RESULTS,
+                        help='Maximum number of tests or test programs to show.')
+    parser.add_argument('--no-ingest', action='store_true',
+                        help='Do not add new reports to the report store before the query.')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(filename)s:%(lineno)d] %(asctime)s %(levelname)s: %(message)s")
+
+    if args.command == PERCENTILES_CMD and not args.test:
+        parser.error('--test is required for the {} command'.format(PERCENTILES_CMD))
+
+    store = TestReportStore(args.reports_dir)
+    if not args.no_ingest or args.command == INGEST_CMD:
+        store.ingest_report_dir()
+
+    if args.command == PERCENTILES_CMD:
+        percentiles = [50, 95, 100]
+        for percentile, elapsed_time_sec in zip(
+                percentiles,
+                store.get_elapsed_time_percentiles(args.test, percentiles, args.max_test_runs)):
+            if elapsed_time_sec is None:
+                sys.stderr.write("No runs of {} found\n".format(args.test))
+                sys.exit(1)
+            print("p%d: %.3f sec" % (percentile, elapsed_time_sec))
+    elif args.command == FLAKIEST_CMD:
+        for test, num_runs, num_failures in store.get_flakiest_tests(
+                args.max_reports, args.num_results):
+            print("%s: %d failures in %d runs" % (test, num_failures, num_runs))
+    elif args.command == SLOWEST_CMD:
+        for test_program, avg_time_sec, num_reports in store.get_slowest_test_programs(
+                args.max_reports, args.num_results):
+            print("%s: %.2f sec on average in %d reports" % (
+                test_program, avg_time_sec, num_reports))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Reading historical test reports saved by run_tests_on_spark.py, to find out how long test programs
+and individual tests take to run and how often they fail.
+"""
+
+import gzip
+import json
+import logging
+import math
+import os
+import struct
+import time
+import zlib
+
+from collections import defaultdict
+
+from yb.yb_dist_tests import TEST_DESCRIPTOR_SEPARATOR, TEST_DESCRIPTOR_ATTEMPT_INDEX_RE
+
+
+# The number of most recent reports to take into account by default.
+DEFAULT_MAX_REPORTS = 20
+
+REPORT_FILE_SUFFIXES = ['.json', '.json.gz']
+
+
+def get_percentile(sorted_values, percentile):
+    """
+    @return the given percentile of a sorted list of values, using the nearest-rank method
+
+    >>> get_percentile([1.0, 2.0, 3.0, 4.0], 50)
+    2.0
+    >>> get_percentile([1.0, 2.0, 3.0, 4.0], 95)
+    4.0
+    >>> get_percentile([], 50) is None
+    True
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(percentile / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def get_descriptor_without_attempt_index(descriptor_str):
+    """
+    >>> get_descriptor_without_attempt_index('tests-rocksdb/merge_test:::attempt_2')
+    'tests-rocksdb/merge_test'
+    >>> get_descriptor_without_attempt_index('tests-util/bitmap-test:::BitmapTest.TestBitmap')
+    'tests-util/bitmap-test:::BitmapTest.TestBitmap'
+    """
+    attempt_index_match = TEST_DESCRIPTOR_ATTEMPT_INDEX_RE.match(descriptor_str)
+    if attempt_index_match:
+        return attempt_index_match.group(1)
+    return descriptor_str
+
+
+def get_test_program(descriptor_str):
+    """
+    @return the test program part of a test descriptor: a C++ test program path relative to the
+            build root, or a Java test source path.
+
+    >>> get_test_program('tests-util/bitmap-test:::BitmapTest.TestBitmap')
+    'tests-util/bitmap-test'
+    >>> get_test_program('tests-rocksdb/merge_test:::attempt_2')
+    'tests-rocksdb/merge_test'
+    >>> get_test_program('yb-client/src/test/java/org/yb/client/TestYBClient.java')
+    'yb-client/src/test/java/org/yb/client/TestYBClient.java'
+    """
+    return get_descriptor_without_attempt_index(descriptor_str).split(TEST_DESCRIPTOR_SEPARATOR)[0]
+
+
+class TestProgramStats:
+    """
+    Statistics of one test program, or of one test, across historical test reports. The elapsed
+    time of a test program in one report is the total elapsed time of all its tests in that report,
+    and the test program is considered failed if any of its tests failed.
+
+    CPU time and memory usage are only known for tests, and only from reports that have them.
+    """
+    def __init__(self):
+        self.num_runs = 0
+        self.num_failures = 0
+        self.total_elapsed_time_sec = 0.0
+        self.elapsed_times_sec = []
+        self.total_cpu_time_sec = 0.0
+        # Total elapsed time of the runs we know the CPU time of.
+        self.cpu_measured_elapsed_time_sec = 0.0
+        self.max_rss_bytes = None
+
+    def add_run(self, elapsed_time_sec, failed, cpu_time_sec=None, max_rss_bytes=None):
+        self.num_runs += 1
+        self.total_elapsed_time_sec += elapsed_time_sec
+        self.elapsed_times_sec.append(elapsed_time_sec)
+        if failed:
+            self.num_failures += 1
+        if cpu_time_sec is not None:
+            self.total_cpu_time_sec += cpu_time_sec
+            self.cpu_measured_elapsed_time_sec += elapsed_time_sec
+        if max_rss_bytes:
+            self.max_rss_bytes = max(self.max_rss_bytes, max_rss_bytes)
+
+    def get_failure_rate(self):
+        return float(self.num_failures) / self.num_runs
+
+    def get_avg_elapsed_time_sec(self):
+        return self.total_elapsed_time_sec / self.num_runs
+
+    def get_elapsed_time_percentile(self, percentile):
+        return get_percentile(sorted(self.elapsed_times_sec), percentile)
+
+    def get_avg_cpu_cores(self):
+        """
+        @return the average number of CPU cores busy while running, or None if unknown
+        """
+        if self.cpu_measured_elapsed_time_sec <= 0:
+            return None
+        return self.total_cpu_time_sec / self.cpu_measured_elapsed_time_sec
+
+    def __str__(self):
+        return "TestProgramStats(%d runs, %d failures, %.2f sec on average)" % (
+                self.num_runs, self.num_failures, self.get_avg_elapsed_time_sec())
+
+
+class TestHistory:
+    """
+    Statistics of test programs aggregated over a number of historical test reports.
+
+    >>> history = TestHistory()
+    >>> history.add_report({'tests': {
+    ...     'tests-util/bitmap-test:::BitmapTest.A': {'elapsed_time_sec': 1.5, 'exit_code': 0},
+    ...     'tests-util/bitmap-test:::BitmapTest.B': {'elapsed_time_sec': 2.5, 'exit_code': 1}}})
+    >>> history.add_report({'tests': {
+    ...     'tests-util/bitmap-test:::BitmapTest.A': {'elapsed_time_sec': 2.0, 'exit_code': 0,
+    ...                                               'cpu_time_sec': 3.0, 'max_rss_bytes': 1000}}})
+    >>> stats = history.get_stats_by_basename()['bitmap-test']
+    >>> (stats.num_runs, stats.get_failure_rate(), stats.get_avg_elapsed_time_sec())
+    (2, 0.5, 3.0)
+    >>> stats = history.get_test_stats('tests-util/bitmap-test:::BitmapTest.A')
+    >>> (stats.get_avg_elapsed_time_sec(), stats.get_avg_cpu_cores(), stats.max_rss_bytes)
+    (1.75, 1.5, 1000)
+    >>> stats.get_elapsed_time_percentile(95)
+    2.0
+    """
+    def __init__(self):
+        # Test program (as returned by get_test_program) -> TestProgramStats.
+        self.stats_by_program = {}
+        # Test descriptor without the attempt index -> TestProgramStats of that test.
+        self.stats_by_test = {}
+        self.num_reports = 0
+        self.stats_by_basename = None
+
+    def add_report(self, report):
+        elapsed_time_by_program = defaultdict(float)
+        failed_programs = set()
+        for descriptor_str, test_report in report.get('tests', {}).items():
+            program = get_test_program(descriptor_str)
+            elapsed_time_sec = test_report.get('elapsed_time_sec') or 0.0
+            elapsed_time_by_program[program] += elapsed_time_sec
+            if test_report.get('exit_code'):
+                failed_programs.add(program)
+
+            test = get_descriptor_without_attempt_index(descriptor_str)
+            if test not in self.stats_by_test:
+                self.stats_by_test[test] = TestProgramStats()
+            self.stats_by_test[test].add_run(
+                elapsed_time_sec, bool(test_report.get('exit_code')),
+                test_report.get('cpu_time_sec'), test_report.get('max_rss_bytes'))
+
+        for program, elapsed_time_sec in elapsed_time_by_program.items():
+            if program not in self.stats_by_program:
+                self.stats_by_program[program] = TestProgramStats()
+            self.stats_by_program[program].add_run(elapsed_time_sec, program in failed_programs)
+        self.num_reports += 1
+        self.stats_by_basename = None
+
+    def get_program_stats(self, program):
+        return self.stats_by_program.get(program)
+
+    def get_test_stats(self, descriptor_str):
+        return self.stats_by_test.get(get_descriptor_without_attempt_index(descriptor_str))
+
+    def get_stats_by_basename(self):
+        """
+        @return a dictionary mapping test program basenames (as used in the test configuration
+                produced by dependency_graph.py) to their statistics. If multiple test programs
+                have the same basename, the one with more runs is used.
+        """
+        if self.stats_by_basename is None:
+            self.stats_by_basename = {}
+            for program, stats in self.stats_by_program.items():
+                basename = os.path.basename(program)
+                existing_stats = self.stats_by_basename.get(basename)
+                if existing_stats is None or existing_stats.num_runs < stats.num_runs:
+                    self.stats_by_basename[basename] = stats
+        return self.stats_by_basename
+
+
+def find_report_paths(report_dir, max_reports=DEFAULT_MAX_REPORTS):
+    """
+    Finds test reports in the given directory and its subdirectories, e.g. the --reports-dir
+    directory of run_tests_on_spark.py or one of its per-build-type subdirectories.
+
+    @return paths of up to max_reports most recently modified reports, most recent first
+    """
+    report_paths = []
+    for dir_path, dir_names, file_names in os.walk(report_dir):
+        for file_name in file_names:
+            if any(file_name.endswith(suffix) for suffix in REPORT_FILE_SUFFIXES):
+                report_paths.append(os.path.join(dir_path, file_name))
+    report_paths.sort(key=lambda report_path: os.path.getmtime(report_path), reverse=True)
+    if max_reports:
+        report_paths = report_paths[:max_reports]
+    return report_paths
+
+
+def load_report(report_path):
+    """
+    Loads a report, possibly gzip-compressed. Raises IOError if the report cannot be read, and
+    ValueError if it cannot be decoded, e.g. if it was truncated because the test run saving it was
+    killed.
+    """
+    open_func = gzip.open if report_path.endswith('.gz') else open
+    with open_func(report_path, 'rb') as report_file:
+        try:
+            report_str = report_file.read()
+        except (EOFError, struct.error, zlib.error) as ex:
+            raise ValueError("Truncated or corrupt compressed report: {}".format(ex))
+    return json.loads(report_str)
+
+
+def load_test_history(report_dir, max_reports=DEFAULT_MAX_REPORTS):
+    """
+    Loads the most recent test reports from the given directory. Reports that cannot be parsed, and
+    short reports without per-test results, are skipped.
+
+    @return a TestHistory
+    """
+    start_time_sec = time.time()
+    history = TestHistory()
+    for report_path in find_report_paths(report_dir, max_reports):
+        try:
+            report = load_report(report_path)
+        except (IOError, ValueError) as ex:
+            logging.warning("Could not load test report from '{}': {}".format(report_path, ex))
+            continue
+        if isinstance(report, dict) and 'tests' in report:
+            history.add_report(report)
+    logging.info("Loaded statistics of %d test programs from %d test reports in '%s' in %.2f sec" %
+                 (len(history.stats_by_program), history.num_reports, report_dir,
+                  time.time() - start_time_sec))
+    return history
@@ -0,0 +1,193 @@
+# Copyright (c) YugaByte, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not use this file except
+# in compliance with the License.  You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under the License
+# is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+# or implied.  See the License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+A local on-disk cache of passing test results, keyed by test descriptor and a digest of all inputs
+of the test program, as computed by dependency_graph.py. A test whose inputs are exactly the same as
+in a previous passing run does not have to be run again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+
+DEFAULT_MAX_CACHE_SIZE_MB = 1024
+
+CACHE_ENTRY_SUFFIX = '.json'
+
+# Read files in chunks of this size when computing their digests, so that large test binaries don't
+# have to be loaded into memory.
+FILE_READ_CHUNK_SIZE = 1024 * 1024
+
+
+def compute_file_digest(path):
+    """
+    @return the SHA-1 hex digest of the contents of the given file
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as input_file:
+        while True:
+            chunk = input_file.read(FILE_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def write_json_atomically(data, output_path):
+    # Multiple test runs might share a cache directory, so never let them see partial files.
+    tmp_path = '%s.tmp.%d' % (output_path, os.getpid())
+    with open(tmp_path, 'w') as output_file:
+        json.dump(data, output_file)
+    os.rename(tmp_path, output_path)
+
+
+class FileDigestCache:
+    """
+    Digests of file contents, saved along with file sizes and modification times, so that files
+    only have to be read again when they change.
+    """
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.entries = {}
+        self.num_computed = 0
+        self.num_reused = 0
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path) as cache_file:
+                    self.entries = json.load(cache_file)
+            except ValueError as ex:
+                logging.warning("Ignoring invalid file digest cache '{}': {}".format(
+                    cache_path, ex))
+
+    def get_digest(self, path):
+        """
+        @return the SHA-1 hex digest of the given file's contents, or None if the file does not
+                exist
+        """
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        entry = self.entries.get(path)
+        if (entry and entry['size'] == stat_result.st_size and
+                entry['mtime'] == stat_result.st_mtime):
+            self.num_reused += 1
+            return entry['sha1']
+        sha1 = compute_file_digest(path)
+        self.entries[path] = dict(size=stat_result.st_size, mtime=stat_result.st_mtime, sha1=sha1)
+        self.num_computed += 1
+        return sha1
+
+    def save(self):
+        write_json_atomically(self.entries, self.cache_path)
+        logging.info("Saved digests of {} files to '{}' ({} computed, {} reused)".format(
+            len(self.entries), self.cache_path, self.num_computed, self.num_reused))
+
+
+class TestResultCache:
+    """
+    Passing test results, one small JSON file per test descriptor and input digest. The total size
+    of the cache is bounded: when it is exceeded, the least recently used entries are removed. Using
+    an entry updates its modification time.
+
+    >>> import shutil, tempfile
+    >>> cache_dir = tempfile.mkdtemp()
+    >>> cache = TestResultCache(cache_dir)
+    >>> cache.get('tests-util/bitmap-test:::BitmapTest.A', 'abc') is None
+    True
+    >>> cache.put('tests-util/bitmap-test:::BitmapTest.A', 'abc', dict(elapsed_time_sec=1.5))
+    >>> cache.get('tests-util/bitmap-test:::BitmapTest.A', 'abc')['elapsed_time_sec']
+    1.5
+    >>> cache.get('tests-util/bitmap-test:::BitmapTest.A', 'abd') is None
+    True
+    >>> shutil.rmtree(cache_dir)
+    """
+    def __init__(self, cache_dir, max_size_bytes=DEFAULT_MAX_CACHE_SIZE_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get_entry_path(self, descriptor_str, digest):
+        key = hashlib.sha1((descriptor_str + '\n' + digest).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + CACHE_ENTRY_SUFFIX)
+
+    def get(self, descriptor_str, digest):
+        """
+        @return the cached result of a passing run of the given test with the given input digest,
+                or None
+        """
+        entry_path = self.get_entry_path(descriptor_str, digest)
+        try:
+            with open(entry_path) as entry_file:
+                entry = json.load(entry_file)
+            os.utime(entry_path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('descriptor') != descriptor_str or entry.get('digest') != digest:
+            return None
+        return entry
+
+    def put(self, descriptor_str, digest, result):
+        """
+        Saves a passing result of the given test.
+        @param result a JSON-friendly dictionary, e.g. with the elapsed time of the test
+        """
+        entry = dict(result, descriptor=descriptor_str, digest=digest, timestamp=time.time())
+        entry_path = self.get_entry_path(descriptor_str, digest)
+        if not os.path.isdir(os.path.dirname(entry_path)):
+            try:
+                os.makedirs(os.path.dirname(entry_path))
+            except OSError:
+                if not os.path.isdir(os.path.dirname(entry_path)):
+                    raise
+        write_json_atomically(entry, entry_path)
+
+    def evict(self):
+        """
+        Removes least recently used entries until the total size of the cache fits the limit.
+        @return the number of entries removed
+        """
+        entries = []
+        total_size = 0
+        for dir_path, dir_names, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if not file_name.endswith(CACHE_ENTRY_SUFFIX):
+                    continue
+                entry_path = os.path.join(dir_path, file_name)
+                try:
+                    stat_result = os.stat(entry_path)
+                except OSError:
+                    continue
+                entries.append((stat_result.st_mtime, stat_result.st_size, entry_path))
+                total_size += stat_result.st_size
+
+        num_removed = 0
+        entries.sort()
+        for mtime, size, entry_path in entries:
+            if total_size <= self.max_size_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            total_size -= size
+            num_removed += 1
+        if num_removed:
+            logging.info("Removed {} least recently used entries from the test result cache at "
+                         "'{}'".format(num_removed, self.cache_dir))
+        return num_removed
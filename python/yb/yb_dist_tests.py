@@ -34,6 +34,10 @@ TEST_DESCRIPTOR_ATTEMPT_PREFIX = TEST_DESCRIPTOR_SEPARATOR + 'attempt_'
 TEST_DESCRIPTOR_ATTEMPT_INDEX_RE = re.compile(
     r'^(.*)' + TEST_DESCRIPTOR_ATTEMPT_PREFIX + r'(\d+)$')
 
+# Lines of Google Test output marking the start and the end of a test, e.g.
+# "[ RUN      ] BitmapTest.TestBitmap" or "[       OK ] BitmapTest.TestBitmap (12 ms)".
+GTEST_TEST_STATUS_LINE_RE = re.compile(r'^\[ +(RUN|OK|FAILED) +\] (\S+)(?: \((\d+) ms\))?')
+
 global_conf = None
 
 CLOCK_SYNC_WAIT_LOGGING_INTERVAL_SEC = 10
@@ -60,6 +64,8 @@ class TestDescriptor:
             self.descriptor_str_without_attempt_index = descriptor_str
 
         self.is_jvm_based = False
+        self.rel_test_binary = None
+        self.test_name = None
         if self.descriptor_str.endswith('.java'):
             self.is_jvm_based = True
             self.language = 'Java'
@@ -85,6 +91,9 @@ class TestDescriptor:
             else:
                 rel_test_binary = self.descriptor_str_without_attempt_index
                 test_name = None
+            self.rel_test_binary = rel_test_binary
+            # The gtest filter identifying the test within the test program, if any.
+            self.test_name = test_name
 
             # Arguments for run-test.sh.
             # - The absolute path to the test binary (the test descriptor only contains the relative
@@ -98,26 +107,28 @@ class TestDescriptor:
                 output_file_name += '__' + test_name
 
         output_file_name = output_file_name.replace('/', '__')
+        if self.attempt_index > 1:
+            # Keep the error output of every attempt of the test.
+            output_file_name += '__attempt_%d' % self.attempt_index
         self.error_output_path = os.path.join(
-                global_conf.build_root, 'yb-test-logs', output_file_name + '__error.log')
+                global_conf.build_root, 'yb-test-logs', output_file_name + '__error.log.gz')
 
     def __str__(self):
         if self.attempt_index == 1:
             return self.descriptor_str_without_attempt_index
-        return "{}{}{}".format[
+        return "{}{}{}".format(
             self.descriptor_str_without_attempt_index,
             TEST_DESCRIPTOR_ATTEMPT_PREFIX,
-            self.attempt_index
-            ]
+            self.attempt_index)
 
     def with_attempt_index(self, attempt_index):
         assert attempt_index >= 1
         copied = copy.copy(self)
         copied.attempt_index = attempt_index
         # descriptor_str is just the cached version of the string representation, with the
-        # attempt_index included (if it is greater than 1).
-        copied.descriptor_str = str(copied)
-        return copied
+        # attempt_index included (if it is greater than 1). Parse it again to also update the error
+        # output path, which depends on the attempt index.
+        return TestDescriptor(str(copied))
 
 
 class GlobalTestConfig:
@@ -149,7 +160,59 @@ TestResult = collections.namedtuple(
         ['test_descriptor',
          'exit_code',
          'elapsed_time_sec',
-         'failed_without_output'])
+         'failed_without_output',
+         # CPU time of the test and all its child processes, and the maximum resident set size of
+         # any of them. None if unknown.
+         'cpu_time_sec',
+         'max_rss_bytes',
+         # The host the test ran on.
+         'host',
+         # If a speculative copy of the test ran, which copy passed first, and therefore
+         # provided this result: "original" or "speculative_copy". Otherwise None.
+         'speculation_winner'])
+
+
+def sanitize_for_path(s):
+    """
+    This must match sanitize_for_path in common-test-env.sh.
+
+    >>> sanitize_for_path('tests-util/bitmap-test')
+    'tests-util__bitmap-test'
+    >>> sanitize_for_path('TestTablet/5.TestFlush')
+    'TestTablet__5_TestFlush'
+    """
+    return s.replace('/', '__').replace(':', '_').replace('.', '_')
+
+
+def parse_gtest_output(lines):
+    """
+    Finds out what happened to every test in the output of one Google Test program invocation.
+
+    @return a dictionary mapping names of tests that started running to (passed, elapsed time in
+            seconds or None) tuples. A test that started but never finished, e.g. because the test
+            program crashed, is considered failed.
+
+    >>> sorted(parse_gtest_output([
+    ...     '[ RUN      ] A.X', 'some log line', '[       OK ] A.X (1500 ms)',
+    ...     '[ RUN      ] A.Y', '[  FAILED  ] A.Y (20 ms)', '[ RUN      ] B/1.Z',
+    ...     '[  FAILED  ] 1 test, listed below:', '[  FAILED  ] A.Y\\n']).items())
+    [('A.X', (True, 1.5)), ('A.Y', (False, 0.02)), ('B/1.Z', (False, None))]
+    """
+    results = {}
+    for line in lines:
+        match = GTEST_TEST_STATUS_LINE_RE.match(line)
+        if not match:
+            continue
+        status, test_name, elapsed_time_ms = match.groups()
+        if status == 'RUN':
+            results[test_name] = (False, None)
+        elif test_name in results:
+            elapsed_time_sec = results[test_name][1]
+            if elapsed_time_ms is not None:
+                elapsed_time_sec = int(elapsed_time_ms) / 1000.0
+            results[test_name] = (status == 'OK', elapsed_time_sec)
+    return results
+
 
 ClockSyncCheckResult = collections.namedtuple(
         'ClockSyncCheckResult',